@@ -1,3 +1,45 @@
-from .image_annotator import AnnotatedImageData, ImageAnnotator
+from __future__ import annotations
 
-__all__ = ["ImageAnnotator", "AnnotatedImageData"]
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .box_sync import apply_box_delta, apply_box_ops
+    from .image_annotator import AnnotatedImageData, ImageAnnotator
+    from .matching import MatchBudget
+    from .template_matcher import MatchParams, TemplateMatcher
+
+__all__ = [
+    "ImageAnnotator",
+    "AnnotatedImageData",
+    "MatchBudget",
+    "MatchParams",
+    "TemplateMatcher",
+    "apply_box_delta",
+    "apply_box_ops",
+]
+
+# Exported names and their modules, imported on first access so that using
+# the box helpers doesn't import gradio, and the component doesn't import
+# OpenCV
+_EXPORTS = {
+    "ImageAnnotator": ".image_annotator",
+    "AnnotatedImageData": ".image_annotator",
+    "MatchBudget": ".matching",
+    "MatchParams": ".template_matcher",
+    "TemplateMatcher": ".template_matcher",
+    "apply_box_delta": ".box_sync",
+    "apply_box_ops": ".box_sync",
+}
+
+
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import base64
+import re
+import struct
+from typing import Any, List
+
+PACKED_FORMAT = "packed"
+PACKED_VERSION = 1
+
+# Index value used for boxes without a label or a color
+NO_INDEX = 0xFFFF
+
+
+def is_packed(boxes: Any) -> bool:
+    """
+    Check whether `boxes` is a packed payload instead of a list of box dicts.
+    """
+    return isinstance(boxes, dict) and boxes.get("format") == PACKED_FORMAT
+
+
+def _parse_color(color: Any) -> tuple | str | None:
+    """
+    RGB tuple of a color. Other strings, e.g. named colors, are passed through
+    as they are for the frontend to interpret, and other values are dropped
+    so the box gets a default color.
+    """
+    if color is None:
+        return None
+    if isinstance(color, (list, tuple)) and len(color) == 3:
+        try:
+            return tuple(int(c) for c in color)
+        except (TypeError, ValueError):
+            return None
+    if isinstance(color, str):
+        match = re.match(r"rgba?\((\d+), ?(\d+), ?(\d+)", color)
+        if match:
+            return tuple(int(match.group(i)) for i in range(1, 4))
+        if re.fullmatch(r"#[0-9a-fA-F]{6}", color):
+            return tuple(int(color[i : i + 2], 16) for i in (1, 3, 5))
+        return color
+    return None
+
+
+def _encode(fmt: str, values: list) -> str:
+    raw = struct.pack(f"<{len(values)}{fmt}", *values)
+    return base64.b64encode(raw).decode("ascii")
+
+
+def _decode(fmt: str, data: str, count: int) -> tuple:
+    return struct.unpack(f"<{count}{fmt}", base64.b64decode(data))
+
+
+def pack_boxes(boxes: List[dict]) -> dict:
+    """
+    Pack a list of boxes into the compact wire format.
+
+    Coordinates are stored as a base64 little-endian float32 array
+    (`xmin, ymin, xmax, ymax` per box). Labels and colors are deduplicated into
+    a label dictionary and a palette, and every box only stores uint16 indices
+    into them (`0xFFFF` meaning no label / no color). Palette entries are
+    `[r, g, b]` lists, or strings for colors that are not RGB values (e.g.
+    "red"). Box ids, if any, are sent as a plain list.
+
+    ```python
+        {
+            "format": "packed",
+            "version": 1,
+            "count": 2,
+            "coords": "AAB8RQCA1UQAgIhFAAADRQ==...",
+            "labels": ["1", "2"],
+            "label_ids": "AAABAA==",
+            "palette": [[255, 0, 0], [0, 106, 219]],
+            "color_ids": "AAABAA==",
+        }
+    ```
+    """
+    labels, label_lookup = [], {}
+    palette, palette_lookup = [], {}
+    coords, label_ids, color_ids = [], [], []
+    ids = []
+
+    for box in boxes:
+        ids.append(box.get("id"))
+        coords.extend((box["xmin"], box["ymin"], box["xmax"], box["ymax"]))
+
+        label = box.get("label")
+        if label is None:
+            label_ids.append(NO_INDEX)
+        else:
+            if label not in label_lookup:
+                label_lookup[label] = len(labels)
+                labels.append(label)
+            label_ids.append(label_lookup[label])
+
+        color = _parse_color(box.get("color"))
+        if color is None:
+            color_ids.append(NO_INDEX)
+        else:
+            if color not in palette_lookup:
+                palette_lookup[color] = len(palette)
+                palette.append(color if isinstance(color, str) else list(color))
+            color_ids.append(palette_lookup[color])
+
+    if len(labels) >= NO_INDEX or len(palette) >= NO_INDEX:
+        raise ValueError(
+            f"Too many distinct labels or colors to pack (max {NO_INDEX - 1})"
+        )
+
+    packed = {
+        "format": PACKED_FORMAT,
+        "version": PACKED_VERSION,
+        "count": len(boxes),
+        "coords": _encode("f", coords),
+        "labels": labels,
+        "label_ids": _encode("H", label_ids),
+        "palette": palette,
+        "color_ids": _encode("H", color_ids),
+    }
+    if any(box_id is not None for box_id in ids):
+        packed["ids"] = ids
+    return packed
+
+
+def unpack_boxes(packed: dict) -> List[dict]:
+    """
+    Unpack a payload created by `pack_boxes` (or by the frontend) back into a
+    list of box dicts with image coordinates.
+    """
+    if packed.get("version", PACKED_VERSION) != PACKED_VERSION:
+        raise ValueError(f"Unsupported packed boxes version {packed.get('version')}")
+
+    count = int(packed.get("count", 0))
+    if count == 0:
+        return []
+
+    coords = _decode("f", packed["coords"], count * 4)
+    label_ids = _decode("H", packed["label_ids"], count)
+    color_ids = _decode("H", packed["color_ids"], count)
+    labels = packed.get("labels", [])
+    palette = packed.get("palette", [])
+    ids = packed.get("ids")
+
+    boxes = []
+    for i in range(count):
+        box = {}
+        if label_ids[i] != NO_INDEX:
+            box["label"] = labels[label_ids[i]]
+        if color_ids[i] != NO_INDEX:
+            color = palette[color_ids[i]]
+            box["color"] = color if isinstance(color, str) else tuple(color)
+        box["xmin"], box["ymin"], box["xmax"], box["ymax"] = coords[i * 4 : i * 4 + 4]
+        if ids is not None and ids[i] is not None:
+            box["id"] = ids[i]
+        boxes.append(box)
+    return boxes
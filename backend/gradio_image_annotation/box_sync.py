@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+from typing import List
+
+VALID_OPS = ("add", "update", "delete")
+
+
+def apply_box_ops(boxes: List[dict], ops: List[dict]) -> List[dict]:
+    """
+    Apply a list of box operations sent by the frontend in "delta" sync mode.
+
+    Boxes are matched by their `id`. "add" and "update" replace the box with
+    that id (or insert it if it is unknown) and "delete" removes it if present,
+    so applying the same operations twice is harmless. New boxes are placed
+    first, as the frontend does.
+
+    ```python
+        [
+            {"op": "add", "id": "k3j2", "box": {"label": "1", "xmin": 10, ...}},
+            {"op": "update", "id": "a81c", "box": {"label": "2", "xmin": 42, ...}},
+            {"op": "delete", "id": "9f0e"},
+        ]
+    ```
+
+    The list is updated in place and also returned.
+    """
+    index = {box.get("id"): i for i, box in enumerate(boxes) if "id" in box}
+    added = {}
+    deleted = set()
+
+    for op in ops:
+        kind = op.get("op")
+        if kind not in VALID_OPS:
+            raise ValueError(f"Invalid box operation {op}")
+        box_id = op["id"]
+        if kind == "delete":
+            added.pop(box_id, None)
+            if box_id in index:
+                deleted.add(index[box_id])
+            continue
+
+        box = dict(op["box"])
+        box["id"] = box_id
+        if box_id in index and index[box_id] not in deleted:
+            boxes[index[box_id]] = box
+        else:
+            added.pop(box_id, None)
+            added[box_id] = box
+
+    kept = [box for i, box in enumerate(boxes) if i not in deleted]
+    boxes[:] = list(reversed(added.values())) + kept
+    return boxes
+
+
+def apply_box_delta(state: dict, delta: dict) -> bool:
+    """
+    Apply the operations of a delta payload (`{"version": ..., "ops": [...]}`)
+    to a stored image state with a "boxes" list.
+
+    Deltas older than or equal to the stored `version` are ignored. Returns
+    whether the delta was applied.
+    """
+    version = delta.get("version", 0)
+    if version <= state.get("version", 0):
+        return False
+    apply_box_ops(state.setdefault("boxes", []), delta.get("ops") or [])
+    state["version"] = version
+    return True
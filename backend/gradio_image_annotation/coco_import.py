@@ -0,0 +1,261 @@
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+from functools import partial
+from typing import IO, Iterator, List, Tuple
+
+INDEX_VERSION = "1"
+SECTIONS = ("images", "annotations", "categories")
+_CHUNK_SIZE = 1 << 20
+_BATCH_SIZE = 10000
+_WHITESPACE = " \t\n\r"
+
+
+class _StreamReader:
+    """
+    Minimal streaming reader over a JSON text file, decoding one value at a
+    time with `json.JSONDecoder.raw_decode` so the whole file is never loaded.
+    """
+
+    def __init__(self, f: IO[str]):
+        self.f = f
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.f.read(_CHUNK_SIZE)
+        if not chunk:
+            self.eof = True
+            return False
+        # Drop the consumed part of the buffer
+        self.buf = self.buf[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON file")
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos} of the buffer")
+        self.pos += 1
+
+    def skip_if(self, char: str) -> bool:
+        if self.peek() == char:
+            self.pos += 1
+            return True
+        return False
+
+    def decode(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number may have been cut at the end of the buffer
+            if end == len(self.buf) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_coco_sections(f: IO[str]) -> Iterator[Tuple[str, dict]]:
+    """
+    Stream the elements of the top-level "images", "annotations" and
+    "categories" arrays of a COCO file as `(section, element)` pairs. Other
+    top-level keys are skipped.
+    """
+    reader = _StreamReader(f)
+    reader.expect("{")
+    while not reader.skip_if("}"):
+        key = reader.decode()
+        reader.expect(":")
+        if key in SECTIONS and reader.skip_if("["):
+            while not reader.skip_if("]"):
+                yield key, reader.decode()
+                reader.skip_if(",")
+        else:
+            reader.decode()
+        reader.skip_if(",")
+
+
+class CocoIndex:
+    """
+    Lazily loaded COCO annotation file.
+
+    The first time a file is opened, it is streamed once into a SQLite index
+    (`<annotation file>.index.sqlite` by default) with a table of images and a
+    table of annotations indexed by image id. The index is rebuilt when the
+    size or the modification time of the annotation file change. The boxes of
+    an image are then read from the index on demand.
+
+    ```python
+        index = CocoIndex("instances_train.json", image_dir="images/")
+        current_loaded_images = dict(index.entries())
+        prepare_annotate_data(current_loaded_images["000001.jpg"])  # loads the boxes
+    ```
+    """
+
+    def __init__(
+        self,
+        annotation_path: str,
+        image_dir: str | None = None,
+        index_path: str | None = None,
+    ):
+        self.annotation_path = annotation_path
+        self.image_dir = image_dir or os.path.dirname(os.path.abspath(annotation_path))
+        self.index_path = index_path or f"{annotation_path}.index.sqlite"
+        self._lock = threading.Lock()
+
+        if self.is_stale():
+            self.build()
+        self._conn = sqlite3.connect(self.index_path, check_same_thread=False)
+        self._categories = dict(self._conn.execute("SELECT id, name FROM categories"))
+
+    def _source_signature(self) -> str:
+        stat = os.stat(self.annotation_path)
+        return f"{INDEX_VERSION}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    def is_stale(self) -> bool:
+        if not os.path.exists(self.index_path):
+            return True
+        try:
+            with sqlite3.connect(self.index_path) as conn:
+                row = conn.execute(
+                    "SELECT value FROM meta WHERE key = 'signature'"
+                ).fetchone()
+        except sqlite3.DatabaseError:
+            return True
+        return row is None or row[0] != self._source_signature()
+
+    def build(self):
+        """
+        Stream the annotation file into a new index, replacing the old one.
+        """
+        tmp_path = f"{self.index_path}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+        conn = sqlite3.connect(tmp_path)
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.executescript(
+            """
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE images (
+                id INTEGER PRIMARY KEY, file_name TEXT, width INTEGER, height INTEGER
+            );
+            CREATE TABLE annotations (
+                image_id INTEGER, category_id INTEGER,
+                x REAL, y REAL, w REAL, h REAL
+            );
+            CREATE TABLE categories (id INTEGER PRIMARY KEY, name TEXT);
+            """
+        )
+
+        queries = {
+            "images": "INSERT INTO images VALUES (?, ?, ?, ?)",
+            "annotations": "INSERT INTO annotations VALUES (?, ?, ?, ?, ?, ?)",
+            "categories": "INSERT INTO categories VALUES (?, ?)",
+        }
+        rows = {section: [] for section in SECTIONS}
+
+        def flush(section):
+            conn.executemany(queries[section], rows[section])
+            rows[section].clear()
+
+        with open(self.annotation_path, "r", encoding="utf8") as f:
+            for section, element in iter_coco_sections(f):
+                if section == "images":
+                    row = (
+                        element["id"],
+                        element["file_name"],
+                        element.get("width"),
+                        element.get("height"),
+                    )
+                elif section == "annotations":
+                    row = (element["image_id"], element["category_id"], *element["bbox"])
+                else:
+                    row = (element["id"], element["name"])
+                rows[section].append(row)
+                if len(rows[section]) >= _BATCH_SIZE:
+                    flush(section)
+
+        for section in SECTIONS:
+            flush(section)
+        # Creating the index after the inserts is much faster
+        conn.execute("CREATE INDEX annotations_image_id ON annotations (image_id)")
+        conn.execute(
+            "INSERT INTO meta VALUES ('signature', ?)", (self._source_signature(),)
+        )
+        conn.commit()
+        conn.close()
+        os.replace(tmp_path, self.index_path)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def images(self, offset: int = 0, limit: int = -1) -> List[Tuple[int, str, int, int]]:
+        """
+        `(id, file_name, width, height)` of the images, ordered by id.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, file_name, width, height FROM images "
+                "ORDER BY id LIMIT ? OFFSET ?",
+                (limit, offset),
+            ).fetchall()
+
+    def boxes(self, image_id: int) -> List[dict]:
+        """
+        Boxes of an image in the `ImageAnnotator` format.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT category_id, x, y, w, h FROM annotations WHERE image_id = ?",
+                (image_id,),
+            ).fetchall()
+        return [
+            {
+                "label": self._categories.get(category_id, str(category_id)),
+                "xmin": round(x),
+                "ymin": round(y),
+                "xmax": round(x + w),
+                "ymax": round(y + h),
+            }
+            for category_id, x, y, w, h in rows
+        ]
+
+    def entries(self, offset: int = 0, limit: int = -1) -> Iterator[Tuple[str, dict]]:
+        """
+        `(file name, image data)` pairs in the format of the demo's loaded
+        images. The boxes are not read yet: the image data has a "load_boxes"
+        callable used by `prepare_annotate_data` when the image is shown.
+        """
+        for image_id, file_name, _, _ in self.images(offset, limit):
+            yield file_name, {
+                "file_path": os.path.join(self.image_dir, file_name),
+                "calibration_ratio": [0, 0],
+                "load_boxes": partial(self.boxes, image_id),
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
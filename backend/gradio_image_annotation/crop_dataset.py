@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+from typing import Iterable, List, Tuple
+
+import cv2
+
+from .utils import bounded_map, get_image_boxes, iter_entries
+
+CROP_FORMATS = ("png", "jpg")
+MANIFEST_NAME = "manifest.jsonl"
+
+_UNSAFE_CHARS = re.compile(r"[^\w.-]+")
+
+
+def crop_file_name(
+    x: int, y: int, w: int, h: int, prefix: str = "", ext: str = "png"
+) -> str:
+    """
+    File name of the crop of a box. The coordinates are separated, so two
+    different boxes never get the same name (unlike "1" "23" and "12" "3").
+    """
+    name = f"{x}_{y}_{w}_{h}.{ext}"
+    return f"{prefix}_{name}" if prefix else name
+
+
+def _safe_name(name: str) -> str:
+    return _UNSAFE_CHARS.sub("_", name).strip("._") or "_"
+
+
+def _crop_rect(
+    box: dict, width: int, height: int, padding: int
+) -> Tuple[int, int, int, int] | None:
+    """
+    (x, y, w, h) of a box grown by `padding` and clipped to the image, None
+    when nothing is left.
+    """
+    xmin = max(round(box["xmin"]) - padding, 0)
+    ymin = max(round(box["ymin"]) - padding, 0)
+    xmax = min(round(box["xmax"]) + padding, width)
+    ymax = min(round(box["ymax"]) + padding, height)
+    if xmax <= xmin or ymax <= ymin:
+        return None
+    return xmin, ymin, xmax - xmin, ymax - ymin
+
+
+def _write_crops(item) -> List[dict]:
+    name, file_path, prefix, boxes, output_dir, padding, crop_format = item
+    image = cv2.imread(file_path)
+    if image is None:
+        return [{"image": name, "error": f"Could not read {file_path}"}]
+    height, width = image.shape[:2]
+
+    rows = []
+    written = set()
+    for label, label_dir, box in boxes:
+        rect = _crop_rect(box, width, height, padding)
+        if rect is None:
+            rows.append({"image": name, "label": label, "error": "Empty box"})
+            continue
+        x, y, w, h = rect
+        path = os.path.join(label_dir, crop_file_name(x, y, w, h, prefix, crop_format))
+        # Identical boxes of an image share a crop
+        if path not in written:
+            cv2.imwrite(os.path.join(output_dir, path), image[y : y + h, x : x + w])
+            written.add(path)
+        rows.append(
+            {
+                "path": path,
+                "image": name,
+                "label": label,
+                "box": [round(box[key]) for key in ("xmin", "ymin", "xmax", "ymax")],
+                "rect": [x, y, w, h],
+            }
+        )
+    return rows
+
+
+def build_crop_dataset(
+    entries,
+    output_dir: str,
+    labels: Iterable[str] | None = None,
+    exclude_labels: Iterable[str] = ("ignore",),
+    padding: int = 0,
+    crop_format: str = "png",
+    workers: int = 4,
+) -> dict:
+    """
+    Save the crop of every annotated box in `output_dir/<label>/`, e.g. to
+    train a classifier, with a `manifest.jsonl` of one line per box.
+
+    See `export_coco` for `entries`. Each image is decoded once and its crops
+    are written by a pool of `workers` threads, a few images at a time, so
+    memory doesn't grow with the number of images. Crop names are made of the
+    image name and the crop coordinates, see `crop_file_name`.
+
+    :param labels: Only crop the boxes with these labels.
+    :param exclude_labels: Never crop the boxes with these labels.
+    :param padding: Pixels added around each box, within the image.
+    :param crop_format: "png" or "jpg".
+    :return: The number of images, crops and errors (unreadable images and
+        boxes outside of their image).
+    """
+    if crop_format not in CROP_FORMATS:
+        raise ValueError(
+            f"Invalid crop format: {crop_format}. Please choose from one of: {CROP_FORMATS}"
+        )
+    labels = set(labels) if labels is not None else None
+    exclude_labels = set(exclude_labels)
+    os.makedirs(output_dir, exist_ok=True)
+
+    prefixes = set()
+    label_dirs = {}  # label -> folder name
+
+    def unique(name: str, taken) -> str:
+        unique_name, n = name, 1
+        while unique_name in taken:
+            n += 1
+            unique_name = f"{name}-{n}"
+        return unique_name
+
+    def items():
+        for name, image_data in iter_entries(entries):
+            boxes = []
+            for box in get_image_boxes(image_data, cache=False):
+                label = str(box.get("label", ""))
+                if label in exclude_labels or (labels is not None and label not in labels):
+                    continue
+                if label not in label_dirs:
+                    # Labels that only differ by unsafe characters get their own folder
+                    label_dir = unique(_safe_name(label), label_dirs.values())
+                    os.makedirs(os.path.join(output_dir, label_dir), exist_ok=True)
+                    label_dirs[label] = label_dir
+                boxes.append((label, label_dirs[label], box))
+            if not boxes:
+                continue
+
+            # Images with the same stem, e.g. "a.png" and "a.jpg", get their own prefix
+            stem = os.path.splitext(os.path.basename(name))[0]
+            prefix = unique(_safe_name(stem), prefixes)
+            prefixes.add(prefix)
+            yield (
+                name,
+                image_data["file_path"],
+                prefix,
+                boxes,
+                output_dir,
+                padding,
+                crop_format,
+            )
+
+    counts = {"images": 0, "crops": 0, "errors": 0}
+    with open(os.path.join(output_dir, MANIFEST_NAME), "w", encoding="utf8") as manifest:
+        for rows in bounded_map(_write_crops, items(), workers):
+            counts["images"] += 1
+            for row in rows:
+                if "error" in row:
+                    counts["errors"] += 1
+                else:
+                    counts["crops"] += 1
+                manifest.write(json.dumps(row) + "\n")
+    return counts
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import os
+import threading
+from typing import TYPE_CHECKING, Dict, Iterator, List, Tuple
+
+if TYPE_CHECKING:
+    from .metadata_index import ImageMetadataIndex
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+class DirectorySource:
+    """
+    Images of a folder on the server, listed lazily page by page.
+
+    The folder is scanned with `os.scandir` only as far as the pages asked for,
+    in directory order, so opening a large folder doesn't wait for a full
+    listing. Nothing is uploaded or copied: the image data points to the
+    files in place.
+
+    Images are named by their path relative to the folder.
+
+    With a `metadata_index` of the folder, the size, orientation and format of
+    the images of each page are looked up in it as the page is listed, and
+    added to their image data under "metadata". Only the headers of images
+    not indexed yet, or changed, are read.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        page_size: int = 100,
+        extensions: Tuple[str, ...] = IMAGE_EXTENSIONS,
+        recursive: bool = False,
+        metadata_index: ImageMetadataIndex | None = None,
+    ):
+        if not os.path.isdir(path):
+            raise ValueError(f"{path} is not a directory")
+        if page_size < 1:
+            raise ValueError(f"page_size must be positive, got {page_size}")
+        self.path = os.path.abspath(path)
+        self.page_size = page_size
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.recursive = recursive
+        self.metadata_index = metadata_index
+        self._metadata: Dict[str, dict | None] = {}
+        self._names: List[str] = []
+        self._positions = {}
+        self._scanner = self._scan()
+        self._complete = False
+        self._lock = threading.Lock()
+
+    def _scan(self) -> Iterator[str]:
+        folders = [self.path]
+        while folders:
+            folder = folders.pop()
+            try:
+                with os.scandir(folder) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            if self.recursive:
+                                folders.append(entry.path)
+                        elif entry.name.lower().endswith(self.extensions):
+                            yield os.path.relpath(entry.path, self.path)
+            except PermissionError:
+                continue
+
+    def _scan_until(self, count: int):
+        with self._lock:
+            while not self._complete and len(self._names) < count:
+                name = next(self._scanner, None)
+                if name is None:
+                    self._complete = True
+                    break
+                self._positions[name] = len(self._names)
+                self._names.append(name)
+
+    @property
+    def is_complete(self) -> bool:
+        """
+        Whether the whole folder has been scanned.
+        """
+        return self._complete
+
+    @property
+    def scanned_count(self) -> int:
+        return len(self._names)
+
+    def page(self, page: int) -> List[str]:
+        """
+        Names of the images of a page, scanning the folder up to it if needed.
+        Empty past the last page.
+        """
+        start = page * self.page_size
+        self._scan_until(start + self.page_size)
+        names = self._names[start : start + self.page_size]
+        if self.metadata_index is not None:
+            missing = [name for name in names if name not in self._metadata]
+            if missing:
+                self._metadata.update(
+                    zip(missing, self.metadata_index.lookup(missing))
+                )
+        return names
+
+    def has_page(self, page: int) -> bool:
+        self._scan_until(page * self.page_size + 1)
+        return len(self._names) > page * self.page_size
+
+    def page_of(self, name: str) -> int:
+        """
+        Page of an image already scanned.
+        """
+        if name not in self._positions:
+            raise ValueError(f"{name} has not been scanned from {self.path}")
+        return self._positions[name] // self.page_size
+
+    def file_path(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def metadata(self, name: str) -> dict | None:
+        """
+        Metadata of an image of a listed page, see `ImageMetadataIndex.get`.
+        None without a `metadata_index`, or if the image can't be read.
+        """
+        return self._metadata.get(name)
+
+    def image_data(self, name: str) -> dict:
+        """
+        Image data in the format of the demo's loaded images.
+        """
+        image_data = {
+            "file_path": self.file_path(name),
+            "calibration_ratio": [0, 0],  # [width, height]
+            "boxes": [],
+        }
+        metadata = self.metadata(name)
+        if metadata is not None:
+            image_data["metadata"] = metadata
+        return image_data
@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import tempfile
+import xml.etree.ElementTree as ET
+from typing import List, Tuple
+
+import PIL.Image
+
+from .utils import bounded_map, get_image_boxes, iter_entries
+
+# EXIF orientations that swap the width and the height of the displayed image
+_TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+class LabelMap:
+    """
+    Stable mapping from label names to integer ids.
+
+    Ids are assigned in the order labels are first seen, after the ones given
+    in `labels`. Save it and load it again to keep the same ids across exports.
+    """
+
+    def __init__(self, labels: List[str] | None = None, start: int = 0):
+        self.start = start
+        self.ids = {}
+        for label in labels or []:
+            self.id(label)
+
+    def id(self, label: str) -> int:
+        if label not in self.ids:
+            self.ids[label] = self.start + len(self.ids)
+        return self.ids[label]
+
+    def names(self) -> List[str]:
+        """
+        Label names sorted by id.
+        """
+        return sorted(self.ids, key=self.ids.get)
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf8") as f:
+            json.dump({"start": self.start, "labels": self.names()}, f)
+
+    @classmethod
+    def load(cls, path: str) -> "LabelMap":
+        with open(path, "r", encoding="utf8") as f:
+            data = json.load(f)
+        return cls(data["labels"], start=data.get("start", 0))
+
+
+def read_image_size(path: str) -> Tuple[int, int]:
+    """
+    Read the displayed (width, height) of an image from its header only,
+    taking the EXIF orientation into account.
+    """
+    with PIL.Image.open(path) as im:
+        width, height = im.size
+        if im.getexif().get(274, 1) in _TRANSPOSED_ORIENTATIONS:
+            width, height = height, width
+    return width, height
+
+
+def _image_size(image_data: dict) -> Tuple[int, int]:
+    # Already read from the header by a metadata index, see `DirectorySource`
+    metadata = image_data.get("metadata")
+    if metadata is not None:
+        return metadata["width"], metadata["height"]
+    return read_image_size(image_data["file_path"])
+
+
+def _annotation_path(output_dir: str, name: str, ext: str) -> str:
+    # Names of a recursive DirectorySource have subfolders, mirrored here
+    path = os.path.join(output_dir, os.path.splitext(name)[0] + ext)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def _box_rect(box: dict) -> Tuple[float, float, float, float]:
+    return box["xmin"], box["ymin"], box["xmax"] - box["xmin"], box["ymax"] - box["ymin"]
+
+
+def export_coco(
+    entries,
+    output_path: str,
+    label_map: LabelMap | None = None,
+    workers: int = 4,
+) -> LabelMap:
+    """
+    Export the annotations to a COCO JSON file.
+
+    `entries` is a dict (or an iterable of pairs) of image name to image data
+    with a "file_path" and a list of "boxes" (or a lazy "load_boxes"), like
+    `current_loaded_images` in the demo. Images and annotations are written as
+    they are read, the annotations being spooled to a temporary file, so
+    memory doesn't grow with the number of images. Image sizes are read in
+    parallel.
+
+    Returns the label map used for the category ids (starting at 1 by default).
+    """
+    if label_map is None:
+        label_map = LabelMap(start=1)
+
+    def read(entry):
+        name, image_data = entry
+        return name, image_data, _image_size(image_data)
+
+    annotation_id = 0
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    with open(output_path, "w", encoding="utf8") as f, tempfile.TemporaryFile(
+        "w+", encoding="utf8", dir=output_dir
+    ) as annotations:
+        f.write('{"images": [')
+        for image_id, (name, image_data, (width, height)) in enumerate(
+            bounded_map(read, iter_entries(entries), workers), start=1
+        ):
+            image = {"id": image_id, "file_name": name, "width": width, "height": height}
+            f.write(("," if image_id > 1 else "") + json.dumps(image))
+
+            for box in get_image_boxes(image_data, cache=False):
+                x, y, w, h = _box_rect(box)
+                annotation_id += 1
+                annotation = {
+                    "id": annotation_id,
+                    "image_id": image_id,
+                    "category_id": label_map.id(box.get("label", "")),
+                    "bbox": [x, y, w, h],
+                    "area": w * h,
+                    "iscrowd": 0,
+                }
+                annotations.write(
+                    ("," if annotation_id > 1 else "") + json.dumps(annotation)
+                )
+
+        f.write('], "annotations": [')
+        annotations.seek(0)
+        shutil.copyfileobj(annotations, f)
+        categories = [
+            {"id": label_map.id(label), "name": label} for label in label_map.names()
+        ]
+        f.write('], "categories": ' + json.dumps(categories) + "}")
+
+    return label_map
+
+
+def _write_yolo(item) -> str:
+    name, image_data, output_dir, rows = item
+    width, height = _image_size(image_data)
+    path = _annotation_path(output_dir, name, ".txt")
+    with open(path, "w", encoding="utf8") as f:
+        for class_id, (x, y, w, h) in rows:
+            f.write(
+                f"{class_id} {(x + w / 2) / width:.6f} {(y + h / 2) / height:.6f} "
+                f"{w / width:.6f} {h / height:.6f}\n"
+            )
+    return path
+
+
+def export_yolo(
+    entries,
+    output_dir: str,
+    label_map: LabelMap | None = None,
+    workers: int = 4,
+) -> LabelMap:
+    """
+    Export the annotations to YOLO txt files, one per image, and a
+    `classes.txt` with the label names in id order. Images are written in
+    parallel. See `export_coco` for `entries`.
+    """
+    if label_map is None:
+        label_map = LabelMap()
+    os.makedirs(output_dir, exist_ok=True)
+
+    def items():
+        for name, image_data in iter_entries(entries):
+            # Ids are assigned here, in order, so they don't depend on the workers
+            rows = [
+                (label_map.id(box.get("label", "")), _box_rect(box))
+                for box in get_image_boxes(image_data, cache=False)
+            ]
+            yield name, image_data, output_dir, rows
+
+    for _ in bounded_map(_write_yolo, items(), workers):
+        pass
+
+    with open(os.path.join(output_dir, "classes.txt"), "w", encoding="utf8") as f:
+        f.write("".join(f"{label}\n" for label in label_map.names()))
+    return label_map
+
+
+def _write_voc(item) -> str:
+    name, image_data, output_dir = item
+    width, height = _image_size(image_data)
+
+    root = ET.Element("annotation")
+    ET.SubElement(root, "filename").text = name
+    ET.SubElement(root, "path").text = image_data["file_path"]
+    size = ET.SubElement(root, "size")
+    ET.SubElement(size, "width").text = str(width)
+    ET.SubElement(size, "height").text = str(height)
+    ET.SubElement(size, "depth").text = "3"
+    for box in get_image_boxes(image_data, cache=False):
+        obj = ET.SubElement(root, "object")
+        ET.SubElement(obj, "name").text = str(box.get("label", ""))
+        ET.SubElement(obj, "difficult").text = "0"
+        bndbox = ET.SubElement(obj, "bndbox")
+        for key in ("xmin", "ymin", "xmax", "ymax"):
+            ET.SubElement(bndbox, key).text = str(round(box[key]))
+
+    path = _annotation_path(output_dir, name, ".xml")
+    ET.ElementTree(root).write(path, encoding="utf-8")
+    return path
+
+
+def export_voc(entries, output_dir: str, workers: int = 4):
+    """
+    Export the annotations to Pascal VOC XML files, one per image. Images are
+    written in parallel. See `export_coco` for `entries`.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    items = (
+        (name, image_data, output_dir)
+        for name, image_data in iter_entries(entries)
+    )
+    for _ in bounded_map(_write_voc, items, workers):
+        pass
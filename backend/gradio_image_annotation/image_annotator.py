@@ -1,9 +1,11 @@
 from __future__ import annotations
 
+import os
 import re
+import uuid
 import warnings
 from pathlib import Path
-from typing import Any, List, Literal, cast
+from typing import Any, List, Literal, Optional, Union, cast
 
 import PIL.Image
 from gradio import image_utils, utils
@@ -12,7 +14,36 @@ from gradio.data_classes import FileData, GradioModel
 from gradio.events import EventListener, Events
 from PIL import ImageOps
 
-PIL.Image.init()  # fixes https://github.com/gradio-app/gradio/issues/2843
+from . import metrics
+from .box_codec import is_packed, pack_boxes, unpack_boxes
+from .metrics import BOXES, BYTES_STAGED, CALL_SECONDS, timed
+
+
+# Options that need support in the compiled frontend (`templates/`). The
+# shipped bundle was built before them, add each one here once the bundle is
+# rebuilt with `gradio cc build`
+BUNDLE_FEATURES: frozenset = frozenset()
+
+
+def _require_bundle_feature(feature: str, parameter: str):
+    if feature not in BUNDLE_FEATURES:
+        raise ValueError(
+            f"Parameter `{parameter}` needs the '{feature}' support of the "
+            "frontend, which the bundled templates don't include yet. Rebuild "
+            "them with `gradio cc build`"
+        )
+
+
+def _init_pil(suffix: str):
+    """
+    Register the Pillow plugins needed for images of `suffix`. Only the common
+    formats are loaded first, all the plugins are loaded the first time
+    another format is seen. Fixes https://github.com/gradio-app/gradio/issues/2843
+    without loading every plugin at import.
+    """
+    PIL.Image.preinit()
+    if f".{suffix.lower()}" not in PIL.Image.EXTENSION:
+        PIL.Image.init()
 
 
 class CustomEvents(Events):
@@ -24,8 +55,10 @@ class CustomEvents(Events):
 
 class AnnotatedImageData(GradioModel):
     image: FileData
-    boxes: List[dict] = []
+    boxes: Union[List[dict], dict] = []
     calibration_ratio: List[float] = [0, 0]
+    ops: Optional[List[dict]] = None
+    version: int = 0
 
 
 def rgb2hex(r, g, b):
@@ -90,6 +123,10 @@ class ImageAnnotator(Component):
         show_clear_button: bool | None = True,
         show_remove_button: bool | None = None,
         handles_cursor: bool | None = True,
+        boxes_format: Literal["json", "packed"] = "json",
+        sync_mode: Literal["full", "delta"] = "full",
+        offscreen_rendering: bool = False,
+        max_side: int | None = None,
     ):
         """
         Parameters:
@@ -122,7 +159,11 @@ class ImageAnnotator(Component):
             show_share_button: If True, will show a share icon in the corner of the component that allows user to share outputs to Hugging Face Spaces Discussions. If False, icon does not appear. If set to None (default behavior), then the icon appears if this Gradio app is launched on Spaces, but not otherwise.
             show_clear_button: If True, will show a button to clear the current image.
             show_remove_button: If True, will show a button to remove the selected bounding box.
-            handles_cursor: If True, the cursor will change when hovering over box handles in drag mode. Can be CPU-intensive.
+            handles_cursor: If True, the cursor will change when hovering over box handles in drag mode. Only the boxes near the pointer are checked.
+            boxes_format: The wire format used to send the boxes between the frontend and the backend. "json" sends a list of box dicts, "packed" sends a compact encoding with base64 float32 coordinates, a label dictionary and a color palette, which is much smaller for images with thousands of boxes. The boxes passed to and returned from the prediction function are always a list of dicts. "packed" needs a rebuilt frontend bundle, see `BUNDLE_FEATURES`.
+            sync_mode: How box edits are sent to the backend. "full" sends every box on each change. "delta" only sends the add/update/delete operations since the last value set by the backend, with a stable 'id' per box and an increasing 'version'; the prediction function then receives the keys 'ops' and 'version' instead of 'boxes' and can apply them to its stored boxes with `apply_box_delta`. A payload without operations, e.g. from a frontend build without delta support, is passed on with its full 'boxes' as in "full" mode.
+            offscreen_rendering: If True, the boxes are rasterized in a Web Worker on an OffscreenCanvas, keeping the main thread free for pointer handling. Falls back to rendering on the main thread if the browser doesn't support OffscreenCanvas. Needs a rebuilt frontend bundle, see `BUNDLE_FEATURES`.
+            max_side: If set, images larger than `max_side` pixels on their longest side are downscaled to it before being passed to the prediction function, decoding JPEGs directly at a reduced resolution. The boxes are scaled to the downscaled image and the scale used is passed in the key 'scale' (divide by it to get coordinates in the original image).
         """
 
         valid_types = ["numpy", "pil", "filepath"]
@@ -131,6 +172,25 @@ class ImageAnnotator(Component):
                 f"Invalid value for parameter `type`: {type}. Please choose from one of: {valid_types}"
             )
         self.image_type = image_type
+        valid_boxes_formats = ["json", "packed"]
+        if boxes_format not in valid_boxes_formats:
+            raise ValueError(
+                f"Invalid value for parameter `boxes_format`: {boxes_format}. Please choose from one of: {valid_boxes_formats}"
+            )
+        if boxes_format == "packed":
+            _require_bundle_feature("packed_boxes", "boxes_format")
+        self.boxes_format = boxes_format
+        valid_sync_modes = ["full", "delta"]
+        if sync_mode not in valid_sync_modes:
+            raise ValueError(
+                f"Invalid value for parameter `sync_mode`: {sync_mode}. Please choose from one of: {valid_sync_modes}"
+            )
+        self.sync_mode = sync_mode
+        if max_side is not None and max_side < 1:
+            raise ValueError(
+                f"Invalid value for parameter `max_side`: {max_side}. It must be a positive number of pixels"
+            )
+        self.max_side = max_side
         self.height = height
         self.width = width
         self.image_mode = image_mode
@@ -157,6 +217,9 @@ class ImageAnnotator(Component):
         self.show_clear_button = show_clear_button
         self.show_remove_button = show_remove_button
         self.handles_cursor = handles_cursor
+        if offscreen_rendering:
+            _require_bundle_feature("offscreen_rendering", "offscreen_rendering")
+        self.offscreen_rendering = offscreen_rendering
 
         self.boxes_alpha = boxes_alpha
         self.box_min_size = box_min_size
@@ -214,8 +277,59 @@ class ImageAnnotator(Component):
         Returns:
             str | None: The preprocessed image as a string or None if the input image is None.
         """
+        return self._preprocess_image(image)[0]
+
+    def _open_image(self, file_path: Path) -> tuple[PIL.Image.Image, float]:
+        """
+        Open an image, downscaled so its longest side is at most `max_side`.
+
+        JPEGs are decoded at 1/2, 1/4 or 1/8 of their resolution when possible
+        (draft mode), and the image is reduced by an integer factor before the
+        final resize, so a large image is never decoded at full resolution.
+
+        Returns:
+            The image, transposed according to its EXIF orientation, and the
+            scale applied to it.
+        """
+        im = PIL.Image.open(file_path)
+        scale = 1.0
+        if self.max_side is not None and max(im.size) > self.max_side:
+            scale = self.max_side / max(im.size)
+            if im.format == "JPEG":
+                # Only changes the decoder, the image is not loaded yet
+                im.draft(
+                    self.image_mode if self.image_mode in ("RGB", "L") else None,
+                    (round(im.width * scale), round(im.height * scale)),
+                )
+
+        exif = im.getexif()
+        # 274 is the code for image rotation and 1 means "correct orientation"
+        if exif.get(274, 1) != 1 and hasattr(ImageOps, "exif_transpose"):
+            try:
+                im = ImageOps.exif_transpose(im)
+            except Exception:
+                warnings.warn(
+                    f"Failed to transpose image {file_path} based on EXIF data."
+                )
+
+        if scale != 1.0:
+            # Sides of the (possibly transposed) original image, scaled
+            ratio = self.max_side / max(im.size)
+            size = (max(round(im.width * ratio), 1), max(round(im.height * ratio), 1))
+            if im.mode in ("1", "P"):
+                # Pixels can't be averaged in these modes
+                im = im.convert("RGBA" if "transparency" in im.info else "RGB")
+            factor = min(im.width // size[0], im.height // size[1])
+            if factor >= 2:
+                im = im.reduce(factor)
+            if im.size != size:
+                im = im.resize(size, PIL.Image.BILINEAR)
+        return im, scale
+
+    @timed(CALL_SECONDS, method="preprocess_image")
+    def _preprocess_image(self, image: FileData | None) -> tuple[Any, float]:
         if image is None:
-            return None
+            return None, 1.0
         file_path = Path(image.path)
         if image.orig_name:
             p = Path(image.orig_name)
@@ -228,47 +342,61 @@ class ImageAnnotator(Component):
             suffix = "png"
 
         if suffix.lower() == "svg":
-            return str(file_path)
+            return str(file_path), 1.0
 
-        im = PIL.Image.open(file_path)
-        exif = im.getexif()
-        # 274 is the code for image rotation and 1 means "correct orientation"
-        if exif.get(274, 1) != 1 and hasattr(ImageOps, "exif_transpose"):
-            try:
-                im = ImageOps.exif_transpose(im)
-            except Exception:
-                warnings.warn(
-                    f"Failed to transpose image {file_path} based on EXIF data."
-                )
+        _init_pil(suffix)
+        if metrics.registry.enabled:
+            BYTES_STAGED.inc(os.path.getsize(file_path), direction="in")
+        im, scale = self._open_image(file_path)
         with warnings.catch_warnings():
             warnings.simplefilter("ignore")
             im = im.convert(self.image_mode)
-        return image_utils.format_image(
-            im,
-            cast(Literal["numpy", "pil", "filepath"], self.image_type),
-            self.GRADIO_CACHE,
-            name=name,
-            format=suffix,
+        return (
+            image_utils.format_image(
+                im,
+                cast(Literal["numpy", "pil", "filepath"], self.image_type),
+                self.GRADIO_CACHE,
+                name=name,
+                format=suffix,
+            ),
+            scale,
         )
 
-    def preprocess_boxes(self, boxes: List[dict] | None) -> list:
+    @timed(CALL_SECONDS, method="preprocess_boxes")
+    def preprocess_boxes(
+        self, boxes: List[dict] | dict | None, scale: float = 1.0
+    ) -> list:
+        """
+        Parse the boxes sent by the frontend into image coordinates, multiplied
+        by `scale` when the image was downscaled.
+        """
+        if boxes is None:
+            return []
+        if is_packed(boxes):
+            # Packed boxes are already in image coordinates with parsed colors
+            boxes = unpack_boxes(boxes)
         parsed_boxes = []
         for box in boxes:
             new_box = {}
             new_box["label"] = box.get("label", "")
             new_box["color"] = (0, 0, 0)
-            if "color" in box:
+            if isinstance(box.get("color"), tuple):
+                new_box["color"] = box["color"]
+            elif "color" in box:
                 match = re.match(r"rgb\((\d+), (\d+), (\d+)\)", box["color"])
                 if match:
                     new_box["color"] = tuple(int(match.group(i)) for i in range(1, 4))
-            scale_factor = box.get("scaleFactor", 1)
+            scale_factor = box.get("scaleFactor", 1) / scale
             new_box["xmin"] = round(box["xmin"] / scale_factor)
             new_box["ymin"] = round(box["ymin"] / scale_factor)
             new_box["xmax"] = round(box["xmax"] / scale_factor)
             new_box["ymax"] = round(box["ymax"] / scale_factor)
+            if "id" in box:
+                new_box["id"] = box["id"]
             parsed_boxes.append(new_box)
         return parsed_boxes
 
+    @timed(CALL_SECONDS, method="preprocess")
     def preprocess(self, payload: AnnotatedImageData | None) -> dict | None:
         """
         Parameters:
@@ -279,13 +407,34 @@ class ImageAnnotator(Component):
         if payload is None:
             return None
 
-        ret_value = {
-            "image": self.preprocess_image(payload.image),
-            "boxes": self.preprocess_boxes(payload.boxes),
-            "calibration_ratio": payload.calibration_ratio,
-        }
+        image, scale = self._preprocess_image(payload.image)
+        # A frontend without delta support sends no ops, only the full boxes
+        if self.sync_mode == "delta" and payload.ops is not None:
+            ops = []
+            for op in payload.ops or []:
+                op = dict(op)
+                if "box" in op:
+                    op["box"] = self.preprocess_boxes([op["box"]], scale)[0]
+                ops.append(op)
+            BOXES.observe(len(ops), direction="in")
+            ret_value = {
+                "image": image,
+                "ops": ops,
+                "version": payload.version,
+                "calibration_ratio": payload.calibration_ratio,
+            }
+        else:
+            ret_value = {
+                "image": image,
+                "boxes": self.preprocess_boxes(payload.boxes, scale),
+                "calibration_ratio": payload.calibration_ratio,
+            }
+            BOXES.observe(len(ret_value["boxes"]), direction="in")
+        if self.max_side is not None:
+            ret_value["scale"] = scale
         return ret_value
 
+    @timed(CALL_SECONDS, method="postprocess")
     def postprocess(self, value: dict | None) -> AnnotatedImageData | None:
         """
         Parameters:
@@ -310,15 +459,22 @@ class ImageAnnotator(Component):
                 if (
                     not isinstance(box, dict)
                     or not set(box.keys()).issubset(
-                        {"label", "xmin", "ymin", "xmax", "ymax", "color"}
+                        {"id", "label", "xmin", "ymin", "xmax", "ymax", "color"}
                     )
                     or not set(box.keys()).issuperset({"xmin", "ymin", "xmax", "ymax"})
                 ):
                     raise ValueError(
                         "Box must be a dict with the following "
                         "keys: 'xmin', 'ymin', 'xmax', 'ymax', "
-                        f"['label', 'color']'. Got {box}"
+                        f"['id', 'label', 'color']'. Got {box}"
                     )
+                if self.sync_mode == "delta":
+                    # Stable ids let the frontend refer to these boxes in its ops
+                    box.setdefault("id", uuid.uuid4().hex)
+
+        BOXES.observe(len(boxes), direction="out")
+        if self.boxes_format == "packed":
+            boxes = pack_boxes(boxes)
 
         # Check and parse image
         image = value.setdefault("image", None)
@@ -326,7 +482,12 @@ class ImageAnnotator(Component):
             if isinstance(image, str) and image.lower().endswith(".svg"):
                 image = FileData(path=image, orig_name=Path(image).name)
             else:
+                if not isinstance(image, (str, Path)):
+                    # Arrays and PIL images are saved as webp by gradio
+                    _init_pil("webp")
                 saved = image_utils.save_image(image, self.GRADIO_CACHE)
+                if metrics.registry.enabled and os.path.exists(saved):
+                    BYTES_STAGED.inc(os.path.getsize(saved), direction="out")
                 orig_name = Path(saved).name if Path(saved).exists() else None
                 image = FileData(path=saved, orig_name=orig_name)
         else:
@@ -344,6 +505,7 @@ class ImageAnnotator(Component):
             image=image, boxes=boxes, calibration_ratio=calibration_ratio
         )
 
+    @timed(CALL_SECONDS, method="process_example")
     def process_example(self, value: dict | None) -> FileData | None:
         if value is None:
             return None
@@ -355,7 +517,12 @@ class ImageAnnotator(Component):
             if isinstance(image, str) and image.lower().endswith(".svg"):
                 image = FileData(path=image, orig_name=Path(image).name)
             else:
+                if not isinstance(image, (str, Path)):
+                    # Arrays and PIL images are saved as webp by gradio
+                    _init_pil("webp")
                 saved = image_utils.save_image(image, self.GRADIO_CACHE)
+                if metrics.registry.enabled and os.path.exists(saved):
+                    BYTES_STAGED.inc(os.path.getsize(saved), direction="out")
                 orig_name = Path(saved).name if Path(saved).exists() else None
                 image = FileData(path=saved, orig_name=orig_name)
         else:
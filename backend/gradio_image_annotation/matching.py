@@ -0,0 +1,686 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import os
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+import cv2
+import numpy as np
+
+Rect = Tuple[int, int, int, int]  # x, y, w, h
+
+# Scale of the image and templates used to rank the templates and angles of a
+# budgeted run, and the smallest template side to rank at that scale
+PLAN_FACTOR = 4
+PLAN_MIN_SIDE = 4
+# Candidates between two checks of the time limit
+_TIME_CHECK_INTERVAL = 1024
+
+
+def is_overlapping(rect1: Rect, rect2: Rect, threshold: float) -> bool:
+    """
+    Whether the intersection of two rects covers more than `threshold` of
+    the smallest one.
+    """
+    x1, y1, w1, h1 = rect1
+    x2, y2, w2, h2 = rect2
+
+    dx = min(x1 + w1, x2 + w2) - max(x1, x2)
+    dy = min(y1 + h1, y2 + h2) - max(y1, y2)
+    if (dx >= 0) and (dy >= 0):
+        overlap_area = dx * dy
+        if overlap_area / min(w1 * h1, w2 * h2) > threshold:
+            return True
+    return False
+
+
+def rotation_matrix(width: int, height: int, angle: float) -> Tuple[np.ndarray, int, int]:
+    """
+    Rotation matrix around the center of an image and the size of the
+    rotated image, large enough to hold all of it.
+    """
+    cX, cY = width // 2, height // 2
+    M = cv2.getRotationMatrix2D((cX, cY), angle, 1.0)
+    cos = np.abs(M[0, 0])
+    sin = np.abs(M[0, 1])
+    nW = int((height * sin) + (width * cos))
+    nH = int((height * cos) + (width * sin))
+    # Adjust the rotation matrix to take into account translation
+    M[0, 2] += (nW / 2) - cX
+    M[1, 2] += (nH / 2) - cY
+    return M, nW, nH
+
+
+class MatchBudget:
+    """
+    Limits of a matching run, checked by `MatchEngine` as it goes.
+
+    - `time_limit`: seconds from `start()`, checked between angles and every
+      few candidates.
+    - `max_per_label`: hits per label, further templates of a full label are
+      skipped.
+    - `max_total`: hits of all labels.
+    - `max_candidates`: rects above the threshold considered per template,
+      best correlation first.
+
+    With a budget, the templates and angles that look the most promising run
+    first (see `MatchEngine.plan`) and candidates are taken best first, so
+    stopping early keeps the best hits found so far. When some work was
+    skipped, `partial` is True and `reasons` tells which limits were hit.
+
+    A budget holds the state of one run, use a new one for each run.
+    """
+
+    def __init__(
+        self,
+        time_limit: float | None = None,
+        max_per_label: int | None = None,
+        max_total: int | None = None,
+        max_candidates: int | None = None,
+    ):
+        self.time_limit = time_limit
+        self.max_per_label = max_per_label
+        self.max_total = max_total
+        self.max_candidates = max_candidates
+        self.deadline: float | None = None
+        self.reasons: set = set()
+        self.full_labels: set = set()
+
+    def limits(self) -> dict:
+        return {
+            "time_limit": self.time_limit,
+            "max_per_label": self.max_per_label,
+            "max_total": self.max_total,
+            "max_candidates": self.max_candidates,
+        }
+
+    def start(self):
+        """
+        Start the clock of the time limit, if not started yet.
+        """
+        if self.deadline is None and self.time_limit is not None:
+            self.deadline = time.monotonic() + self.time_limit
+
+    @property
+    def partial(self) -> bool:
+        return bool(self.reasons)
+
+    @property
+    def stopped(self) -> bool:
+        """
+        Whether no more work should be done at all.
+        """
+        return "time_limit" in self.reasons or "max_total" in self.reasons
+
+    def check_time(self) -> bool:
+        """
+        Whether the run must stop, flagging the time limit if it is over.
+        """
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self.reasons.add("time_limit")
+        return self.stopped
+
+    def admit(self, label: str, label_count: int, total_count: int) -> bool:
+        """
+        Whether a new hit of `label` fits in the budget, given the number of
+        hits of the label and of all labels so far.
+        """
+        if self.max_total is not None and total_count >= self.max_total:
+            self.reasons.add("max_total")
+            return False
+        if self.max_per_label is not None and label_count >= self.max_per_label:
+            self.reasons.add("max_per_label")
+            self.full_labels.add(label)
+            return False
+        return True
+
+
+class MatchEngine:
+    """
+    Template matching inner loop working in reusable buffers.
+
+    The CLAHE filter is built once, and the grayscale, rotated and correlation
+    images are written into buffers kept per name and size, so matching many
+    templates at many angles doesn't allocate a new image each time. Input
+    images are never modified.
+
+    An engine is not thread-safe, use one per thread.
+    """
+
+    def __init__(self, method: int = cv2.TM_CCOEFF_NORMED):
+        self.method = method
+        # CLAHE (Contrast Limited Adaptive Histogram Equalization) to enhance contrast
+        self.clahe = cv2.createCLAHE(clipLimit=0.5, tileGridSize=(3, 3))
+        self.kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, 1))
+        self._buffers: Dict[str, np.ndarray] = {}  # name -> block of bytes
+
+    def buffer(self, name: str, shape: tuple, dtype=np.uint8) -> np.ndarray:
+        """
+        A buffer for `name` of the given shape, reused across calls. Its
+        content is whatever was written last.
+
+        Each name has a single block of memory, grown to the largest size
+        asked for, and the buffers are views of it. So the memory kept is the
+        largest buffer of each name, whatever the number of template shapes.
+        """
+        dtype = np.dtype(dtype)
+        size = math.prod(shape) * dtype.itemsize
+        block = self._buffers.get(name)
+        if block is None or block.nbytes < size:
+            block = self._buffers[name] = np.empty(size, dtype=np.uint8)
+        return block[:size].view(dtype).reshape(shape)
+
+    @property
+    def buffer_bytes(self) -> int:
+        return sum(block.nbytes for block in self._buffers.values())
+
+    def trim_buffers(self, max_bytes: int):
+        """
+        Free the largest buffers until at most `max_bytes` are kept, e.g.
+        between the runs of a long-lived engine.
+        """
+        for name in sorted(
+            self._buffers, key=lambda name: self._buffers[name].nbytes, reverse=True
+        ):
+            if self.buffer_bytes <= max_bytes:
+                break
+            del self._buffers[name]
+
+    def clear_buffers(self):
+        self._buffers.clear()
+
+    def preprocess(self, image: np.ndarray, name: str = "image") -> np.ndarray:
+        """
+        Grayscale, contrast-enhanced version of a BGR image, in the `name`
+        buffer.
+        """
+        shape = image.shape[:2]
+        gray = self.buffer(f"{name}_gray", shape)
+        cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=gray)
+        out = self.buffer(name, shape)
+        self.clahe.apply(gray, dst=out)
+        # Morphological opening to clean up the noise, in place
+        cv2.morphologyEx(out, cv2.MORPH_OPEN, self.kernel, dst=out)
+        return out
+
+    def rotate(self, image: np.ndarray, angle: float) -> np.ndarray:
+        """
+        Rotated copy of an image, in a buffer of the rotated size.
+        """
+        height, width = image.shape[:2]
+        M, nW, nH = rotation_matrix(width, height, angle)
+        dst = self.buffer("rotated", (nH, nW) + image.shape[2:], image.dtype)
+        cv2.warpAffine(image, M, (nW, nH), dst=dst)
+        return dst
+
+    def prepare(self, template: np.ndarray, angle: float) -> np.ndarray:
+        """
+        Rotated and preprocessed template, in the "template" buffer.
+        """
+        rotated = self.rotate(template, angle) if angle else template
+        return self.preprocess(rotated, "template")
+
+    def match(
+        self,
+        image_processed: np.ndarray,
+        template_processed: np.ndarray,
+        threshold: float,
+        regions: List[Rect] | None = None,
+        ranked: bool = False,
+        limit: int | None = None,
+    ) -> Iterator[Rect]:
+        """
+        Rects where the correlation with the template is at least `threshold`,
+        in row-major order. With `regions`, only these parts of the image are
+        searched, region by region.
+
+        With `ranked`, the rects are yielded best correlation first, at most
+        `limit` of them.
+        """
+        temp_h, temp_w = template_processed.shape[:2]
+        if regions is None:
+            image_h, image_w = image_processed.shape[:2]
+            regions = [(0, 0, image_w, image_h)]
+            # Region sizes vary, only the buffers of the full image are kept
+            reuse = True
+        else:
+            reuse = False
+
+        scores, xs, ys = [], [], []
+        for rx, ry, rw, rh in regions:
+            if temp_w > rw or temp_h > rh:
+                continue
+            roi = image_processed[ry : ry + rh, rx : rx + rw]
+            res_shape = (rh - temp_h + 1, rw - temp_w + 1)
+            if reuse:
+                res = self.buffer("result", res_shape, np.float32)
+                cv2.matchTemplate(roi, template_processed, self.method, result=res)
+                mask = self.buffer("mask", res_shape, np.bool_)
+                np.greater_equal(res, threshold, out=mask)
+            else:
+                res = cv2.matchTemplate(roi, template_processed, self.method)
+                mask = res >= threshold
+            indices = np.flatnonzero(mask)
+            if not ranked:
+                for index in indices:
+                    y, x = divmod(int(index), res_shape[1])
+                    yield (x + rx, y + ry, temp_w, temp_h)
+                continue
+            # Copied out of the buffers, which the next region reuses
+            scores.append(res.ravel()[indices])
+            ys_region, xs_region = np.divmod(indices, res_shape[1])
+            xs.append(xs_region + rx)
+            ys.append(ys_region + ry)
+
+        if ranked and scores:
+            all_scores = np.concatenate(scores)
+            all_xs, all_ys = np.concatenate(xs), np.concatenate(ys)
+            if limit is not None and limit < len(all_scores):
+                if limit <= 0:
+                    return
+                top = np.argpartition(-all_scores, limit - 1)[:limit]
+            else:
+                top = np.arange(len(all_scores))
+            top = top[np.argsort(-all_scores[top], kind="stable")]
+            for i in top:
+                yield (int(all_xs[i]), int(all_ys[i]), temp_w, temp_h)
+
+    def plan(
+        self,
+        image_processed: np.ndarray,
+        count: int,
+        angles: List[float],
+        prepare: Callable[[int, float], np.ndarray],
+    ) -> List[Tuple[int, List[float]]]:
+        """
+        Most promising first order of the work of a budgeted run, as
+        `(template index, angles)` pairs.
+
+        Each of the `count` templates, prepared at each angle by
+        `prepare(index, angle)`, is correlated with the image scaled down by
+        `PLAN_FACTOR`. Templates are ordered by their best correlation, and
+        their angles by correlation. Templates too small to be compared at
+        that scale come last, in their original order.
+        """
+        image_h, image_w = image_processed.shape[:2]
+        small_w, small_h = image_w // PLAN_FACTOR, image_h // PLAN_FACTOR
+        if small_w < PLAN_MIN_SIDE or small_h < PLAN_MIN_SIDE:
+            return [(index, list(angles)) for index in range(count)]
+        small = self.buffer("plan", (small_h, small_w))
+        cv2.resize(
+            image_processed, (small_w, small_h), dst=small, interpolation=cv2.INTER_AREA
+        )
+
+        ranked = []
+        for index in range(count):
+            scores = {}
+            for angle in angles:
+                template = prepare(index, angle)
+                temp_h, temp_w = template.shape[:2]
+                temp_w, temp_h = temp_w // PLAN_FACTOR, temp_h // PLAN_FACTOR
+                score = -math.inf
+                if (
+                    PLAN_MIN_SIDE <= temp_w <= small_w
+                    and PLAN_MIN_SIDE <= temp_h <= small_h
+                ):
+                    small_template = cv2.resize(
+                        template, (temp_w, temp_h), interpolation=cv2.INTER_AREA
+                    )
+                    res = cv2.matchTemplate(small, small_template, self.method)
+                    best = float(cv2.minMaxLoc(res)[1])
+                    # Flat templates have no defined correlation
+                    if not math.isnan(best):
+                        score = best
+                scores[angle] = score
+            ordered = sorted(angles, key=lambda angle: scores[angle], reverse=True)
+            ranked.append((index, ordered, max(scores.values(), default=-math.inf)))
+        ranked.sort(key=lambda item: item[2], reverse=True)
+        return [(index, ordered) for index, ordered, _ in ranked]
+
+    def find(
+        self,
+        image_processed: np.ndarray,
+        templates: List[Tuple[str, np.ndarray]],
+        angles: List[float],
+        accuracy_threshold: float,
+        rect_overlap_threshold: float,
+        found_labels: Dict[str, List[Rect]] | None = None,
+        pruner: FeaturePruner | None = None,
+        budget: MatchBudget | None = None,
+    ) -> Dict[str, List[Rect]]:
+        """
+        Match `(label, BGR template)` pairs against a preprocessed image at
+        each angle. A hit is kept unless it overlaps a hit already kept (of any
+        label) by more than `rect_overlap_threshold`.
+
+        With a `pruner`, each rotated template is only correlated inside the
+        regions proposed from keypoint matches, and skipped at the angles
+        where it has none.
+
+        With a `budget`, the most promising templates and angles run first and
+        the run stops early when a limit is hit, see `MatchBudget`.
+
+        Returns the rects found for each label, added to `found_labels` if
+        given.
+        """
+        if found_labels is None:
+            found_labels = {}
+        if budget is not None:
+            budget.start()
+            order = self.plan(
+                image_processed,
+                len(templates),
+                angles,
+                lambda index, angle: self.prepare(templates[index][1], angle),
+            )
+        else:
+            order = [(index, angles) for index in range(len(templates))]
+        image_features = pruner.detect(image_processed) if pruner else None
+        for index, template_angles in order:
+            label, template = templates[index]
+            self.find_template(
+                image_processed,
+                label,
+                template,
+                template_angles,
+                accuracy_threshold,
+                rect_overlap_threshold,
+                found_labels,
+                pruner,
+                image_features,
+                budget=budget,
+            )
+            if budget is not None and budget.stopped:
+                break
+        return found_labels
+
+    def find_template(
+        self,
+        image_processed: np.ndarray,
+        label: str,
+        template: np.ndarray,
+        angles: List[float],
+        accuracy_threshold: float,
+        rect_overlap_threshold: float,
+        found_labels: Dict[str, List[Rect]],
+        pruner: FeaturePruner | None = None,
+        image_features: tuple | None = None,
+        prepare: Callable[[float], np.ndarray] | None = None,
+        budget: MatchBudget | None = None,
+    ) -> List[Rect]:
+        """
+        Match a single template, see `find`. `image_features` are the ones of
+        `pruner.detect(image_processed)`, computed if not given. `prepare`
+        returns the rotated and preprocessed template at an angle, e.g. from a
+        cache, instead of computing it in the engine buffers.
+
+        With a `budget`, the angles are matched in the given order (see
+        `plan`) and candidates best first, until a limit is hit.
+
+        Returns the new hits, which are also added to `found_labels`.
+        """
+        if budget is not None and (budget.stopped or label in budget.full_labels):
+            return []
+        if pruner is not None and image_features is None:
+            image_features = pruner.detect(image_processed)
+        found_rects = [rect for rects in found_labels.values() for rect in rects]
+        new_rects = []
+        candidates = 0
+
+        for angle in angles:
+            limit = None
+            if budget is not None:
+                budget.start()
+                if budget.check_time():
+                    break
+                if budget.max_candidates is not None:
+                    if candidates >= budget.max_candidates:
+                        # The remaining angles are not searched
+                        budget.reasons.add("max_candidates")
+                        break
+                    # One more to know if some were left out
+                    limit = budget.max_candidates - candidates + 1
+            if prepare is not None:
+                temp_processed = prepare(angle)
+            else:
+                temp_processed = self.prepare(template, angle)
+            regions = None
+            if pruner is not None:
+                regions = pruner.regions(image_features, temp_processed)
+                if regions is not None and not regions:
+                    continue
+            for rect in self.match(
+                image_processed,
+                temp_processed,
+                accuracy_threshold,
+                regions,
+                ranked=budget is not None,
+                limit=limit,
+            ):
+                candidates += 1
+                if budget is not None:
+                    if (
+                        budget.max_candidates is not None
+                        and candidates > budget.max_candidates
+                    ):
+                        budget.reasons.add("max_candidates")
+                        return new_rects
+                    if candidates % _TIME_CHECK_INTERVAL == 0 and budget.check_time():
+                        return new_rects
+                if not any(
+                    is_overlapping(rect, existing, rect_overlap_threshold)
+                    for existing in found_rects
+                ):
+                    if budget is not None and not budget.admit(
+                        label, len(found_labels.get(label, ())), len(found_rects)
+                    ):
+                        return new_rects
+                    found_labels.setdefault(label, []).append(rect)
+                    found_rects.append(rect)
+                    new_rects.append(rect)
+        return new_rects
+
+
+class FeaturePruner:
+    """
+    Proposes where, and at which angles, a template may be in an image, from
+    ORB keypoint matches, so the correlation only runs there.
+
+    A rotated template is kept at an angle when enough of its keypoints match
+    image keypoints with the same orientation, and each such match proposes
+    the template rect around it, grown by `margin`. When the image or the
+    template have too few keypoints, no pruning is done.
+    """
+
+    def __init__(
+        self,
+        n_features: int = 20000,
+        min_keypoints: int = 8,
+        min_matches: int = 3,
+        ratio: float = 0.75,
+        max_angle_diff: float = 20.0,
+        margin: float = 0.25,
+    ):
+        self.min_keypoints = min_keypoints
+        self.min_matches = min_matches
+        self.ratio = ratio
+        self.max_angle_diff = max_angle_diff
+        self.margin = margin
+        # Small patches so that small templates still have keypoints
+        self.image_orb = cv2.ORB_create(
+            nfeatures=n_features, edgeThreshold=15, patchSize=15
+        )
+        self.template_orb = cv2.ORB_create(nfeatures=500, edgeThreshold=15, patchSize=15)
+        self.matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+
+    def detect(self, image_processed: np.ndarray) -> tuple:
+        """
+        Keypoints of the image, passed to `regions`.
+        """
+        keypoints, descriptors = self.image_orb.detectAndCompute(image_processed, None)
+        return keypoints, descriptors, image_processed.shape[:2]
+
+    def regions(
+        self, image_features: tuple, template_processed: np.ndarray
+    ) -> List[Rect] | None:
+        """
+        Image regions to search for a template, an empty list if the template
+        is unlikely to be in the image at this angle, or None to search the
+        whole image.
+        """
+        keypoints, descriptors, (image_h, image_w) = image_features
+        if descriptors is None or len(keypoints) < self.min_keypoints:
+            return None
+        temp_keypoints, temp_descriptors = self.template_orb.detectAndCompute(
+            template_processed, None
+        )
+        if temp_descriptors is None or len(temp_keypoints) < self.min_keypoints:
+            return None
+
+        temp_h, temp_w = template_processed.shape[:2]
+        margin_x, margin_y = int(temp_w * self.margin), int(temp_h * self.margin)
+        regions = []
+        for pair in self.matcher.knnMatch(temp_descriptors, descriptors, k=2):
+            if not pair:
+                continue
+            if len(pair) == 2 and pair[0].distance > self.ratio * pair[1].distance:
+                continue
+            temp_kp = temp_keypoints[pair[0].queryIdx]
+            image_kp = keypoints[pair[0].trainIdx]
+            diff = abs(temp_kp.angle - image_kp.angle) % 360
+            if min(diff, 360 - diff) > self.max_angle_diff:
+                continue
+            # Top-left corner of the template if this match is right
+            x = int(image_kp.pt[0] - temp_kp.pt[0])
+            y = int(image_kp.pt[1] - temp_kp.pt[1])
+            xmin, ymin = max(x - margin_x, 0), max(y - margin_y, 0)
+            xmax = min(x + temp_w + margin_x, image_w)
+            ymax = min(y + temp_h + margin_y, image_h)
+            if xmax > xmin and ymax > ymin:
+                regions.append((xmin, ymin, xmax - xmin, ymax - ymin))
+
+        if len(regions) < self.min_matches:
+            return []
+        return merge_regions(regions)
+
+
+def merge_regions(regions: List[Rect]) -> List[Rect]:
+    """
+    Merge intersecting rects into their bounding rects until none intersect.
+    """
+    merged = [list(region) for region in regions]
+    changed = True
+    while changed:
+        changed = False
+        result = []
+        for x, y, w, h in merged:
+            for other in result:
+                ox, oy, ow, oh = other
+                if x < ox + ow and ox < x + w and y < oy + oh and oy < y + h:
+                    xmin, ymin = min(x, ox), min(y, oy)
+                    other[:] = [
+                        xmin,
+                        ymin,
+                        max(x + w, ox + ow) - xmin,
+                        max(y + h, oy + oh) - ymin,
+                    ]
+                    changed = True
+                    break
+            else:
+                result.append([x, y, w, h])
+        merged = result
+    return [tuple(region) for region in merged]
+
+
+def template_hash(template: np.ndarray) -> str:
+    """
+    Hash of the content of a template image.
+    """
+    digest = hashlib.sha1(str(template.shape).encode())
+    digest.update(np.ascontiguousarray(template).data)
+    return digest.hexdigest()
+
+
+class MatchState:
+    """
+    Hits of the templates already matched against an image, saved between
+    runs so only new or changed templates are matched again.
+
+    The state is tied to a `signature` of everything else the hits depend on
+    (image, thresholds, angles...), and is reset when it changes. Hits are
+    stored per template, keyed by its label and hash (see `key`), in matching
+    order: `{key: {"label": label, "rects": [[x, y, w, h], ...]}}`. Relabeling
+    a template, or two templates with the same crop and different labels,
+    give different keys.
+
+    The hits of a template depend on the hits of the templates matched before
+    it, which suppress the rects they overlap. So only the hits of the
+    templates matched in the same order as now are kept, see `found_labels`.
+    """
+
+    FILE_NAME = "match_state.json"
+
+    def __init__(self, path: str, signature: dict):
+        self.path = path
+        self.signature = signature
+        self.hits: Dict[str, dict] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf8") as f:
+                data = json.load(f)
+            if data.get("signature") == signature:
+                self.hits = data["hits"]
+
+    @staticmethod
+    def key(label: str, template_hash: str) -> str:
+        return f"{label}:{template_hash}"
+
+    def found_labels(
+        self, keys: List[str], labels: Iterable[str]
+    ) -> Dict[str, List[Rect]]:
+        """
+        Keep the hits of the templates that were matched in the same order as
+        `keys`, up to the first difference or to a label not in `labels`, and
+        return them per label in matching order. The templates after it must
+        be matched again, so that the hits are the ones of a run from scratch:
+        e.g. when a template is removed, the rects it suppressed may now be
+        found by the next ones.
+        """
+        labels = set(labels)
+        kept = {}
+        for key, stored_key in zip(keys, self.hits):
+            if key != stored_key or self.hits[key]["label"] not in labels:
+                break
+            kept[key] = self.hits[key]
+        self.hits = kept
+        found_labels = {}
+        for hits in self.hits.values():
+            found_labels.setdefault(hits["label"], []).extend(
+                tuple(rect) for rect in hits["rects"]
+            )
+        return found_labels
+
+    def add(self, key: str, label: str, rects: List[Rect]):
+        self.hits[key] = {"label": label, "rects": [list(rect) for rect in rects]}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w", encoding="utf8") as f:
+            json.dump({"signature": self.signature, "hits": self.hits}, f)
+
+
+def draw_matches(
+    image: np.ndarray, found_labels: Dict[str, dict], thickness: int = 2
+) -> np.ndarray:
+    """
+    Copy of a BGR image with the rects of the results drawn on it. The
+    results have the format `{label: {"color": [r, g, b], "rects": [...]}}`.
+    """
+    output = image.copy()
+    for result in found_labels.values():
+        color = tuple(int(c) for c in result["color"][::-1])
+        for x, y, w, h in result["rects"]:
+            cv2.rectangle(output, (x, y), (x + w, y + h), color, thickness)
+    return output
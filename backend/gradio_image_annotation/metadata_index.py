@@ -0,0 +1,284 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import struct
+import threading
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+import PIL.Image
+
+from .directory_source import IMAGE_EXTENSIONS
+from .utils import bounded_map
+
+INDEX_NAME = ".image_metadata.sqlite"
+COLUMNS = (
+    "name",
+    "width",
+    "height",
+    "format",
+    "orientation",
+    "file_size",
+    "mtime_ns",
+    "taken_at",
+)
+SORT_COLUMNS = COLUMNS + ("area",)
+
+# EXIF tags
+_ORIENTATION = 0x0112
+_DATETIME = 0x0132
+_EXIF_IFD = 0x8769
+_DATETIME_ORIGINAL = 0x9003
+
+
+def read_image_metadata(path: str) -> dict:
+    """
+    Read the displayed size, format, EXIF orientation and capture date of an
+    image from its header, without decoding the pixels.
+    """
+    with PIL.Image.open(path) as im:
+        width, height = im.size
+        exif = im.getexif()
+        orientation = exif.get(_ORIENTATION, 1)
+        taken_at = exif.get_ifd(_EXIF_IFD).get(_DATETIME_ORIGINAL) or exif.get(
+            _DATETIME
+        )
+        image_format = im.format
+    if orientation in (5, 6, 7, 8):
+        width, height = height, width
+    return {
+        "width": width,
+        "height": height,
+        "format": image_format,
+        "orientation": orientation,
+        "taken_at": taken_at,
+    }
+
+
+class ImageMetadataIndex:
+    """
+    Persistent index of the image metadata of a folder, read from the headers.
+
+    The index is stored in a SQLite file (`.image_metadata.sqlite` in the
+    folder by default). `refresh` only reads the headers of new images and of
+    images whose size or modification time changed, in parallel, and drops
+    the images that were removed. Files whose header can't be read are kept
+    in a separate table, and skipped until their size or modification time
+    changes. `lookup` does the same for a few images only, e.g. the page of a
+    `DirectorySource` being browsed.
+
+    ```python
+        index = ImageMetadataIndex("images/")
+        index.refresh()
+        index.query(sort_by="taken_at", orientation=6, min_width=1000)
+    ```
+    """
+
+    def __init__(
+        self,
+        folder: str,
+        index_path: str | None = None,
+        recursive: bool = False,
+        workers: int = 8,
+    ):
+        if not os.path.isdir(folder):
+            raise ValueError(f"{folder} is not a directory")
+        self.folder = os.path.abspath(folder)
+        self.index_path = index_path or os.path.join(self.folder, INDEX_NAME)
+        self.recursive = recursive
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.index_path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS images (
+                name TEXT PRIMARY KEY, width INTEGER, height INTEGER,
+                format TEXT, orientation INTEGER, file_size INTEGER,
+                mtime_ns INTEGER, taken_at TEXT
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS unreadable (
+                name TEXT PRIMARY KEY, file_size INTEGER, mtime_ns INTEGER
+            )
+            """
+        )
+        self._conn.commit()
+
+    def _scan(self) -> Iterator[Tuple[str, os.stat_result]]:
+        folders = [self.folder]
+        while folders:
+            folder = folders.pop()
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        if self.recursive:
+                            folders.append(entry.path)
+                    elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                        yield os.path.relpath(entry.path, self.folder), entry.stat()
+
+    def _known(self, names: Iterable[str] | None = None) -> Dict[str, tuple]:
+        # (size, mtime) of the indexed files, readable or not
+        with self._lock:
+            if names is None:
+                return {
+                    name: (file_size, mtime_ns)
+                    for table in ("images", "unreadable")
+                    for name, file_size, mtime_ns in self._conn.execute(
+                        f"SELECT name, file_size, mtime_ns FROM {table}"
+                    )
+                }
+            known = {}
+            for name in names:
+                for table in ("images", "unreadable"):
+                    row = self._conn.execute(
+                        f"SELECT file_size, mtime_ns FROM {table} WHERE name = ?",
+                        (name,),
+                    ).fetchone()
+                    if row:
+                        known[name] = tuple(row)
+            return known
+
+    def _read(self, item: Tuple[str, os.stat_result]) -> tuple:
+        name, stat = item
+        try:
+            metadata = read_image_metadata(os.path.join(self.folder, name))
+        except (OSError, SyntaxError, ValueError, struct.error):
+            # Not an image PIL can read, or a malformed EXIF block
+            return name, stat.st_size, stat.st_mtime_ns
+        return (
+            name,
+            metadata["width"],
+            metadata["height"],
+            metadata["format"],
+            metadata["orientation"],
+            stat.st_size,
+            stat.st_mtime_ns,
+            metadata["taken_at"],
+        )
+
+    def _update(
+        self, changed: Iterable[Tuple[str, os.stat_result]], removed: Iterable[str] = ()
+    ) -> int:
+        rows, unreadable = [], []
+        for row in bounded_map(self._read, changed, self.workers):
+            (rows if len(row) == len(COLUMNS) else unreadable).append(row)
+        # A file is in one table only. `removed` is read after `changed`.
+        deleted = [(name,) for name in removed]
+        deleted += [(row[0],) for row in rows + unreadable]
+        with self._lock:
+            for table in ("images", "unreadable"):
+                self._conn.executemany(f"DELETE FROM {table} WHERE name = ?", deleted)
+            self._conn.executemany(
+                f"INSERT INTO images VALUES ({', '.join('?' * len(COLUMNS))})",
+                rows,
+            )
+            self._conn.executemany("INSERT INTO unreadable VALUES (?, ?, ?)", unreadable)
+            self._conn.commit()
+        return len(rows) + len(unreadable)
+
+    def refresh(self) -> int:
+        """
+        Bring the index up to date with the folder.
+
+        Returns the number of images whose headers were read.
+        """
+        known = self._known()
+
+        def changed():
+            for name, stat in self._scan():
+                if known.pop(name, None) != (stat.st_size, stat.st_mtime_ns):
+                    yield name, stat
+
+        # Once the scan is done, what is left in `known` was removed
+        return self._update(changed(), known)
+
+    def lookup(self, names: Iterable[str]) -> List[dict | None]:
+        """
+        Metadata of some images of the folder, by name relative to it. Only
+        the headers of the images not indexed yet or changed are read. None
+        for the images that are missing or can't be read.
+        """
+        names = list(names)
+        known = self._known(names)
+        changed = []
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(self.folder, name))
+            except OSError:
+                continue
+            if known.get(name) != (stat.st_size, stat.st_mtime_ns):
+                changed.append((name, stat))
+        self._update(changed)
+        return [self.get(name) for name in names]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def get(self, name: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM images WHERE name = ?", (name,)
+            ).fetchone()
+        return dict(zip(COLUMNS, row)) if row else None
+
+    def query(
+        self,
+        sort_by: str = "name",
+        descending: bool = False,
+        min_width: int | None = None,
+        max_width: int | None = None,
+        min_height: int | None = None,
+        max_height: int | None = None,
+        orientation: int | None = None,
+        image_format: str | None = None,
+        modified_after: float | None = None,
+        modified_before: float | None = None,
+        limit: int = -1,
+        offset: int = 0,
+    ) -> List[dict]:
+        """
+        Images matching all the given filters, sorted by a metadata column or
+        by "area". Modification times are timestamps in seconds.
+        """
+        if sort_by not in SORT_COLUMNS:
+            raise ValueError(
+                f"Cannot sort by {sort_by}, expected one of {', '.join(SORT_COLUMNS)}"
+            )
+
+        filters = [
+            ("width >= ?", min_width),
+            ("width <= ?", max_width),
+            ("height >= ?", min_height),
+            ("height <= ?", max_height),
+            ("orientation = ?", orientation),
+            ("format = ?", image_format),
+            (
+                "mtime_ns >= ?",
+                None if modified_after is None else int(modified_after * 1e9),
+            ),
+            (
+                "mtime_ns <= ?",
+                None if modified_before is None else int(modified_before * 1e9),
+            ),
+        ]
+        conditions = [condition for condition, value in filters if value is not None]
+        params = [value for _, value in filters if value is not None]
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        order = "width * height" if sort_by == "area" else sort_by
+
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM images {where} "
+                f"ORDER BY {order} {'DESC' if descending else 'ASC'}, name "
+                "LIMIT ? OFFSET ?",
+                (*params, limit, offset),
+            ).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
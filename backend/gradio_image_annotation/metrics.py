@@ -0,0 +1,277 @@
+from __future__ import annotations
+
+import functools
+import math
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterable, List, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 10, 100, 1000, 10000, 50000)
+ENV_VARIABLE = "GRADIO_IMAGE_ANNOTATION_METRICS"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(ABC):
+    type = ""
+
+    def __init__(
+        self,
+        registry: MetricsRegistry,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+    ):
+        self._registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"Metric {self.name} expects the labels {self.labelnames}, "
+                f"got {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """
+        Lines of the metric's samples in the Prometheus text format.
+        """
+
+    def render(self) -> str:
+        return "\n".join(
+            [
+                f"# HELP {self.name} {self.documentation}",
+                f"# TYPE {self.name} {self.type}",
+                *self.samples(),
+            ]
+        )
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        if not self._registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        if not self._registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, *args, buckets: Iterable[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # labels -> [bucket counts..., sum, count]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        if not self._registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[i] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(values)) for key, values in self._values.items()]
+        lines = []
+        for key, values in items:
+            for bound, count in zip(self.buckets, values):
+                labels = _format_labels(
+                    self.labelnames, key, f'le="{_format_value(bound)}"'
+                )
+                lines.append(f"{self.name}_bucket{labels} {_format_value(count)}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(values[-2])}")
+            lines.append(f"{self.name}_count{labels} {_format_value(values[-1])}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Minimal, dependency-free metrics registry rendered in the Prometheus text
+    format.
+
+    Metrics are recorded only while the registry is `enabled`. When disabled,
+    recording a value is a single attribute check.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, documentation: str, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(
+                    self, name, documentation, labelnames, **kwargs
+                )
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as a {metric.type}")
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._get_or_create(
+            Histogram, name, documentation, labelnames, buckets=buckets
+        )
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+registry = MetricsRegistry(
+    enabled=os.environ.get(ENV_VARIABLE, "").lower() in ("1", "true", "yes")
+)
+
+
+def enable_metrics(enabled: bool = True):
+    """
+    Start (or stop) recording the metrics of the package. Metrics are also
+    enabled by setting the `GRADIO_IMAGE_ANNOTATION_METRICS=1` environment
+    variable.
+    """
+    registry.enabled = enabled
+
+
+def timed(histogram: Histogram, **labels) -> Callable:
+    """
+    Decorator observing the duration of each call in `histogram`.
+    """
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not histogram._registry.enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+
+        return wrapper
+
+    return decorator
+
+
+def add_metrics_route(app, path: str = "/metrics"):
+    """
+    Serve the metrics in the Prometheus text format on a FastAPI app, e.g.
+    the one of a Gradio app:
+
+    ```python
+        app = gr.mount_gradio_app(FastAPI(), demo, path="/")
+        add_metrics_route(app)
+    ```
+    """
+    from fastapi.responses import PlainTextResponse
+
+    def metrics():
+        return PlainTextResponse(
+            registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+        )
+
+    app.add_api_route(path, metrics, methods=["GET"], include_in_schema=False)
+    return app
+
+
+# Metrics of the package
+CALL_SECONDS = registry.histogram(
+    "image_annotator_call_seconds",
+    "Duration of the ImageAnnotator methods and of the template matching runs.",
+    ["method"],
+)
+BYTES_STAGED = registry.counter(
+    "image_annotator_bytes_staged_total",
+    "Bytes of the images read or written by ImageAnnotator.",
+    ["direction"],
+)
+BOXES = registry.histogram(
+    "image_annotator_boxes",
+    "Number of boxes per ImageAnnotator payload.",
+    ["direction"],
+    buckets=COUNT_BUCKETS,
+)
+CACHE_REQUESTS = registry.counter(
+    "image_annotator_cache_requests_total",
+    "Lookups in the caches of the package, by cache and result (hit or miss).",
+    ["cache", "result"],
+)
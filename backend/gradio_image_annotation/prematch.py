@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import List
+
+from .template_matcher import MatchParams, TemplateMatcher
+from .utils import format_template_matching_output
+
+# Added to the niceness of the worker threads, where the OS supports it
+NICENESS = 10
+
+
+def _lower_priority():
+    # On Linux, a thread id is a valid target of setpriority
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), NICENESS)
+    except (AttributeError, OSError):
+        pass
+
+
+def _request_key(rectangles: List[dict], params: MatchParams, folders: List[str]) -> tuple:
+    # In "file" mode, only the ignored boxes of the image change the results
+    ignore_rects = tuple(
+        tuple(item["rect"]) for item in rectangles if item["label"] == "ignore"
+    )
+    return params, tuple(folders), ignore_rects
+
+
+class PrematchQueue:
+    """
+    Matches the templates of library folders against loaded images in the
+    background, so their results are ready when the user gets to them.
+
+    Jobs run on a pool of `workers` threads with a lower OS priority, and wait
+    while an interactive run is in progress (see `interactive`). When a job is
+    done, its hits become the "boxes" of the image data, unless the boxes were
+    edited in the meantime, so they show as soon as the image is opened. Each
+    job is also kept in its image data under "prematch", with the request it
+    was made for, and `result` hands it over when the same request is made
+    again.
+
+    ```python
+        queue = PrematchQueue(matcher)
+        for name, image_data in images.items():
+            queue.submit(name, image_data, [], params, ["screws"])
+        ...
+        result = queue.result(image_data, [], params, ["screws"])
+    ```
+    """
+
+    def __init__(self, matcher: TemplateMatcher, workers: int = 1):
+        if workers < 1:
+            raise ValueError(f"workers must be positive, got {workers}")
+        self.matcher = matcher
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix="prematch",
+            initializer=_lower_priority,
+        )
+        self._interactive = 0
+        self._idle = threading.Condition()
+        # Jobs not done yet, cancelled by `shutdown`
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+
+    @contextmanager
+    def interactive(self):
+        """
+        Hold the jobs that have not started yet while the block runs.
+        """
+        with self._idle:
+            self._interactive += 1
+        try:
+            yield
+        finally:
+            with self._idle:
+                self._interactive -= 1
+                self._idle.notify_all()
+
+    def _run(self, image_path, rectangles, image_name, params, folders):
+        with self._idle:
+            self._idle.wait_for(lambda: self._interactive == 0)
+        return self.matcher.match(
+            image_path, rectangles, image_name, params, folders=folders
+        )
+
+    def submit(
+        self,
+        image_name: str,
+        image_data: dict,
+        rectangles: List[dict],
+        params: MatchParams,
+        folders: List[str],
+    ):
+        """
+        Queue the matching of `folders` against an image, see
+        `TemplateMatcher.match` for the arguments.
+        """
+        future = self._executor.submit(
+            self._run,
+            image_data["file_path"],
+            rectangles,
+            image_name,
+            params,
+            list(folders),
+        )
+        image_data["prematch"] = {
+            "key": _request_key(rectangles, params, folders),
+            "future": future,
+        }
+        with self._pending_lock:
+            self._pending.add(future)
+        boxes = list(image_data.get("boxes", []))
+        future.add_done_callback(self._forget)
+        future.add_done_callback(
+            lambda future: self._apply(image_data, boxes, future)
+        )
+
+    def _forget(self, future):
+        with self._pending_lock:
+            self._pending.discard(future)
+
+    @staticmethod
+    def _apply(image_data: dict, boxes: list, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        # Boxes edited since the job was queued are left alone
+        if image_data.get("boxes", []) != boxes:
+            return
+        found_labels = future.result()[3]
+        image_data["boxes"] = format_template_matching_output(found_labels)
+
+    def result(
+        self,
+        image_data: dict,
+        rectangles: List[dict],
+        params: MatchParams,
+        folders: List[str],
+    ) -> tuple | None:
+        """
+        Result of the background job of an image if it was made for the same
+        request, waiting for it when it is running. Returns None when there is
+        no such job, or it had not started (it is cancelled) or failed.
+
+        Call it outside of `interactive`, which holds the jobs it may wait for.
+        """
+        prematch = image_data.pop("prematch", None)
+        if prematch is None:
+            return None
+        future = prematch["future"]
+        if prematch["key"] != _request_key(rectangles, params, folders):
+            future.cancel()
+            return None
+        if future.cancel():
+            return None
+        try:
+            return future.result()
+        except Exception as error:
+            print(f"Background matching failed: {error}")
+            return None
+
+    def cancel(self, entries):
+        """
+        Cancel the jobs of images that have not started yet, e.g. when other
+        images are loaded.
+        """
+        for image_data in entries.values():
+            prematch = image_data.pop("prematch", None)
+            if prematch is not None:
+                prematch["future"].cancel()
+
+    def shutdown(self):
+        # `cancel_futures` of `Executor.shutdown` needs Python 3.9
+        with self._pending_lock:
+            pending = list(self._pending)
+        for future in pending:
+            future.cancel()
+        self._executor.shutdown(wait=False)
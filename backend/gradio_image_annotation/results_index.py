@@ -0,0 +1,428 @@
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Tuple
+
+from .results_store import _STATE_FILES
+
+INDEX_NAME = ".results_index.sqlite"
+
+Rect = Tuple[int, int, int, int]  # x, y, w, h
+
+
+def _has_rtree(conn: sqlite3.Connection) -> bool:
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp._rtree_check USING rtree(id, x0, x1)")
+    except sqlite3.OperationalError:
+        return False
+    conn.execute("DROP TABLE temp._rtree_check")
+    return True
+
+
+class ResultsIndex:
+    """
+    Queryable index of the template matching results of a results folder
+    (`<root>/<image name>/<image name>_<timestamp>.json` files).
+
+    Each result file is a run of an image, and each of its rects a
+    detection. Detections are stored in a SQLite file (`.results_index.sqlite`
+    in the folder by default), with an R*Tree over their boxes when SQLite
+    has the module, and a plain index otherwise, so that region queries don't
+    load any result file.
+
+    Runs are added as they complete (see `TemplateMatcher`), and `refresh`
+    picks up the files that were added, changed or removed since. Each run
+    has a sequence number, bumped when it is added again or touched (e.g. when
+    memoized outputs are reused), and the run of an image with the highest one
+    is its latest. By default, queries only look at the latest run of each
+    image.
+
+    ```python
+        index = ResultsIndex("results/")
+        index.refresh()
+        index.detections(label="2", region=(0, 0, 1000, 1000))
+        index.images(min_count=50)
+    ```
+    """
+
+    def __init__(self, root: str, index_path: str | None = None):
+        os.makedirs(root, exist_ok=True)
+        self.root = os.path.abspath(root)
+        self.index_path = index_path or os.path.join(self.root, INDEX_NAME)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.index_path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY, image TEXT, path TEXT,
+                mtime_ns INTEGER, count INTEGER, latest INTEGER, seq INTEGER,
+                UNIQUE (image, path)
+            );
+            CREATE INDEX IF NOT EXISTS runs_image ON runs (image);
+            CREATE TABLE IF NOT EXISTS detections (
+                id INTEGER PRIMARY KEY, run_id INTEGER, label TEXT,
+                xmin INTEGER, ymin INTEGER, xmax INTEGER, ymax INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS detections_run ON detections (run_id);
+            CREATE INDEX IF NOT EXISTS detections_label ON detections (label, xmin);
+            """
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(runs)")]
+        if "seq" not in columns:
+            # Index made before the sequence numbers, ids are in insertion order
+            self._conn.execute("ALTER TABLE runs ADD COLUMN seq INTEGER")
+            self._conn.execute("UPDATE runs SET seq = id")
+        self.rtree = _has_rtree(self._conn)
+        if self.rtree:
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS detections_rtree "
+                "USING rtree(id, xmin, xmax, ymin, ymax)"
+            )
+        self._conn.commit()
+
+    def _image_name(self, path: str) -> str:
+        # Results are saved in a folder per image
+        relative = os.path.relpath(path, self.root)
+        return relative.split(os.sep, 1)[0] if os.sep in relative else ""
+
+    def _delete_run(self, run_id: int):
+        if self.rtree:
+            self._conn.execute(
+                "DELETE FROM detections_rtree WHERE id IN "
+                "(SELECT id FROM detections WHERE run_id = ?)",
+                (run_id,),
+            )
+        self._conn.execute("DELETE FROM detections WHERE run_id = ?", (run_id,))
+        self._conn.execute("DELETE FROM runs WHERE id = ?", (run_id,))
+
+    def _update_latest(self, image: str):
+        self._conn.execute(
+            "UPDATE runs SET latest = (id = (SELECT id FROM runs WHERE image = ? "
+            "ORDER BY seq DESC, id DESC LIMIT 1)) WHERE image = ?",
+            (image, image),
+        )
+
+    def _next_seq(self) -> int:
+        return self._conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM runs").fetchone()[0]
+
+    def _add(
+        self,
+        image: str,
+        path: str,
+        found_labels: Dict[str, dict],
+        mtime_ns: int,
+        keep_seq: bool = False,
+    ):
+        row = self._conn.execute(
+            "SELECT id, seq FROM runs WHERE image = ? AND path = ?", (image, path)
+        ).fetchone()
+        seq = row[1] if keep_seq and row is not None else self._next_seq()
+        if row is not None:
+            self._delete_run(row[0])
+        count = sum(len(result["rects"]) for result in found_labels.values())
+        run_id = self._conn.execute(
+            "INSERT INTO runs (image, path, mtime_ns, count, latest, seq) "
+            "VALUES (?, ?, ?, ?, 0, ?)",
+            (image, path, mtime_ns, count, seq),
+        ).lastrowid
+        for label, result in found_labels.items():
+            for x, y, w, h in result["rects"]:
+                detection_id = self._conn.execute(
+                    "INSERT INTO detections (run_id, label, xmin, ymin, xmax, ymax) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (run_id, label, x, y, x + w, y + h),
+                ).lastrowid
+                if self.rtree:
+                    self._conn.execute(
+                        "INSERT INTO detections_rtree VALUES (?, ?, ?, ?, ?)",
+                        (detection_id, x, x + w, y, y + h),
+                    )
+        self._update_latest(image)
+
+    def add(
+        self,
+        json_path: str,
+        image_name: str | None = None,
+        found_labels: Dict[str, dict] | None = None,
+    ):
+        """
+        Index a result file as the latest run of its image, replacing its
+        previous detections. `image_name` defaults to the folder of the file,
+        and `found_labels` to its content.
+        """
+        path = os.path.abspath(json_path)
+        if found_labels is None:
+            with open(path, "r", encoding="utf8") as f:
+                found_labels = json.load(f)
+        image = image_name if image_name is not None else self._image_name(path)
+        mtime_ns = os.stat(path).st_mtime_ns
+        with self._lock:
+            self._add(image, path, found_labels, mtime_ns)
+            self._conn.commit()
+
+    def touch(
+        self,
+        json_path: str,
+        image_name: str | None = None,
+        found_labels: Dict[str, dict] | None = None,
+    ):
+        """
+        Make an indexed result file the latest run of its image again, without
+        reading it, e.g. when a run reuses memoized outputs. Its modification
+        time is updated too. Files not indexed yet for the image are added, see
+        `add`.
+        """
+        path = os.path.abspath(json_path)
+        image = image_name if image_name is not None else self._image_name(path)
+        # So that `rebuild`, which orders new files by mtime, agrees
+        os.utime(path)
+        mtime_ns = os.stat(path).st_mtime_ns
+        with self._lock:
+            touched = self._conn.execute(
+                "UPDATE runs SET seq = (SELECT MAX(seq) FROM runs) + 1, mtime_ns = ? "
+                "WHERE image = ? AND path = ?",
+                (mtime_ns, image, path),
+            ).rowcount
+            if touched:
+                self._update_latest(image)
+                self._conn.commit()
+                return
+        self.add(json_path, image_name, found_labels)
+
+    def refresh(self) -> int:
+        """
+        Bring the index up to date with the results folder: index the new and
+        changed result files, and forget the runs whose file was removed.
+
+        Returns the number of files read.
+        """
+        with self._lock:
+            known = {}
+            for run_id, image, path, mtime_ns in self._conn.execute(
+                "SELECT id, image, path, mtime_ns FROM runs"
+            ):
+                known.setdefault(path, []).append((run_id, image, mtime_ns))
+
+        changed = []
+        seen = set()
+        for folder, _, names in os.walk(self.root):
+            for name in names:
+                if (
+                    folder == self.root
+                    or not name.endswith(".json")
+                    or name.startswith(".")
+                    or name in _STATE_FILES
+                ):
+                    continue
+                path = os.path.join(folder, name)
+                seen.add(path)
+                mtime_ns = os.stat(path).st_mtime_ns
+                runs = known.get(path)
+                if runs is None or any(run[2] != mtime_ns for run in runs):
+                    changed.append((path, mtime_ns))
+
+        read = 0
+        # New files get sequence numbers in the order they were written
+        changed.sort(key=lambda item: item[1])
+        with self._lock:
+            images = set()
+            for path in known.keys() - seen:
+                for run_id, image, _ in known[path]:
+                    self._delete_run(run_id)
+                    images.add(image)
+            for path, mtime_ns in changed:
+                try:
+                    with open(path, "r", encoding="utf8") as f:
+                        found_labels = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                if not isinstance(found_labels, dict) or not all(
+                    isinstance(result, dict) and "rects" in result
+                    for result in found_labels.values()
+                ):
+                    continue
+                read += 1
+                # Outputs shared by identical runs (see `ResultsStore`) stay
+                # indexed under each of their images
+                for image in [run[1] for run in known.get(path, [])] or [
+                    self._image_name(path)
+                ]:
+                    self._add(image, path, found_labels, mtime_ns, keep_seq=True)
+            for image in images:
+                self._update_latest(image)
+            self._conn.commit()
+        return read
+
+    def rebuild(self) -> int:
+        """
+        Forget everything and index the whole results folder again.
+        """
+        with self._lock:
+            if self.rtree:
+                self._conn.execute("DELETE FROM detections_rtree")
+            self._conn.execute("DELETE FROM detections")
+            self._conn.execute("DELETE FROM runs")
+            self._conn.commit()
+        return self.refresh()
+
+    def _where(
+        self,
+        label: str | None,
+        region: Rect | None,
+        overlapping: bool,
+        image: str | None,
+        latest: bool,
+    ) -> Tuple[str, list]:
+        conditions, params = [], []
+        if latest:
+            conditions.append("runs.latest = 1")
+        if image is not None:
+            conditions.append("runs.image = ?")
+            params.append(image)
+        if label is not None:
+            conditions.append("detections.label = ?")
+            params.append(label)
+        if region is not None:
+            x, y, w, h = region
+            if overlapping:
+                bounds = ["xmax >= ?", "xmin <= ?", "ymax >= ?", "ymin <= ?"]
+            else:
+                bounds = ["xmin >= ?", "xmax <= ?", "ymin >= ?", "ymax <= ?"]
+            values = [x, x + w, y, y + h]
+            if self.rtree:
+                conditions.append(
+                    "detections.id IN (SELECT id FROM detections_rtree WHERE "
+                    f"{' AND '.join(bounds)})"
+                )
+            else:
+                conditions.extend(f"detections.{bound}" for bound in bounds)
+            params.extend(values)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return where, params
+
+    def detections(
+        self,
+        label: str | None = None,
+        region: Rect | None = None,
+        overlapping: bool = False,
+        image: str | None = None,
+        latest: bool = True,
+        limit: int = -1,
+        offset: int = 0,
+    ) -> List[dict]:
+        """
+        Detections matching all the given filters, as
+        `{"image", "path", "label", "rect": [x, y, w, h]}`.
+
+        :param region: `(x, y, w, h)` the detections are inside of, or
+            intersect with `overlapping`.
+        :param latest: Only look at the latest run of each image.
+        """
+        where, params = self._where(label, region, overlapping, image, latest)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT runs.image, runs.path, detections.label, detections.xmin, "
+                "detections.ymin, detections.xmax, detections.ymax "
+                f"FROM detections JOIN runs ON runs.id = detections.run_id {where} "
+                "ORDER BY runs.image, detections.id LIMIT ? OFFSET ?",
+                (*params, limit, offset),
+            ).fetchall()
+        return [
+            {
+                "image": image,
+                "path": path,
+                "label": label,
+                "rect": [xmin, ymin, xmax - xmin, ymax - ymin],
+            }
+            for image, path, label, xmin, ymin, xmax, ymax in rows
+        ]
+
+    def count(
+        self,
+        label: str | None = None,
+        region: Rect | None = None,
+        overlapping: bool = False,
+        image: str | None = None,
+        latest: bool = True,
+    ) -> int:
+        """
+        Number of detections matching the filters, see `detections`.
+        """
+        where, params = self._where(label, region, overlapping, image, latest)
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM detections "
+                f"JOIN runs ON runs.id = detections.run_id {where}",
+                params,
+            ).fetchone()[0]
+
+    def images(
+        self,
+        label: str | None = None,
+        region: Rect | None = None,
+        overlapping: bool = False,
+        min_count: int | None = None,
+        max_count: int | None = None,
+        latest: bool = True,
+        limit: int = -1,
+        offset: int = 0,
+    ) -> List[dict]:
+        """
+        Runs with a number of detections matching the filters between
+        `min_count` and `max_count`, most detections first, as
+        `{"image", "path", "count"}`. Without filters, runs without any
+        detection are included.
+        """
+        if label is None and region is None:
+            conditions, params = [], []
+            if latest:
+                conditions.append("latest = 1")
+            for condition, value in (("count >= ?", min_count), ("count <= ?", max_count)):
+                if value is not None:
+                    conditions.append(condition)
+                    params.append(value)
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+            query = (
+                f"SELECT image, path, count FROM runs {where} "
+                "ORDER BY count DESC, image LIMIT ? OFFSET ?"
+            )
+        else:
+            where, params = self._where(label, region, overlapping, None, latest)
+            having = []
+            for condition, value in (
+                ("COUNT(*) >= ?", min_count),
+                ("COUNT(*) <= ?", max_count),
+            ):
+                if value is not None:
+                    having.append(condition)
+                    params.append(value)
+            query = (
+                "SELECT runs.image, runs.path, COUNT(*) AS hits FROM detections "
+                f"JOIN runs ON runs.id = detections.run_id {where} "
+                "GROUP BY runs.id "
+                f"{'HAVING ' + ' AND '.join(having) if having else ''} "
+                "ORDER BY hits DESC, runs.image LIMIT ? OFFSET ?"
+            )
+        with self._lock:
+            rows = self._conn.execute(query, (*params, limit, offset)).fetchall()
+        return [{"image": image, "path": path, "count": count} for image, path, count in rows]
+
+    def labels(self, latest: bool = True) -> Dict[str, int]:
+        """
+        Number of detections per label.
+        """
+        where = "WHERE runs.latest = 1" if latest else ""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT detections.label, COUNT(*) FROM detections "
+                f"JOIN runs ON runs.id = detections.run_id {where} "
+                "GROUP BY detections.label ORDER BY detections.label"
+            ).fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
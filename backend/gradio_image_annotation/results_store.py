@@ -0,0 +1,261 @@
+from __future__ import annotations
+
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, List
+
+INDEX_NAME = ".runs.json"
+DEFAULT_MAX_BYTES = 1 << 30  # 1 GiB
+_RESULT_EXTENSIONS = (".png", ".json")
+# Files of the results folder that are state, not outputs
+_STATE_FILES = ("match_state.json",)
+_CHUNK_SIZE = 1 << 20
+# Seconds between two saves of the index for the `last_used` times updated by
+# hits, which are otherwise only kept in memory
+TOUCH_SAVE_INTERVAL = 30.0
+
+_shared_stores: Dict[str, ResultsStore] = {}
+_shared_stores_lock = threading.Lock()
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def run_key(image_hash: str, template_hashes: Iterable[str], **params) -> str:
+    """
+    Key of a template matching run: the image content, the set of templates
+    (as content hashes, order doesn't matter) and the matching parameters.
+    """
+    payload = {
+        "image": image_hash,
+        "templates": sorted(template_hashes),
+        "params": params,
+    }
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+class ResultsStore:
+    """
+    Memo of the template matching runs saved in the results folder.
+
+    Runs are recorded under a key of their inputs (see `run_key`), so an
+    identical request gets the saved outputs back instead of matching and
+    writing a new PNG and JSON. Outputs are also addressed by content: when a
+    new output is identical to one already stored, the new file is removed
+    and the existing one is used.
+
+    The total size of the recorded outputs is capped to `max_bytes`, evicting
+    the least recently used runs first. `compact` also takes the outputs of
+    older, unrecorded runs into account.
+
+    Hits only update the index on disk every `TOUCH_SAVE_INTERVAL` seconds,
+    `flush` saves the pending updates. A store owns the index file of its
+    folder: use `ResultsStore.shared` so that the stores of a process don't
+    overwrite each other's index.
+    """
+
+    def __init__(self, root: str, max_bytes: int | None = DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(root, INDEX_NAME)
+        self._lock = threading.Lock()
+        # run key -> {"paths": {...}, "hashes": {...}, "last_used": ..., **info}
+        self.runs: Dict[str, dict] = {}
+        # output content hash -> path
+        self.objects: Dict[str, str] = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf8") as f:
+                data = json.load(f)
+            self.runs = data.get("runs", {})
+            self.objects = data.get("objects", {})
+        self._dirty = False
+        self._saved_at = time.monotonic()
+
+    @classmethod
+    def shared(cls, root: str, max_bytes: int | None = DEFAULT_MAX_BYTES) -> ResultsStore:
+        """
+        The store of a folder shared by the whole process, created on first
+        use with `max_bytes`. Pending `last_used` updates are saved at exit.
+        """
+        path = os.path.abspath(root)
+        with _shared_stores_lock:
+            store = _shared_stores.get(path)
+            if store is None:
+                store = _shared_stores[path] = cls(root, max_bytes=max_bytes)
+                atexit.register(store.flush)
+            return store
+
+    def _save(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{self.index_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf8") as f:
+            json.dump({"runs": self.runs, "objects": self.objects}, f)
+        os.replace(tmp_path, self.index_path)
+        self._dirty = False
+        self._saved_at = time.monotonic()
+
+    def flush(self):
+        """
+        Save the `last_used` times of the hits not saved yet.
+        """
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def get(self, key: str) -> dict | None:
+        """
+        The recorded run of a key, if its outputs still exist.
+        """
+        with self._lock:
+            run = self.runs.get(key)
+            if run is None:
+                return None
+            if not all(os.path.exists(path) for path in run["paths"].values()):
+                del self.runs[key]
+                self._save()
+                return None
+            run["last_used"] = time.time()
+            self._dirty = True
+            if time.monotonic() - self._saved_at >= TOUCH_SAVE_INTERVAL:
+                self._save()
+            return run
+
+    def record(self, key: str, paths: Dict[str, str], **info) -> dict:
+        """
+        Record the output files of a run, e.g. `{"image": ..., "json": ...}`,
+        with any extra `info` to return on a hit. Returns the run, whose paths
+        may point to identical outputs stored before.
+        """
+        with self._lock:
+            stored_paths, hashes = {}, {}
+            for name, path in paths.items():
+                digest = file_hash(path)
+                existing = self.objects.get(digest)
+                if existing and existing != path and os.path.exists(existing):
+                    os.remove(path)
+                    path = existing
+                else:
+                    self.objects[digest] = path
+                stored_paths[name] = path
+                hashes[name] = digest
+
+            run = {
+                "paths": stored_paths,
+                "hashes": hashes,
+                "last_used": time.time(),
+                **info,
+            }
+            self.runs[key] = run
+            if self.max_bytes is not None:
+                self._evict(self.max_bytes, keep=key)
+            self._save()
+            return run
+
+    def _referenced(self) -> Dict[str, List[str]]:
+        referenced = {}
+        for key, run in self.runs.items():
+            for path in run["paths"].values():
+                referenced.setdefault(path, []).append(key)
+        return referenced
+
+    def _remove_runs(self, keys: Iterable[str]):
+        keys = set(keys)
+        for key in keys:
+            self.runs.pop(key, None)
+        still_used = self._referenced()
+        self.objects = {
+            digest: path for digest, path in self.objects.items() if path in still_used
+        }
+
+    def _evict(self, max_bytes: int, keep: str | None = None):
+        referenced = self._referenced()
+        total = sum(os.path.getsize(path) for path in referenced if os.path.exists(path))
+        evicted = []
+        for key in sorted(self.runs, key=lambda key: self.runs[key]["last_used"]):
+            if total <= max_bytes:
+                break
+            if key == keep:
+                continue
+            for path in set(self.runs[key]["paths"].values()):
+                referenced[path].remove(key)
+                # Outputs shared with other runs are kept
+                if not referenced[path] and os.path.exists(path):
+                    total -= os.path.getsize(path)
+                    os.remove(path)
+            evicted.append(key)
+        self._remove_runs(evicted)
+
+    def compact(self, max_bytes: int | None = None):
+        """
+        Dedupe identical outputs in the whole results folder, forget runs
+        whose outputs were removed, and delete the oldest outputs until the
+        folder is under `max_bytes` (the store's cap by default).
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        with self._lock:
+            self._remove_runs(
+                key
+                for key, run in self.runs.items()
+                if not all(os.path.exists(path) for path in run["paths"].values())
+            )
+            referenced = self._referenced()
+
+            files = []
+            for folder, _, names in os.walk(self.root):
+                for name in names:
+                    path = os.path.join(folder, name)
+                    if (
+                        name.endswith(_RESULT_EXTENSIONS)
+                        and not name.startswith(".")
+                        and name not in _STATE_FILES
+                    ):
+                        files.append(path)
+
+            # Dedupe, keeping recorded outputs over unrecorded ones
+            survivors = {}
+            for path in sorted(files, key=lambda path: path not in referenced):
+                digest = file_hash(path)
+                survivor = survivors.setdefault(digest, path)
+                if survivor == path:
+                    continue
+                for key in referenced.get(path, []):
+                    paths = self.runs[key]["paths"]
+                    for name in paths:
+                        if paths[name] == path:
+                            paths[name] = survivor
+                os.remove(path)
+            self.objects = {
+                digest: path
+                for digest, path in survivors.items()
+                if any(path in run["paths"].values() for run in self.runs.values())
+            }
+            referenced = self._referenced()
+
+            if max_bytes is not None:
+                # Least recently used first, by mtime for unrecorded outputs
+                def last_used(path):
+                    keys = referenced.get(path)
+                    if keys:
+                        return max(self.runs[key]["last_used"] for key in keys)
+                    return os.path.getmtime(path)
+
+                remaining = sorted(survivors.values(), key=last_used)
+                total = sum(os.path.getsize(path) for path in remaining)
+                removed_runs = set()
+                for path in remaining:
+                    if total <= max_bytes:
+                        break
+                    total -= os.path.getsize(path)
+                    os.remove(path)
+                    removed_runs.update(referenced.get(path, []))
+                self._remove_runs(removed_runs)
+            self._save()
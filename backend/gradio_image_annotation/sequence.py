@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import os
+import re
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+import cv2
+import numpy as np
+
+from .directory_source import IMAGE_EXTENSIONS
+from .matching import MatchEngine, Rect, is_overlapping, merge_regions
+from .template_matcher import MatchParams, distinct_colors
+from .utils import format_template_matching_output
+
+_DIGITS = re.compile(r"(\d+)")
+
+
+def _natural_key(name: str) -> list:
+    # "frame_10.png" after "frame_9.png"
+    return [int(part) if part.isdigit() else part.lower() for part in _DIGITS.split(name)]
+
+
+def iter_frames(source: str, step: int = 1) -> Iterator[Tuple[str, str | None, np.ndarray]]:
+    """
+    Frames of an image folder, in natural order of their names, or of a video
+    file, as `(name, file path, BGR image)`. Video frames have no file path and
+    are named by their index, e.g. "frame_000042".
+
+    Only every `step`-th frame is read. Unreadable images are skipped.
+    """
+    if step < 1:
+        raise ValueError(f"step must be positive, got {step}")
+
+    if os.path.isdir(source):
+        names = sorted(
+            (
+                name
+                for name in os.listdir(source)
+                if name.lower().endswith(IMAGE_EXTENSIONS)
+            ),
+            key=_natural_key,
+        )
+        for name in names[::step]:
+            file_path = os.path.join(source, name)
+            image = cv2.imread(file_path)
+            if image is not None:
+                yield name, file_path, image
+        return
+
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open {source} as an image folder or a video")
+    try:
+        index = 0
+        while True:
+            # Skipped frames are only grabbed, not decoded
+            if index % step == 0:
+                ok, image = capture.read()
+                if not ok:
+                    break
+                yield f"frame_{index:06d}", None, image
+            elif not capture.grab():
+                break
+            index += 1
+    finally:
+        capture.release()
+
+
+def crop_templates(image_path: str, rectangles: List[dict]) -> List[Tuple[str, np.ndarray]]:
+    """
+    `(label, BGR crop)` templates of the annotated boxes of an image, given as
+    `{"label": ..., "rect": [x, y, w, h]}` like `TemplateMatcher.match`.
+    Boxes labeled "ignore" are left out.
+    """
+    image = cv2.imread(image_path)
+    if image is None:
+        raise ValueError(f"Could not read {image_path}")
+    templates = []
+    for item in rectangles:
+        if item["label"] == "ignore":
+            continue
+        x, y, w, h = item["rect"]
+        crop = image[y : y + h, x : x + w]
+        if crop.size:
+            templates.append((item["label"], crop.copy()))
+    return templates
+
+
+class _Windows:
+    """
+    Search windows around the last detections of a label, used in place of a
+    `FeaturePruner`: a template is only correlated around the rects it was
+    found at, each grown by its own margin times its largest side.
+    """
+
+    def __init__(self, rects: List[Tuple[Rect, float]]):
+        self.rects = rects  # (rect, margin)
+
+    def detect(self, image_processed: np.ndarray) -> tuple:
+        return image_processed.shape[:2]
+
+    def regions(
+        self, image_features: tuple, template_processed: np.ndarray
+    ) -> List[Rect]:
+        image_h, image_w = image_features
+        temp_h, temp_w = template_processed.shape[:2]
+        regions = []
+        for (x, y, w, h), margin in self.rects:
+            pad = int(max(w, h) * margin)
+            # Centered on the previous rect, and large enough for the template
+            # at any angle
+            side_w, side_h = max(w, temp_w) + 2 * pad, max(h, temp_h) + 2 * pad
+            cx, cy = x + w // 2, y + h // 2
+            xmin, ymin = max(cx - side_w // 2, 0), max(cy - side_h // 2, 0)
+            xmax = min(cx - side_w // 2 + side_w, image_w)
+            ymax = min(cy - side_h // 2 + side_h, image_h)
+            if xmax - xmin >= temp_w and ymax - ymin >= temp_h:
+                regions.append((xmin, ymin, xmax - xmin, ymax - ymin))
+        return merge_regions(regions)
+
+
+class SequenceMatcher:
+    """
+    Template matching over the frames of a fixed camera, where objects barely
+    move from one frame to the next.
+
+    Keyframes, every `rescan_every` frames starting with the first one, are
+    searched in full. In the frames in between, each template is only
+    correlated in windows around the last hits of its label (see `_Windows`).
+    A hit missed in a frame, e.g. briefly occluded, is still searched around
+    where it was last seen, with the margin growing by `margin` for each
+    missed frame. Labels not found since the last keyframe are not searched
+    until the next one. The full re-scans pick up objects that
+    appeared and correct the drift of the windows.
+
+    ```python
+        sequence = SequenceMatcher([("screw", template)], rescan_every=30)
+        for frame in sequence.run(iter_frames("video.mp4")):
+            print(frame["name"], len(frame["boxes"]))
+    ```
+    """
+
+    def __init__(
+        self,
+        templates: List[Tuple[str, np.ndarray]],
+        params: MatchParams | None = None,
+        rescan_every: int = 30,
+        margin: float = 0.5,
+    ):
+        if rescan_every < 1:
+            raise ValueError(f"rescan_every must be positive, got {rescan_every}")
+        if margin < 0:
+            raise ValueError(f"margin must not be negative, got {margin}")
+        self.templates = templates
+        self.params = params or MatchParams()
+        self.rescan_every = rescan_every
+        self.margin = margin
+        self.engine = MatchEngine()
+        labels = list(dict.fromkeys(label for label, _ in templates))
+        self.colors = dict(zip(labels, distinct_colors(len(labels))))
+
+    def match_frame(
+        self,
+        image: np.ndarray,
+        tracked: Dict[str, List[Tuple[Rect, int]]] | None = None,
+    ) -> Dict[str, List[Rect]]:
+        """
+        Rects per label found in a BGR frame, searching the whole frame, or
+        only around the `tracked` hits when given, as `(rect, missed)` pairs
+        per label where `missed` is the number of frames since the rect was
+        last found.
+        """
+        params = self.params
+        image_processed = self.engine.preprocess(image)
+        if tracked is None:
+            return self.engine.find(
+                image_processed,
+                self.templates,
+                params.angles,
+                params.accuracy_threshold,
+                params.rect_overlap_threshold,
+            )
+
+        found_labels = {}
+        image_features = image_processed.shape[:2]
+        for label, template in self.templates:
+            rects = tracked.get(label)
+            if not rects:
+                continue
+            self.engine.find_template(
+                image_processed,
+                label,
+                template,
+                params.angles,
+                params.accuracy_threshold,
+                params.rect_overlap_threshold,
+                found_labels,
+                _Windows(
+                    [(rect, self.margin * (1 + missed)) for rect, missed in rects]
+                ),
+                image_features,
+            )
+        return found_labels
+
+    def run(
+        self, frames: Iterable[Tuple[str, str | None, np.ndarray]]
+    ) -> Iterator[dict]:
+        """
+        Match each frame of `frames` (see `iter_frames`) and yield, as soon as
+        it is done:
+
+        - `index`, `name`, `file_path` and `image`: the frame.
+        - `keyframe`: whether the whole frame was searched.
+        - `found_labels`: the hits in the format of the result JSON files,
+          `{label: {"color": [r, g, b], "rects": [...]}}`.
+        - `boxes`: the hits as `ImageAnnotator` boxes.
+        """
+        tracked: Dict[str, List[Tuple[Rect, int]]] = {}
+        for index, (name, file_path, image) in enumerate(frames):
+            keyframe = index % self.rescan_every == 0
+            if keyframe:
+                found_rects = self.match_frame(image)
+                tracked = {}
+            else:
+                found_rects = self.match_frame(image, tracked)
+            # The new hits, and the previous ones that were not found again
+            for label in set(tracked) | set(found_rects):
+                hits = found_rects.get(label, [])
+                tracked[label] = [(rect, 0) for rect in hits] + [
+                    (rect, missed + 1)
+                    for rect, missed in tracked.get(label, [])
+                    if not any(is_overlapping(rect, hit, 0) for hit in hits)
+                ]
+            found_labels = {
+                label: {"color": list(self.colors[label]), "rects": rects}
+                for label, rects in found_rects.items()
+            }
+            yield {
+                "index": index,
+                "name": name,
+                "file_path": file_path,
+                "image": image,
+                "keyframe": keyframe,
+                "found_labels": found_labels,
+                "boxes": format_template_matching_output(found_labels),
+            }
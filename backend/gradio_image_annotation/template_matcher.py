@@ -0,0 +1,466 @@
+from __future__ import annotations
+
+import colorsys
+import json
+import os
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+from .crop_dataset import crop_file_name
+from .matching import (
+    FeaturePruner,
+    MatchBudget,
+    MatchEngine,
+    MatchState,
+    draw_matches,
+    template_hash,
+)
+from .metrics import CACHE_REQUESTS, CALL_SECONDS, timed
+from .results_index import ResultsIndex
+from .results_store import DEFAULT_MAX_BYTES, ResultsStore, file_hash, run_key
+
+TEMPLATE_EXTENSIONS = (".jpg", ".png", ".jpeg")
+# Buffers each thread's engine keeps between runs, see `MatchEngine.trim_buffers`
+ENGINE_KEEP_BYTES = 64 << 20
+
+
+@dataclass(frozen=True)
+class MatchParams:
+    """
+    Parameters of a template matching run.
+    """
+
+    accuracy_threshold: float = 0.8
+    rect_overlap_threshold: float = 0.2
+    # Step of the template rotations in degrees, 0 to not rotate them
+    selected_angle: int = 90
+    # Only correlate where ORB keypoints match, see `FeaturePruner`
+    use_features: bool = False
+
+    @property
+    def angles(self) -> List[int]:
+        if int(self.selected_angle) != 0:
+            return list(range(0, 360, int(self.selected_angle)))
+        return [0]
+
+
+@lru_cache(maxsize=None)
+def distinct_colors(n: int) -> Tuple[Tuple[int, int, int], ...]:
+    """
+    `n` RGB colors of evenly spaced hues.
+    """
+    hue_partition = 1.0 / (n + 1)
+    colors = []
+    for value in range(n):
+        r, g, b = colorsys.hsv_to_rgb(hue_partition * value, 1.0, 1.0)
+        colors.append((int(255 * r), int(255 * g), int(255 * b)))
+    return tuple(colors)
+
+
+class _Template:
+    """
+    A template image, preprocessed at each angle on first use.
+    """
+
+    __slots__ = ("label", "image", "hash", "signature", "prepared")
+
+    def __init__(self, label: str, image: np.ndarray, signature: tuple | None = None):
+        self.label = label
+        self.image = image
+        self.hash = template_hash(image)
+        # (size, mtime) of the file it was loaded from
+        self.signature = signature
+        self.prepared: Dict[float, np.ndarray] = {}
+
+
+class TemplateMatcher:
+    """
+    Template matching engine meant to be kept alive and shared between
+    requests, e.g. by a web app or a batch worker.
+
+    The template library (`template_dir/<folder>/<label>/<image>`) is loaded
+    on first use and kept in memory with each template preprocessed at each
+    angle. Files that were added, changed or removed are picked up on the next
+    call. Results are saved in `result_dir` and memoized, see `ResultsStore`.
+
+    `match` can be called from several threads: each thread works in its own
+    `MatchEngine` buffers, trimmed to `ENGINE_KEEP_BYTES` after each run, and
+    calls on the same image are serialized.
+
+    Pass a `MatchBudget` to bound a run in time and number of hits. Partial
+    runs are saved like the others but not memoized.
+
+    With a `results_index`, each new result is added to it as it is saved,
+    see `ResultsIndex`.
+
+    ```python
+        matcher = TemplateMatcher("templates", "results")
+        matcher.match("image.png", boxes, "image", MatchParams(selected_angle=90))
+    ```
+    """
+
+    def __init__(
+        self,
+        template_dir: str,
+        result_dir: str,
+        max_results_bytes: int | None = DEFAULT_MAX_BYTES,
+        results_index: ResultsIndex | None = None,
+    ):
+        self.template_dir = template_dir
+        self.result_dir = result_dir
+        self.store = ResultsStore.shared(result_dir, max_bytes=max_results_bytes)
+        self.results_index = results_index
+        self._templates: Dict[str, _Template] = {}  # path -> template
+        self._library_lock = threading.Lock()
+        self._image_locks: Dict[str, threading.Lock] = {}
+        self._image_locks_lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def engine(self) -> MatchEngine:
+        """
+        The engine of the current thread.
+        """
+        engine = getattr(self._local, "engine", None)
+        if engine is None:
+            engine = self._local.engine = MatchEngine()
+        return engine
+
+    def _image_lock(self, image_name: str) -> threading.Lock:
+        with self._image_locks_lock:
+            return self._image_locks.setdefault(image_name, threading.Lock())
+
+    def load_templates(self, folders: List[str]) -> List[_Template]:
+        """
+        Templates of the given folders of the library, reading only the files
+        that are new or changed since the last call.
+        """
+        templates = []
+        with self._library_lock:
+            for folder in folders:
+                folder_path = os.path.join(self.template_dir, folder)
+                seen = set()
+                for label in os.listdir(folder_path):
+                    label_path = os.path.join(folder_path, label)
+                    if not os.path.isdir(label_path):
+                        continue
+                    for filename in os.listdir(label_path):
+                        if not filename.lower().endswith(TEMPLATE_EXTENSIONS):
+                            continue
+                        path = os.path.join(label_path, filename)
+                        seen.add(path)
+                        template = self._load_template(path, label)
+                        if template is not None:
+                            templates.append(template)
+                # Forget the templates removed from this folder
+                for path in list(self._templates):
+                    if path.startswith(folder_path + os.sep) and path not in seen:
+                        del self._templates[path]
+        return templates
+
+    def _load_template(self, path: str, label: str) -> _Template | None:
+        stat = os.stat(path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        template = self._templates.get(path)
+        hit = template is not None and template.signature == signature
+        CACHE_REQUESTS.inc(cache="templates", result="hit" if hit else "miss")
+        if not hit:
+            image = cv2.imread(path)
+            if image is None:
+                return None
+            template = self._templates[path] = _Template(label, image, signature)
+        return template
+
+    def _prepare(self, template: _Template, angle: float) -> np.ndarray:
+        prepared = template.prepared.get(angle)
+        CACHE_REQUESTS.inc(
+            cache="prepared_templates", result="miss" if prepared is None else "hit"
+        )
+        if prepared is None:
+            prepared = template.prepared[angle] = self.engine.prepare(
+                template.image, angle
+            ).copy()
+        return prepared
+
+    def _plan(self, image_processed, templates, angles, budget, prepare=None):
+        """
+        `(template, angles)` pairs in matching order: the given order without
+        a budget, most promising first with one, see `MatchEngine.plan`.
+        """
+        if budget is None:
+            return [(template, angles) for template in templates]
+
+        def prepare_index(index, angle):
+            if prepare is not None:
+                return prepare(templates[index], angle)
+            return self.engine.prepare(templates[index].image, angle)
+
+        order = self.engine.plan(image_processed, len(templates), angles, prepare_index)
+        return [(templates[index], template_angles) for index, template_angles in order]
+
+    @timed(CALL_SECONDS, method="TemplateMatcher.match")
+    def match(
+        self,
+        image_path: str,
+        rectangles: List[dict],
+        image_name: str,
+        params: MatchParams | None = None,
+        folders: List[str] | None = None,
+        budget: MatchBudget | None = None,
+    ) -> tuple:
+        """
+        Find objects similar to the templates in an image.
+
+        :param image_path: Path to the image file.
+        :param rectangles: Annotated boxes as `{"label": ..., "rect": [x, y, w, h]}`.
+            Boxes labeled "ignore" are left out of the search. Without
+            `folders`, the other boxes are the templates ("annotate" mode).
+        :param image_name: Name of the image, used to name the crops and results.
+        :param params: Matching parameters.
+        :param folders: Folders of the template library to use ("file" mode).
+        :param budget: Limits of the run. When it stopped early, the results
+            are the best hits found so far and `budget.partial` is True.
+        :return: Path of the result image, path of the result JSON, name of
+            the result image, found rects per label, number of found rects.
+        """
+        params = params or MatchParams()
+        if budget is not None:
+            budget.start()
+        try:
+            with self._image_lock(image_name):
+                return self._match(
+                    image_path, rectangles, image_name, params, folders, budget
+                )
+        finally:
+            # The engine lives as long as its thread, don't keep the
+            # image-sized buffers of the largest image ever matched
+            self.engine.trim_buffers(ENGINE_KEEP_BYTES)
+
+    def _match(
+        self, image_path, rectangles, image_name, params, folders, budget
+    ) -> tuple:
+        engine = self.engine
+        angles = params.angles
+
+        # rectangles without the ones with ignore labels
+        filtered_rectangles = []
+        ignore_rects = []
+        for item in rectangles:
+            if item["label"] == "ignore":
+                ignore_rects.append(list(item["rect"]))
+            else:
+                filtered_rectangles.append(item)
+
+        # sort by area (w * h) in descending order
+        filtered_rectangles.sort(key=lambda x: x["rect"][2] * x["rect"][3], reverse=True)
+
+        if folders is None:
+            # The annotations are cropped from the image once it is loaded,
+            # the image content and their rects identify them until then
+            templates = None
+            labels = [item["label"] for item in filtered_rectangles]
+            template_keys = [
+                f"{item['label']}:rect:{','.join(str(v) for v in item['rect'])}"
+                for item in filtered_rectangles
+            ]
+        else:
+            templates = self.load_templates(folders)
+            labels = [template.label for template in templates]
+            template_keys = [f"{template.label}:{template.hash}" for template in templates]
+
+        unique_labels = list(dict.fromkeys(labels))
+        unique_labels_with_color = dict(
+            zip(unique_labels, distinct_colors(len(unique_labels)))
+        )
+
+        # Identical requests get the outputs of a previous run back, before the
+        # image is even decoded. Results of budgeted runs depend on their
+        # limits, but not on the time limit when they complete
+        budget_key = {}
+        if budget is not None:
+            budget_key["budget"] = {
+                name: value
+                for name, value in budget.limits().items()
+                if name != "time_limit"
+            }
+        key = run_key(
+            file_hash(image_path),
+            template_keys,
+            accuracy_threshold=params.accuracy_threshold,
+            rect_overlap_threshold=params.rect_overlap_threshold,
+            angles=angles,
+            use_features=bool(params.use_features),
+            ignore_rects=ignore_rects,
+            **budget_key,
+        )
+        run = self.store.get(key)
+        CACHE_REQUESTS.inc(cache="results", result="miss" if run is None else "hit")
+        if run is not None:
+            with open(run["paths"]["json"], "r", encoding="utf8") as f:
+                found_labels = json.load(f)
+            # The reused outputs are the latest run of the image now
+            if self.results_index is not None:
+                self.results_index.touch(run["paths"]["json"], image_name, found_labels)
+            return (
+                run["paths"]["image"],
+                run["paths"]["json"],
+                os.path.basename(run["paths"]["image"]),
+                found_labels,
+                run["count"],
+            )
+
+        # Load the image
+        image = cv2.imread(image_path)
+        image_processed = engine.preprocess(image)
+        for x, y, w, h in ignore_rects:
+            image_processed[y : y + h, x : x + w] = 255  # white out the ignore area
+
+        if templates is None:
+            # Save the annotations as templates
+            templates = []
+            for item in filtered_rectangles:
+                x, y, w, h = item["rect"]
+                crop_tmpl = image[y : y + h, x : x + w]
+                label_dir = os.path.join(self.template_dir, image_name, item["label"])
+                os.makedirs(label_dir, exist_ok=True)
+                cropped_tmpl_path = os.path.join(label_dir, crop_file_name(x, y, w, h))
+                if not os.path.exists(cropped_tmpl_path):
+                    cv2.imwrite(cropped_tmpl_path, crop_tmpl)
+                templates.append(_Template(item["label"], crop_tmpl))
+
+        pruner = FeaturePruner() if params.use_features else None
+        image_features = None
+
+        if folders is None:
+            # Only match the templates not matched yet with the same
+            # parameters, on top of the hits of the previous runs
+            stat = os.stat(image_path)
+            state = MatchState(
+                os.path.join(self.result_dir, image_name, MatchState.FILE_NAME),
+                {
+                    "image": [stat.st_size, stat.st_mtime_ns],
+                    "accuracy_threshold": params.accuracy_threshold,
+                    "rect_overlap_threshold": params.rect_overlap_threshold,
+                    "angles": angles,
+                    "use_features": bool(params.use_features),
+                    "ignore_rects": ignore_rects,
+                    **budget_key,
+                },
+            )
+            found_rects = state.found_labels(
+                [MatchState.key(template.label, template.hash) for template in templates],
+                unique_labels_with_color,
+            )
+            pending = [
+                template
+                for template in templates
+                if MatchState.key(template.label, template.hash) not in state.hits
+            ]
+            for template, template_angles in self._plan(
+                image_processed, pending, angles, budget
+            ):
+                if pruner is not None and image_features is None:
+                    image_features = pruner.detect(image_processed)
+                new_rects = engine.find_template(
+                    image_processed,
+                    template.label,
+                    template.image,
+                    template_angles,
+                    params.accuracy_threshold,
+                    params.rect_overlap_threshold,
+                    found_rects,
+                    pruner,
+                    image_features,
+                    budget=budget,
+                )
+                # Once the budget cut some work, hits may be incomplete
+                if budget is None or not budget.partial:
+                    state.add(
+                        MatchState.key(template.label, template.hash),
+                        template.label,
+                        new_rects,
+                    )
+            state.save()
+        else:
+            found_rects = {}
+            if pruner is not None and templates:
+                image_features = pruner.detect(image_processed)
+            for template, template_angles in self._plan(
+                image_processed,
+                templates,
+                angles,
+                budget,
+                prepare=self._prepare,
+            ):
+                engine.find_template(
+                    image_processed,
+                    template.label,
+                    template.image,
+                    template_angles,
+                    params.accuracy_threshold,
+                    params.rect_overlap_threshold,
+                    found_rects,
+                    pruner,
+                    image_features,
+                    prepare=lambda angle, template=template: self._prepare(
+                        template, angle
+                    ),
+                    budget=budget,
+                )
+                if budget is not None and budget.stopped:
+                    break
+
+        found_labels = {
+            label: {"color": unique_labels_with_color[label], "rects": rects}
+            for label, rects in found_rects.items()
+        }
+        rects_found_count = sum(len(rects) for rects in found_rects.values())
+
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        save_dir = os.path.join(self.result_dir, image_name)
+        os.makedirs(save_dir, exist_ok=True)
+
+        processed_img_name = f"{image_name}_{timestamp}.png"
+        processed_img_path = f"{save_dir}/{processed_img_name}"
+        processed_img_json_path = f"{save_dir}/{image_name}_{timestamp}.json"
+
+        # Save the result image, drawn on a copy so the input is left untouched
+        cv2.imwrite(processed_img_path, draw_matches(image, found_labels))
+        # Save the result json
+        with open(processed_img_json_path, "w", encoding="utf8") as f:
+            json.dump(found_labels, f)
+
+        if budget is not None and budget.partial:
+            if self.results_index is not None:
+                self.results_index.add(processed_img_json_path, image_name, found_labels)
+            return (
+                processed_img_path,
+                processed_img_json_path,
+                processed_img_name,
+                found_labels,
+                rects_found_count,
+            )
+
+        # Identical outputs of other runs are reused, see `ResultsStore`
+        run = self.store.record(
+            key,
+            {"image": processed_img_path, "json": processed_img_json_path},
+            count=rects_found_count,
+        )
+        # The stored output may be an identical one saved for another image
+        if self.results_index is not None:
+            self.results_index.add(run["paths"]["json"], image_name, found_labels)
+
+        return (
+            run["paths"]["image"],
+            run["paths"]["json"],
+            os.path.basename(run["paths"]["image"]),
+            found_labels,
+            rects_found_count,
+        )
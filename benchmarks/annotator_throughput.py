@@ -0,0 +1,231 @@
+"""
+Throughput of `ImageAnnotator.preprocess` and `postprocess`, called directly
+without a browser, over a matrix of image sizes, formats, image modes, image
+types and box counts.
+
+Each case reports ops/sec, p50/p99 latency, and the peak and number of
+Python allocations of a single call (from tracemalloc, measured separately
+from the timings).
+
+    python benchmarks/annotator_throughput.py --sizes 512,2048 --boxes 0,1000 \
+        --output throughput.json
+
+Compare two runs with `--compare old.json`. Add `--max-side 1024` to measure
+the reduced-resolution decoding of `ImageAnnotator(max_side=...)`.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+from itertools import product
+
+import numpy as np
+import PIL.Image
+from gradio.data_classes import FileData
+
+from gradio_image_annotation import AnnotatedImageData, ImageAnnotator
+
+FORMATS = ("jpeg", "png", "jpeg-exif", "svg")
+IMAGE_MODES = ("RGB", "L")
+IMAGE_TYPES = ("numpy", "pil", "filepath")
+
+
+def make_image(folder: str, size: int, image_format: str) -> str:
+    path = os.path.join(folder, f"{size}_{image_format}")
+    if image_format == "svg":
+        path += ".svg"
+        with open(path, "w", encoding="utf8") as f:
+            f.write(
+                f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" '
+                f'height="{size}"><rect width="{size}" height="{size}" '
+                'fill="#4a90d9"/></svg>'
+            )
+        return path
+
+    rng = np.random.default_rng(size)
+    pixels = rng.integers(0, 255, (size, size, 3), dtype=np.uint8)
+    im = PIL.Image.fromarray(pixels)
+    if image_format == "png":
+        path += ".png"
+        im.save(path)
+    else:
+        path += ".jpg"
+        exif = PIL.Image.Exif()
+        if image_format == "jpeg-exif":
+            exif[274] = 6  # Rotated 90 degrees
+        im.save(path, quality=90, exif=exif)
+    return path
+
+
+def make_boxes(count: int, size: int):
+    rng = np.random.default_rng(count)
+    boxes = []
+    for i, (x, y) in enumerate(rng.integers(0, max(size - 32, 1), (count, 2))):
+        boxes.append(
+            {
+                "label": f"label_{i % 10}",
+                "color": "rgb(255, 0, 0)",
+                "xmin": int(x),
+                "ymin": int(y),
+                "xmax": int(x) + 32,
+                "ymax": int(y) + 32,
+            }
+        )
+    return boxes
+
+
+def measure(fn, min_time: float, max_iterations: int) -> dict:
+    fn()  # Warm up
+    latencies = []
+    start = time.perf_counter()
+    while len(latencies) < max_iterations and (
+        time.perf_counter() - start < min_time or len(latencies) < 3
+    ):
+        t = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t)
+    latencies.sort()
+
+    tracemalloc.start()
+    snapshot_before = tracemalloc.take_snapshot()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    snapshot_after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocations = sum(
+        stat.count_diff
+        for stat in snapshot_after.compare_to(snapshot_before, "filename")
+        if stat.count_diff > 0
+    )
+
+    return {
+        "iterations": len(latencies),
+        "ops_per_sec": round(len(latencies) / sum(latencies), 2),
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p99_ms": round(latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000, 3),
+        "peak_alloc_kb": round(peak / 1024, 1),
+        "allocations": allocations,
+    }
+
+
+def run(args) -> list:
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        images = {}
+        for size, image_format in product(args.sizes, args.formats):
+            images[size, image_format] = make_image(folder, size, image_format)
+
+        for size, image_format, image_mode, image_type, n_boxes in product(
+            args.sizes, args.formats, args.image_modes, args.image_types, args.boxes
+        ):
+            path = images[size, image_format]
+            boxes = make_boxes(n_boxes, size)
+            annotator = ImageAnnotator(
+                image_mode=image_mode, image_type=image_type, max_side=args.max_side
+            )
+            payload = AnnotatedImageData(
+                image=FileData(path=path, orig_name=os.path.basename(path)),
+                boxes=boxes,
+            )
+            if image_format == "svg" or image_type == "filepath":
+                value_image = path
+            else:
+                im = PIL.Image.open(path).convert(image_mode)
+                value_image = np.asarray(im) if image_type == "numpy" else im
+
+            case = {
+                "size": size,
+                "format": image_format,
+                "image_mode": image_mode,
+                "image_type": image_type,
+                "boxes": n_boxes,
+                "max_side": args.max_side,
+            }
+            results.append(
+                {
+                    **case,
+                    "method": "preprocess",
+                    **measure(
+                        lambda: annotator.preprocess(payload),
+                        args.min_time,
+                        args.max_iterations,
+                    ),
+                }
+            )
+            results.append(
+                {
+                    **case,
+                    "method": "postprocess",
+                    **measure(
+                        lambda: annotator.postprocess(
+                            {"image": value_image, "boxes": [dict(b) for b in boxes]}
+                        ),
+                        args.min_time,
+                        args.max_iterations,
+                    ),
+                }
+            )
+            print(
+                f"{case} preprocess {results[-2]['ops_per_sec']} ops/s, "
+                f"postprocess {results[-1]['ops_per_sec']} ops/s",
+                flush=True,
+            )
+    return results
+
+
+def compare(results: list, baseline_path: str):
+    with open(baseline_path, "r", encoding="utf8") as f:
+        baseline = json.load(f)["results"]
+
+    def key(result):
+        return tuple(
+            result[k]
+            for k in ("method", "size", "format", "image_mode", "image_type", "boxes")
+        )
+
+    baseline = {key(result): result for result in baseline}
+    for result in results:
+        old = baseline.get(key(result))
+        if old:
+            change = (result["p50_ms"] - old["p50_ms"]) / old["p50_ms"] * 100
+            print(f"{key(result)} p50 {old['p50_ms']} -> {result['p50_ms']} ms ({change:+.1f}%)")
+
+
+def main():
+    def int_list(value):
+        return [int(v) for v in value.split(",")]
+
+    def str_list(value):
+        return value.split(",")
+
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sizes", type=int_list, default=[512, 2048, 4096])
+    parser.add_argument("--formats", type=str_list, default=list(FORMATS))
+    parser.add_argument("--image-modes", type=str_list, default=list(IMAGE_MODES))
+    parser.add_argument("--image-types", type=str_list, default=list(IMAGE_TYPES))
+    parser.add_argument("--boxes", type=int_list, default=[0, 100, 5000, 50000])
+    parser.add_argument(
+        "--max-side", type=int, help="Downscale the images to this size on preprocess"
+    )
+    parser.add_argument("--min-time", type=float, default=1.0, help="Seconds per case")
+    parser.add_argument("--max-iterations", type=int, default=1000)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as f:
+            json.dump({"params": vars(args), "results": results}, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
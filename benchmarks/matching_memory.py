@@ -0,0 +1,124 @@
+"""
+Peak memory and garbage collections of the template matching inner loop,
+before (a new image per call, as `template_matching` used to do) and after
+(`MatchEngine` with reused buffers).
+
+    python benchmarks/matching_memory.py --size 2000 --templates 20 --angle 30
+"""
+
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from gradio_image_annotation.matching import MatchEngine, is_overlapping, rotation_matrix
+
+
+def make_data(size: int, n_templates: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    image = rng.integers(0, 255, (size, size, 3), dtype=np.uint8)
+    image = cv2.GaussianBlur(image, (5, 5), 0)
+    templates = []
+    for i in range(n_templates):
+        w, h = rng.integers(20, 60, 2)
+        x, y = rng.integers(0, size - 60, 2)
+        templates.append((f"label_{i % 3}", image[y : y + h, x : x + w].copy()))
+    return image, templates
+
+
+def legacy_find(image, templates, angles, accuracy_threshold, rect_overlap_threshold):
+    def preprocess_image(image):
+        gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        clahe = cv2.createCLAHE(clipLimit=0.5, tileGridSize=(3, 3))
+        contrast_enhanced = clahe.apply(gray_image)
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, 1))
+        return cv2.morphologyEx(contrast_enhanced, cv2.MORPH_OPEN, kernel)
+
+    image = image.copy()
+    image_processed = preprocess_image(image)
+    found_labels = {}
+    for label, template in templates:
+        for angle in angles:
+            h, w = template.shape[:2]
+            M, nW, nH = rotation_matrix(w, h, angle)
+            temp_processed = preprocess_image(cv2.warpAffine(template, M, (nW, nH)))
+            temp_w, temp_h = temp_processed.shape[::-1]
+            res = cv2.matchTemplate(image_processed, temp_processed, cv2.TM_CCOEFF_NORMED)
+            loc = np.where(res >= accuracy_threshold)
+            for pt in zip(*loc[::-1]):
+                rect = (int(pt[0]), int(pt[1]), temp_w, temp_h)
+                if not any(
+                    is_overlapping(rect, existing, rect_overlap_threshold)
+                    for rects in found_labels.values()
+                    for existing in rects
+                ):
+                    cv2.rectangle(image, pt, (pt[0] + temp_w, pt[1] + temp_h), (0, 0, 255), 2)
+                    found_labels.setdefault(label, []).append(rect)
+    return found_labels
+
+
+def engine_find(image, templates, angles, accuracy_threshold, rect_overlap_threshold):
+    engine = MatchEngine()
+    image_processed = engine.preprocess(image)
+    return engine.find(
+        image_processed, templates, angles, accuracy_threshold, rect_overlap_threshold
+    )
+
+
+def measure(fn, *args):
+    collections = [0]
+
+    def on_gc(phase, info):
+        if phase == "start":
+            collections[0] += 1
+
+    gc.collect()
+    gc.callbacks.append(on_gc)
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    gc.callbacks.remove(on_gc)
+    return result, {
+        "seconds": round(elapsed, 3),
+        "peak_mb": round(peak / 2**20, 2),
+        "gc_collections": collections[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=2000)
+    parser.add_argument("--templates", type=int, default=20)
+    parser.add_argument("--angle", type=int, default=30)
+    parser.add_argument("--threshold", type=float, default=0.8)
+    parser.add_argument("--overlap", type=float, default=0.2)
+    args = parser.parse_args()
+
+    image, templates = make_data(args.size, args.templates)
+    angles = list(range(0, 360, args.angle)) if args.angle else [0]
+    params = (image, templates, angles, args.threshold, args.overlap)
+
+    _, before = measure(legacy_find, *params)
+    found, after = measure(engine_find, *params)
+    print(
+        json.dumps(
+            {
+                "params": vars(args),
+                "found": sum(len(rects) for rects in found.values()),
+                "before": before,
+                "after": after,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Import time and memory of the package entry points, each measured in fresh
+interpreters.
+
+    python benchmarks/startup.py --repeat 5 --output startup.json
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+ENTRY_POINTS = {
+    "package": "import gradio_image_annotation",
+    "box_codec": "from gradio_image_annotation.box_codec import pack_boxes",
+    "box_sync": "from gradio_image_annotation import apply_box_ops",
+    "exporters": "from gradio_image_annotation.exporters import export_coco",
+    "coco_import": "from gradio_image_annotation.coco_import import CocoIndex",
+    "matching": "from gradio_image_annotation import TemplateMatcher",
+    "component": "from gradio_image_annotation import ImageAnnotator",
+}
+
+# Prints the import time in seconds, the max RSS in KiB and the heavy
+# dependencies that were imported
+_PROBE = """
+import resource, sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+heavy = [name for name in ("gradio", "cv2", "numpy", "PIL") if name in sys.modules]
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, ",".join(heavy))
+"""
+
+
+def probe(statement: str):
+    output = subprocess.run(
+        [sys.executable, "-c", _PROBE.format(statement=statement)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.split()
+    return float(output[0]), int(output[1]), output[2] if len(output) > 2 else ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    _, baseline_rss, _ = probe("pass")
+    results = {}
+    for name, statement in ENTRY_POINTS.items():
+        try:
+            runs = [probe(statement) for _ in range(args.repeat)]
+        except subprocess.CalledProcessError as e:
+            results[name] = {"error": e.stderr.strip().splitlines()[-1]}
+            continue
+        results[name] = {
+            "import_ms": round(statistics.median(run[0] for run in runs) * 1000, 1),
+            "rss_mb": round(statistics.median(run[1] for run in runs) / 1024, 1),
+            "rss_over_baseline_mb": round(
+                (statistics.median(run[1] for run in runs) - baseline_rss) / 1024, 1
+            ),
+            "heavy_imports": runs[0][2].split(",") if runs[0][2] else [],
+        }
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
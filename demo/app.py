@@ -1,29 +1,97 @@
+import hashlib
 import json
 import os
+import shutil
+from datetime import datetime
 from typing import List
 
 import gradio as gr
-from gradio_image_annotation import ImageAnnotator
+from gradio_image_annotation import (
+    ImageAnnotator,
+    MatchBudget,
+    MatchParams,
+    TemplateMatcher,
+    apply_box_delta,
+)
+from gradio_image_annotation.coco_import import CocoIndex
 from gradio_image_annotation.constants import CSS, EXAMPLE_DATA, JS_SCRIPT
+from gradio_image_annotation.crop_dataset import build_crop_dataset
+from gradio_image_annotation.directory_source import DirectorySource
+from gradio_image_annotation.exporters import export_coco, export_voc, export_yolo
+from gradio_image_annotation.metadata_index import ImageMetadataIndex
+from gradio_image_annotation.metrics import add_metrics_route, registry
+from gradio_image_annotation.prematch import PrematchQueue
+from gradio_image_annotation.results_index import ResultsIndex
+from gradio_image_annotation.sequence import (
+    SequenceMatcher,
+    crop_templates,
+    iter_frames,
+)
 from gradio_image_annotation.utils import (
     format_boxes_output,
     format_template_matching_output,
+    get_image_boxes,
     prepare_annotate_data,
-    template_matching,
 )
 
 ## GLOBALS VARIABLES ##
 current_loaded_images = {}
+# Set when browsing a folder on the server, whose images are loaded page by page
+current_source: DirectorySource | None = None
 calibration_options = {}
 TEMPLATES_DIR = "templates"
 RESULTS_DIR = "results"
+EXPORTS_DIR = "exports"
+# Metadata indexes of the server folders, kept here as the folders may be
+# read-only
+METADATA_DIR = "metadata"
+# Folders served to the annotator besides the uploaded files, e.g. the image
+# folder of an imported COCO file
+ALLOWED_PATHS = [
+    path for path in os.environ.get("ALLOWED_PATHS", "").split(os.pathsep) if path
+]
 
 os.makedirs(TEMPLATES_DIR, exist_ok=True)
 os.makedirs(RESULTS_DIR, exist_ok=True)
+os.makedirs(EXPORTS_DIR, exist_ok=True)
+os.makedirs(METADATA_DIR, exist_ok=True)
+
+# Detections of the results folder, kept up to date as runs complete
+results_index = ResultsIndex(RESULTS_DIR)
+results_index.refresh()
+# Shared by all the requests, keeps the template library loaded
+matcher = TemplateMatcher(TEMPLATES_DIR, RESULTS_DIR, results_index=results_index)
+# Matches uploaded folders in the background, on a single low priority thread
+prematch_queue = PrematchQueue(matcher, workers=1)
 
 
-def get_boxes_json(annotations):
-    return annotations["boxes"]
+def get_boxes_json(image_name, annotations):
+    if image_name in current_loaded_images:
+        return get_image_boxes(current_loaded_images[image_name])
+    return annotations.get("boxes", [])
+
+
+def export_annotations(export_format: str):
+    if not current_loaded_images:
+        gr.Info("Please select an folder first")
+        return None
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    if export_format == "COCO":
+        output_path = os.path.join(EXPORTS_DIR, f"coco_{timestamp}.json")
+        export_coco(current_loaded_images, output_path)
+        return output_path
+
+    output_dir = os.path.join(EXPORTS_DIR, f"{export_format.lower()}_{timestamp}")
+    if export_format == "YOLO":
+        export_yolo(current_loaded_images, output_dir)
+    elif export_format == "Crops":
+        build_crop_dataset(current_loaded_images, output_dir)
+    else:
+        export_voc(current_loaded_images, output_dir)
+    archive = shutil.make_archive(output_dir, "zip", output_dir)
+    shutil.rmtree(output_dir)
+    return archive
 
 
 def _show_hide_setting_tab(setting_state):
@@ -33,14 +101,25 @@ def _show_hide_setting_tab(setting_state):
     return gr.update(visible=status), btn_label, status
 
 
-def _handle_folder_selection(list_files: List[str] | None):
+def _handle_folder_selection(
+    list_files: List[str] | None,
+    prematch=False,
+    accuracy_threshold=0.8,
+    bounding_rect_overlap_threshold=0.2,
+    rotation_angle_step=90,
+    use_feature_pruning=False,
+    use_template_checkbox=False,
+    choose_folder_templates=None,
+):
     global current_loaded_images
 
     if list_files is None:
         return []
 
     # Empty the current loaded images
+    prematch_queue.cancel(current_loaded_images)
     current_loaded_images = {}
+    _set_source(None)
 
     for file_path in list_files:
         if file_path.endswith(".png") or file_path.endswith(".jpg"):
@@ -55,6 +134,25 @@ def _handle_folder_selection(list_files: List[str] | None):
 
     file_names = list(current_loaded_images.keys())
 
+    # Match the selected template folders against every image, in the order
+    # they are browsed, so the results are ready when the user gets there
+    if prematch and use_template_checkbox and choose_folder_templates:
+        params = MatchParams(
+            accuracy_threshold=accuracy_threshold,
+            rect_overlap_threshold=bounding_rect_overlap_threshold,
+            selected_angle=int(rotation_angle_step),
+            use_features=use_feature_pruning,
+        )
+        for name in file_names:
+            prematch_queue.submit(
+                name.rsplit(".", 1)[0],
+                current_loaded_images[name],
+                [],
+                params,
+                choose_folder_templates,
+            )
+        print(f"🚀 Queued background matching of {len(file_names)} images")
+
     return gr.update(choices=file_names, value=file_names[0]), gr.update(
         value=prepare_annotate_data(
             current_loaded_images[file_names[0]],
@@ -62,6 +160,93 @@ def _handle_folder_selection(list_files: List[str] | None):
     )
 
 
+def _set_source(source: DirectorySource | None):
+    global current_source
+
+    if current_source is not None and current_source.metadata_index is not None:
+        current_source.metadata_index.close()
+    current_source = source
+
+
+def _load_source_page(page: int) -> List[str]:
+    """
+    Add the images of a page of the server folder to the loaded images.
+    """
+    names = current_source.page(page)
+    for name in names:
+        if name not in current_loaded_images:
+            current_loaded_images[name] = current_source.image_data(name)
+    return names
+
+
+def _dropdown_update(image_name: str):
+    """
+    Select an image in the dropdown, showing its page when browsing a server
+    folder.
+    """
+    if current_source is None:
+        return image_name
+    page = current_source.page_of(image_name)
+    metadata = current_source.metadata(image_name)
+    size = f", {metadata['width']}x{metadata['height']}" if metadata else ""
+    return gr.update(
+        choices=current_source.page(page),
+        value=image_name,
+        label=f"Choose an image (page {page + 1}{size})",
+    )
+
+
+def _handle_server_folder(folder_path: str):
+    global current_loaded_images
+
+    if not folder_path or not os.path.isdir(folder_path):
+        gr.Info("Please enter the path of a folder on the server")
+        return gr.update(), gr.update()
+
+    prematch_queue.cancel(current_loaded_images)
+    current_loaded_images = {}
+    # Sizes and orientations are read once per image, and kept between visits
+    folder_key = hashlib.sha1(os.path.abspath(folder_path).encode()).hexdigest()
+    metadata_index = ImageMetadataIndex(
+        folder_path,
+        index_path=os.path.join(METADATA_DIR, f"{folder_key[:16]}.sqlite"),
+    )
+    _set_source(DirectorySource(folder_path, metadata_index=metadata_index))
+    names = _load_source_page(0)
+    if not names:
+        _set_source(None)
+        gr.Info("No images found in the folder")
+        return gr.update(choices=[], value=None), gr.update()
+
+    return _dropdown_update(names[0]), gr.update(
+        value=prepare_annotate_data(current_loaded_images[names[0]])
+    )
+
+
+def _handle_coco_import(annotation_path: str, image_dir: str):
+    global current_loaded_images
+
+    if not annotation_path or not os.path.isfile(annotation_path):
+        gr.Info("Please enter the path of a COCO annotation file")
+        return gr.update(), gr.update()
+
+    # Builds the index on the first import, boxes are read when an image is shown
+    index = CocoIndex(annotation_path, image_dir=image_dir or None)
+    prematch_queue.cancel(current_loaded_images)
+    current_loaded_images = dict(index.entries())
+    _set_source(None)
+    if not current_loaded_images:
+        gr.Info("No images found in the annotation file")
+        return gr.update(), gr.update()
+
+    file_names = list(current_loaded_images.keys())
+    print(f"🚀 Imported {len(file_names)} images from {annotation_path}")
+
+    return gr.update(choices=file_names, value=file_names[0]), gr.update(
+        value=prepare_annotate_data(current_loaded_images[file_names[0]])
+    )
+
+
 def handlePrevButtonClick(dropdown):
     if dropdown is None:
         gr.Info("Please select an folder first")
@@ -83,7 +268,7 @@ def handlePrevButtonClick(dropdown):
         )
     else:
         dropdown = list_keys[index - 1]
-        return dropdown, gr.update(
+        return _dropdown_update(dropdown), gr.update(
             value=prepare_annotate_data(current_loaded_images[list_keys[index - 1]])
         )
 
@@ -99,6 +284,11 @@ def handleNextButtonClick(dropdown):
 
     index = list_keys.index(dropdown)
 
+    # Scan the next page of the server folder when reaching the last image
+    if index == len(list_keys) - 1 and current_source is not None:
+        if _load_source_page(current_source.page_of(dropdown) + 1):
+            list_keys = list(current_loaded_images.keys())
+
     if index == len(list_keys) - 1:
         gr.Info("You are at the last image")
         return dropdown, gr.update(
@@ -106,7 +296,7 @@ def handleNextButtonClick(dropdown):
         )
     else:
         dropdown = list_keys[index + 1]
-        return dropdown, gr.update(
+        return _dropdown_update(dropdown), gr.update(
             value=prepare_annotate_data(current_loaded_images[list_keys[index + 1]])
         )
 
@@ -141,10 +331,18 @@ def update_new_boxes_data(image_name: str, annotator: dict):
     if image_name is None or image_name not in current_loaded_images:
         return
 
-    # print(f"🚀 Update new boxes data: {annotator['boxes']}")
-    current_loaded_images.get(image_name, {})["boxes"] = annotator["boxes"]
-
-    print(f"🚀 Current data: {current_loaded_images[image_name]}")
+    image_data = current_loaded_images[image_name]
+    get_image_boxes(image_data)
+    if "ops" in annotator:
+        if not apply_box_delta(image_data, annotator):
+            return
+        print(
+            f"🚀 Applied {len(annotator['ops'])} box ops to {image_name}, "
+            f"{len(image_data['boxes'])} boxes"
+        )
+    else:
+        image_data["boxes"] = annotator["boxes"]
+        print(f"🚀 Updated {image_name}, {len(image_data['boxes'])} boxes")
 
 
 def exec_template_matching(
@@ -152,6 +350,9 @@ def exec_template_matching(
     accuracy_threshold,
     bounding_rect_overlap_threshold,
     rotation_angle_step,
+    use_feature_pruning,
+    time_limit,
+    max_detections,
     use_template_checkbox,
     choose_folder_templates,
     annotator,
@@ -171,33 +372,53 @@ def exec_template_matching(
     image_path = image_data["file_path"]
     current_image_name = dropdown
 
-    rectangles = format_boxes_output(annotator.get("boxes", []))
+    # The stored boxes are kept in sync with the annotator by the change event
+    rectangles = format_boxes_output(get_image_boxes(image_data))
 
     if use_template_checkbox:
-        job_type = "file"
-        selected_folders = choose_folder_templates
+        selected_folders = choose_folder_templates or []
     else:
-        job_type = "annotate"
-        selected_folders = []  # Not used when job_type is 'annotate'
+        selected_folders = None  # Use the annotated boxes as templates
+
+    # 0 means no limit
+    budget = None
+    if time_limit or max_detections:
+        budget = MatchBudget(
+            time_limit=time_limit or None, max_total=int(max_detections) or None
+        )
+    params = MatchParams(
+        accuracy_threshold=accuracy_threshold,
+        rect_overlap_threshold=bounding_rect_overlap_threshold,
+        selected_angle=int(rotation_angle_step),
+        use_features=use_feature_pruning,
+    )
 
+    # Matched in the background if the folder was opened with the same settings
+    result = None
+    if selected_folders and budget is None:
+        result = prematch_queue.result(image_data, rectangles, params, selected_folders)
+    if result is None:
+        with prematch_queue.interactive():
+            result = matcher.match(
+                image_path,
+                rectangles,
+                current_image_name.rsplit(".", 1)[0],
+                params,
+                folders=selected_folders,
+                budget=budget,
+            )
     (
         processed_img_path,
         processed_img_json_path,
         processed_img_name,
         found_labels,
         rects_found_count,
-    ) = template_matching(
-        job_type=job_type,
-        template_dir=TEMPLATES_DIR,
-        result_dir=RESULTS_DIR,
-        image_path=image_path,
-        rectangles=rectangles,
-        current_image_name=current_image_name.rsplit(".", 1)[0],
-        accuracy_threshold=accuracy_threshold,
-        rect_overlap_threshold=bounding_rect_overlap_threshold,
-        selected_folders=selected_folders,
-        selected_angle=int(rotation_angle_step),
-    )
+    ) = result
+    if budget is not None and budget.partial:
+        gr.Warning(
+            "Template matching stopped early "
+            f"({', '.join(sorted(budget.reasons))}), showing the best matches found"
+        )
 
     print(f"🚀 Found labels: {found_labels}")
     print(f"🚀 Rectangles found count: {rects_found_count}")
@@ -221,6 +442,73 @@ def exec_template_matching(
     ), gr.update(value=json_data)
 
 
+def exec_sequence_matching(
+    sequence_path,
+    rescan_every,
+    dropdown,
+    accuracy_threshold,
+    bounding_rect_overlap_threshold,
+    rotation_angle_step,
+    use_template_checkbox,
+    choose_folder_templates,
+):
+    if not sequence_path or not os.path.exists(sequence_path):
+        gr.Info("Please enter the path of an image folder or a video on the server")
+        return
+
+    # Same templates as a single image run: the library folders, or the boxes
+    # annotated on the current image
+    if use_template_checkbox:
+        templates = [
+            (template.label, template.image)
+            for template in matcher.load_templates(choose_folder_templates or [])
+        ]
+    elif dropdown in current_loaded_images:
+        image_data = current_loaded_images[dropdown]
+        templates = crop_templates(
+            image_data["file_path"], format_boxes_output(get_image_boxes(image_data))
+        )
+    else:
+        templates = []
+    if not templates:
+        gr.Info("Please choose template folders or annotate boxes first")
+        return
+
+    sequence = SequenceMatcher(
+        templates,
+        MatchParams(
+            accuracy_threshold=accuracy_threshold,
+            rect_overlap_threshold=bounding_rect_overlap_threshold,
+            selected_angle=int(rotation_angle_step),
+        ),
+        rescan_every=int(rescan_every),
+    )
+
+    # One line of hits per frame, for review after the run
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    results_path = os.path.join(RESULTS_DIR, f"sequence_{timestamp}.jsonl")
+    print(f"🚀 Matching the frames of {sequence_path} into {results_path}")
+    with open(results_path, "w", encoding="utf8") as results:
+        for frame in sequence.run(iter_frames(sequence_path)):
+            results.write(
+                json.dumps(
+                    {
+                        "index": frame["index"],
+                        "name": frame["name"],
+                        "keyframe": frame["keyframe"],
+                        "found_labels": frame["found_labels"],
+                    }
+                )
+                + "\n"
+            )
+            # Video frames are not files, the annotator gets them as RGB arrays
+            image = frame["file_path"] or frame["image"][:, :, ::-1]
+            yield gr.update(
+                value={"image": image, "boxes": frame["boxes"]},
+                label=f"{frame['name']}{' (keyframe)' if frame['keyframe'] else ''}",
+            ), gr.update(value=frame["found_labels"])
+
+
 with gr.Blocks(
     js=JS_SCRIPT,
     theme=gr.themes.Soft(primary_hue="slate"),
@@ -251,6 +539,24 @@ with gr.Blocks(
                 file_count="directory",
             )
 
+            with gr.Accordion("Open a folder on the server", open=False):
+                server_folder_path = gr.Textbox(
+                    label="Folder path",
+                    placeholder="/data/images",
+                )
+                server_folder_btn = gr.Button("Open", variant="primary")
+
+            with gr.Accordion("Import COCO annotations", open=False):
+                coco_annotation_path = gr.Textbox(
+                    label="Annotation file on the server",
+                    placeholder="/data/annotations/instances_train.json",
+                )
+                coco_image_dir = gr.Textbox(
+                    label="Image folder on the server",
+                    placeholder="Defaults to the folder of the annotation file",
+                )
+                coco_import_btn = gr.Button("Import", variant="primary")
+
             gr.Markdown("---")
             gr.Markdown("#### Template Matching Setting")
 
@@ -280,6 +586,27 @@ with gr.Blocks(
                 interactive=True,
             )
 
+            use_feature_pruning = gr.Checkbox(
+                label="Only search where keypoints match (faster)",
+                value=False,
+                interactive=True,
+            )
+
+            with gr.Row(variant="panel"):
+                time_limit = gr.Number(
+                    label="Time limit in seconds (0 = none)",
+                    value=0,
+                    minimum=0,
+                    interactive=True,
+                )
+                max_detections = gr.Number(
+                    label="Max detections (0 = none)",
+                    value=0,
+                    minimum=0,
+                    precision=0,
+                    interactive=True,
+                )
+
             gr.Markdown("---")
 
             with gr.Row(variant="panel"):
@@ -296,11 +623,45 @@ with gr.Blocks(
                     multiselect=True,
                 )
 
+            with gr.Accordion("Match an image sequence or video", open=False):
+                sequence_path = gr.Textbox(
+                    label="Image folder or video on the server",
+                    placeholder="/data/camera_1",
+                )
+                rescan_every = gr.Number(
+                    label="Full search every N frames",
+                    value=30,
+                    minimum=1,
+                    precision=0,
+                    interactive=True,
+                )
+                sequence_btn = gr.Button("Run on the sequence", variant="primary")
+
+            prematch_checkbox = gr.Checkbox(
+                label="Match uploaded folders in the background with these templates",
+                value=False,
+                interactive=True,
+            )
+
             gr.Markdown("#### Output JSON")
 
             with gr.Accordion():
                 json_boxes = gr.JSON()
 
+            gr.Markdown("#### Export annotations")
+
+            with gr.Row(variant="panel"):
+                export_format = gr.Dropdown(
+                    label="Format",
+                    choices=["COCO", "YOLO", "Pascal VOC", "Crops"],
+                    value="COCO",
+                    interactive=True,
+                )
+
+                export_btn = gr.Button("Export", variant="primary")
+
+            export_file = gr.File(label="Exported annotations", interactive=False)
+
         with gr.Column(scale=70, variant="panel") as annotatate_col:
             gr.Markdown("#### Step 2: Annotate the image")
 
@@ -309,12 +670,14 @@ with gr.Blocks(
                     value=prepare_annotate_data(current_loaded_images[dropdown.value]),
                     boxes_alpha=0,
                     box_thickness=0.1,
+                    sync_mode="full",
                 )
             else:
                 annotator = ImageAnnotator(
                     value=EXAMPLE_DATA,
                     boxes_alpha=0,
                     box_thickness=0.1,
+                    sync_mode="full",
                 )
 
             with gr.Row(variant="panel"):
@@ -355,7 +718,28 @@ with gr.Blocks(
             # Setting event
             folder_of_images_btn.upload(
                 _handle_folder_selection,
-                inputs=[folder_of_images_btn],
+                inputs=[
+                    folder_of_images_btn,
+                    prematch_checkbox,
+                    accuracy_threshold,
+                    bounding_rect_overlap_threshold,
+                    rotation_angle_step,
+                    use_feature_pruning,
+                    use_template_checkbox,
+                    choose_folder_templates,
+                ],
+                outputs=[dropdown, annotator],
+            )
+
+            server_folder_btn.click(
+                _handle_server_folder,
+                inputs=[server_folder_path],
+                outputs=[dropdown, annotator],
+            )
+
+            coco_import_btn.click(
+                _handle_coco_import,
+                inputs=[coco_annotation_path, coco_image_dir],
                 outputs=[dropdown, annotator],
             )
 
@@ -407,10 +791,16 @@ with gr.Blocks(
 
             get_coor_btn.click(
                 get_boxes_json,
-                annotator,
+                [dropdown, annotator],
                 json_boxes,
             )
 
+            export_btn.click(
+                fn=export_annotations,
+                inputs=[export_format],
+                outputs=[export_file],
+            )
+
             # Run template matching
             run_template_matching.click(
                 fn=exec_template_matching,
@@ -419,6 +809,9 @@ with gr.Blocks(
                     accuracy_threshold,
                     bounding_rect_overlap_threshold,
                     rotation_angle_step,
+                    use_feature_pruning,
+                    time_limit,
+                    max_detections,
                     use_template_checkbox,
                     choose_folder_templates,
                     annotator,
@@ -426,6 +819,27 @@ with gr.Blocks(
                 outputs=[annotator, json_boxes],
             )
 
+            sequence_btn.click(
+                fn=exec_sequence_matching,
+                inputs=[
+                    sequence_path,
+                    rescan_every,
+                    dropdown,
+                    accuracy_threshold,
+                    bounding_rect_overlap_threshold,
+                    rotation_angle_step,
+                    use_template_checkbox,
+                    choose_folder_templates,
+                ],
+                outputs=[annotator, json_boxes],
+            )
+
 
 if __name__ == "__main__":
-    demo.launch()
+    if registry.enabled:
+        # GRADIO_IMAGE_ANNOTATION_METRICS=1 also serves them on /metrics
+        app, _, _ = demo.launch(allowed_paths=ALLOWED_PATHS, prevent_thread_lock=True)
+        add_metrics_route(app)
+        demo.block_thread()
+    else:
+        demo.launch(allowed_paths=ALLOWED_PATHS)
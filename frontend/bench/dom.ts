@@ -0,0 +1,158 @@
+/**
+ * The parts of the DOM used by the annotator's canvas code, so that it runs
+ * in Node without a browser.
+ *
+ * - Canvases have a recording 2D context: drawing calls are counted and
+ *   otherwise ignored.
+ * - `document` dispatches the listeners added by the boxes while they are
+ *   dragged, resized or created.
+ * - Animation frames are queued and run by `flushFrames`.
+ */
+
+type Listener = (event: any) => void;
+
+export class RecordingContext {
+  calls: number = 0;
+  fillStyle: string = "";
+  strokeStyle: string = "";
+  lineWidth: number = 1;
+  font: string = "";
+  globalAlpha: number = 1;
+
+  constructor(public canvas: FakeCanvas) {}
+
+  private record(): void {
+    this.calls += 1;
+  }
+
+  beginPath(): void { this.record(); }
+  closePath(): void { this.record(); }
+  moveTo(): void { this.record(); }
+  lineTo(): void { this.record(); }
+  rect(): void { this.record(); }
+  fill(): void { this.record(); }
+  stroke(): void { this.record(); }
+  fillRect(): void { this.record(); }
+  strokeRect(): void { this.record(); }
+  clearRect(): void { this.record(); }
+  fillText(): void { this.record(); }
+  drawImage(): void { this.record(); }
+  save(): void { this.record(); }
+  restore(): void { this.record(); }
+  setTransform(): void { this.record(); }
+  measureText(text: string): { width: number } {
+    this.record();
+    return { width: text.length * 7 };
+  }
+}
+
+export class FakeCanvas {
+  width: number = 300;
+  height: number = 150;
+  clientWidth: number = 300;
+  clientHeight: number = 150;
+  style: Record<string, string> = {};
+  private context: RecordingContext | null = null;
+
+  getContext(type: string): RecordingContext | null {
+    if (type !== "2d") {
+      return null;
+    }
+    if (this.context === null) {
+      this.context = new RecordingContext(this);
+    }
+    return this.context;
+  }
+
+  getBoundingClientRect() {
+    return { left: 0, top: 0, width: this.clientWidth, height: this.clientHeight };
+  }
+
+  /**
+   * Drawing calls made on the canvas since the last call
+   */
+  takeCalls(): number {
+    const calls = this.context ? this.context.calls : 0;
+    if (this.context) {
+      this.context.calls = 0;
+    }
+    return calls;
+  }
+}
+
+class FakePath2D {
+  rect(): void {}
+  moveTo(): void {}
+  lineTo(): void {}
+  closePath(): void {}
+}
+
+export class FakeDocument {
+  private listeners: Map<string, Set<Listener>> = new Map();
+  createdCanvases: FakeCanvas[] = [];
+
+  createElement(tag: string): FakeCanvas {
+    if (tag !== "canvas") {
+      throw new Error(`Unsupported element: ${tag}`);
+    }
+    const canvas = new FakeCanvas();
+    this.createdCanvases.push(canvas);
+    return canvas;
+  }
+
+  addEventListener(type: string, listener: Listener): void {
+    let listeners = this.listeners.get(type);
+    if (!listeners) {
+      listeners = new Set();
+      this.listeners.set(type, listeners);
+    }
+    listeners.add(listener);
+  }
+
+  removeEventListener(type: string, listener: Listener): void {
+    this.listeners.get(type)?.delete(listener);
+  }
+
+  dispatch(type: string, event: any): void {
+    const listeners = this.listeners.get(type);
+    if (listeners) {
+      // Listeners may remove themselves while the event is dispatched
+      for (const listener of Array.from(listeners)) {
+        listener(event);
+      }
+    }
+  }
+}
+
+let frameCallbacks: Map<number, FrameRequestCallback> = new Map();
+let nextFrameId = 1;
+
+/**
+ * Run the pending animation frame callbacks
+ * @returns number of callbacks that ran
+ */
+export function flushFrames(): number {
+  const callbacks = frameCallbacks;
+  frameCallbacks = new Map();
+  const now = performance.now();
+  for (const callback of callbacks.values()) {
+    callback(now);
+  }
+  return callbacks.size;
+}
+
+export function installDom(): FakeDocument {
+  const document = new FakeDocument();
+  const globals = globalThis as any;
+  globals.document = document;
+  globals.Path2D = FakePath2D;
+  globals.requestAnimationFrame = (callback: FrameRequestCallback) => {
+    const id = nextFrameId++;
+    frameCallbacks.set(id, callback);
+    return id;
+  };
+  globals.cancelAnimationFrame = (id: number) => {
+    frameCallbacks.delete(id);
+  };
+  return document;
+}
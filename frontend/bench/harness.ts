@@ -0,0 +1,279 @@
+import Box from "../shared/components/ts/box";
+import type { BoxesFormat } from "../shared/components/ts/box-codec";
+import BoxOpLog from "../shared/components/ts/box-sync";
+import type { SyncMode } from "../shared/components/ts/box-sync";
+import {
+  hitTest,
+  hoverCursor,
+  pointerPosition,
+  prepareChange,
+  setSelection,
+} from "../shared/components/ts/canvas-handlers";
+import LayeredRenderer from "../shared/components/ts/layered-renderer";
+import BoxGrid from "../shared/components/ts/spatial-index";
+import { BoxProperty, Colors } from "../shared/utils/constants";
+import { FakeCanvas, FakeDocument, flushFrames } from "./dom";
+
+export type PointerType = "pointerdown" | "pointermove" | "pointerup";
+
+export interface PointerStep {
+  type: PointerType;
+  x: number;
+  y: number;
+  t?: number; // ms since the start of the sequence, informative only
+}
+
+export interface PointerSequence {
+  name: string;
+  mode: "drag" | "create";
+  events: PointerStep[];
+}
+
+export interface SceneOptions {
+  width: number;
+  height: number;
+  boxes: number;
+  boxSize: number;
+  seed: number;
+  syncMode: SyncMode;
+  boxesFormat: BoxesFormat;
+}
+
+/**
+ * Small deterministic PRNG (mulberry32), so runs are comparable
+ */
+export function random(seed: number): () => number {
+  let state = seed >>> 0;
+  return () => {
+    state = (state + 0x6d2b79f5) >>> 0;
+    let t = state;
+    t = Math.imul(t ^ (t >>> 15), t | 1);
+    t ^= t + Math.imul(t ^ (t >>> 7), t | 61);
+    return ((t ^ (t >>> 14)) >>> 0) / 4294967296;
+  };
+}
+
+/**
+ * Boxes of `boxSize` +/- 50% at random positions in the scene
+ * @returns [xmin, ymin, xmax, ymax][]
+ */
+export function syntheticBoxes(
+  options: SceneOptions
+): [number, number, number, number][] {
+  const rand = random(options.seed);
+  const boxes: [number, number, number, number][] = [];
+  for (let i = 0; i < options.boxes; i++) {
+    const size = options.boxSize * (0.5 + rand());
+    const xmin = Math.round(rand() * Math.max(options.width - size, 1));
+    const ymin = Math.round(rand() * Math.max(options.height - size, 1));
+    boxes.push([xmin, ymin, Math.round(xmin + size), Math.round(ymin + size)]);
+  }
+  return boxes;
+}
+
+/**
+ * The canvas of the annotator, without Svelte: the handlers of
+ * `canvas.svelte` wired the same way around the functions they share
+ * (`canvas-handlers.ts`), driving the same `Box`, `BoxGrid`,
+ * `LayeredRenderer` and `BoxOpLog` code on a synthetic image with synthetic
+ * boxes. Each edit prepares a change like the component does.
+ */
+export class AnnotatorHarness {
+  canvas: FakeCanvas;
+  renderer: LayeredRenderer;
+  boxIndex: BoxGrid = new BoxGrid();
+  boxes: Box[] = [];
+  selectedBox: number = -1;
+  mode: "drag" | "create" = "drag";
+  changes: number = 0;
+  private opLog: BoxOpLog = new BoxOpLog();
+  private layers: FakeCanvas[];
+  private image: { width: number; height: number };
+
+  constructor(private document: FakeDocument, private options: SceneOptions) {
+    const { width, height } = options;
+    this.canvas = new FakeCanvas();
+    this.canvas.width = this.canvas.clientWidth = width;
+    this.canvas.height = this.canvas.clientHeight = height;
+    this.image = { width, height };
+    const created = document.createdCanvases.length;
+    this.renderer = new LayeredRenderer(this.canvas as unknown as HTMLCanvasElement);
+    // The offscreen layers of the renderer
+    this.layers = document.createdCanvases.slice(created);
+
+    this.boxes = syntheticBoxes(options).map(([xmin, ymin, xmax, ymax], i) =>
+      this.newBox(xmin, ymin, xmax, ymax, i)
+    );
+    this.boxIndex.rebuild(this.boxes);
+    // Like on mount, the first box is selected
+    this.selectBox(this.boxes.length > 0 ? 0 : -1);
+    this.frame();
+  }
+
+  private newBox(xmin: number, ymin: number, xmax: number, ymax: number, i: number): Box {
+    const box = new Box(
+      () => this.drawSelected(),
+      () => this.onBoxFinishCreation(),
+      0,
+      0,
+      this.options.width,
+      this.options.height,
+      `label_${i % 10}`,
+      xmin,
+      ymin,
+      xmax,
+      ymax,
+      Colors[i % Colors.length],
+      BoxProperty.Alpha,
+      BoxProperty.MinSize,
+      BoxProperty.HandleSize,
+      BoxProperty.Thickness,
+      BoxProperty.SelectedThickness,
+      1.0
+    );
+    box.onFinishEdit = () => {
+      this.boxIndex.update(box);
+      this.opLog.update(box);
+      this.dispatchChange();
+    };
+    return box;
+  }
+
+  draw(): void {
+    this.renderer.setBackground(
+      this.image as unknown as HTMLImageElement,
+      0,
+      0,
+      this.image.width,
+      this.image.height
+    );
+    this.renderer.setBoxes(this.boxes, this.selectedBox);
+    this.renderer.invalidateBoxes();
+    this.renderer.requestRender();
+  }
+
+  drawSelected(): void {
+    this.renderer.setBoxes(this.boxes, this.selectedBox);
+    this.renderer.requestRender();
+  }
+
+  selectBox(index: number): void {
+    this.selectedBox = index;
+    setSelection(this.boxes, index);
+    this.draw();
+  }
+
+  private dispatchChange(): void {
+    prepareChange(
+      { boxes: this.boxes },
+      this.options.syncMode,
+      this.options.boxesFormat,
+      this.opLog
+    );
+    this.changes += 1;
+  }
+
+  private clickBox(event: PointerEvent): void {
+    const [x, y] = pointerPosition(this.canvas as unknown as HTMLCanvasElement, event);
+    const hit = hitTest(this.boxIndex, x, y);
+    if (hit === null) {
+      this.selectBox(-1);
+      return;
+    }
+    this.selectBox(hit.index);
+    if (hit.handle >= 0) {
+      hit.box.startResize(hit.handle, event);
+    } else {
+      hit.box.startDrag(event);
+    }
+  }
+
+  private createBox(event: PointerEvent): void {
+    const box = this.newBox(
+      event.clientX,
+      event.clientY,
+      event.clientX,
+      event.clientY,
+      this.boxes.length
+    );
+    box.label = "";
+    box.startCreating(event, 0, 0);
+    this.boxes = [box, ...this.boxes];
+    this.selectBox(0);
+    this.draw();
+  }
+
+  private onBoxFinishCreation(): void {
+    if (this.selectedBox >= 0 && this.selectedBox < this.boxes.length) {
+      const box = this.boxes[this.selectedBox];
+      this.boxIndex.update(box);
+      if (box.getArea() < 1) {
+        this.boxIndex.remove(box);
+        this.boxes.splice(this.selectedBox, 1);
+        this.selectBox(-1);
+      } else {
+        // As with `disableEditBoxes`, without the label modal
+        this.opLog.add(box);
+        this.dispatchChange();
+      }
+    }
+  }
+
+  private handlePointerDown(event: PointerEvent): void {
+    if (this.mode === "create") {
+      this.createBox(event);
+    } else {
+      this.clickBox(event);
+    }
+  }
+
+  private handlePointerMove(event: PointerEvent): void {
+    if (this.mode !== "drag") {
+      return;
+    }
+    const [x, y] = pointerPosition(this.canvas as unknown as HTMLCanvasElement, event);
+    const cursor = hoverCursor(this.boxIndex, this.boxes, this.selectedBox, x, y);
+    if (cursor !== null) {
+      this.canvas.style.cursor = cursor;
+    }
+  }
+
+  /**
+   * Dispatch a pointer event the way the browser does: to the canvas
+   * handlers first, then to the listeners of the document.
+   */
+  dispatch(step: PointerStep): void {
+    const event = {
+      type: step.type,
+      clientX: step.x,
+      clientY: step.y,
+      pointerId: 1,
+      target: this.canvas,
+    } as unknown as PointerEvent;
+    if (step.type === "pointerdown") {
+      this.handlePointerDown(event);
+    } else if (step.type === "pointermove") {
+      this.handlePointerMove(event);
+    }
+    this.document.dispatch(step.type, event);
+  }
+
+  /**
+   * Run the pending frame, if any
+   * @returns the drawing calls made on every canvas, or -1 without a frame
+   */
+  frame(): number {
+    if (flushFrames() === 0) {
+      return -1;
+    }
+    let calls = 0;
+    for (const canvas of [this.canvas, ...this.layers]) {
+      calls += canvas.takeCalls();
+    }
+    return calls;
+  }
+
+  destroy(): void {
+    this.renderer.destroy();
+  }
+}
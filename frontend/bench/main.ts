@@ -0,0 +1,236 @@
+import { readFileSync, writeFileSync } from "node:fs";
+import { installDom } from "./dom";
+import type { FakeDocument } from "./dom";
+import type { BoxesFormat } from "../shared/components/ts/box-codec";
+import type { SyncMode } from "../shared/components/ts/box-sync";
+import { AnnotatorHarness } from "./harness";
+import type { PointerSequence, SceneOptions } from "./harness";
+import { syntheticSequences } from "./sequences";
+
+interface Args {
+  boxes: number[];
+  width: number;
+  height: number;
+  boxSize: number;
+  events: number;
+  seed: number;
+  warmup: number;
+  syncMode: SyncMode;
+  boxesFormat: BoxesFormat;
+  sequences: string | null;
+  record: string | null;
+  output: string | null;
+  compare: string | null;
+}
+
+const USAGE = `Frame time and event handler cost of the annotator canvas, replaying
+pointer sequences headlessly.
+
+  npm run bench -- --boxes 100,10000 --output bench.json
+
+Options:
+  --boxes 0,100,1000,10000  Number of boxes of the scenes
+  --size 2048x2048          Size of the synthetic image
+  --box-size 48             Mean box size in pixels
+  --events 500              Events per synthetic sequence
+  --seed 1                  Seed of the boxes and sequences
+  --warmup 1                Untimed runs of each sequence first
+  --sync-mode full          Sync mode of the changes, "full" or "delta"
+  --boxes-format json       Wire format of the boxes, "json" or "packed"
+  --sequences file.json     Replay recorded sequences instead
+  --record file.json        Save the synthetic sequences of the first scene
+  --output file.json        Write the results to this JSON file
+  --compare file.json       Compare with the results of a previous run`;
+
+function parseArgs(argv: string[]): Args {
+  const args: Args = {
+    boxes: [0, 100, 1000, 10000],
+    width: 2048,
+    height: 2048,
+    boxSize: 48,
+    events: 500,
+    seed: 1,
+    warmup: 1,
+    syncMode: "full",
+    boxesFormat: "json",
+    sequences: null,
+    record: null,
+    output: null,
+    compare: null,
+  };
+  for (let i = 0; i < argv.length; i++) {
+    const name = argv[i];
+    const value = argv[i + 1];
+    if (name === "--help" || name === "-h") {
+      console.log(USAGE);
+      process.exit(0);
+    }
+    if (value === undefined) {
+      throw new Error(`Missing value for ${name}`);
+    }
+    i++;
+    switch (name) {
+      case "--boxes":
+        args.boxes = value.split(",").map(Number);
+        break;
+      case "--size": {
+        const [width, height] = value.split("x").map(Number);
+        args.width = width;
+        args.height = height || width;
+        break;
+      }
+      case "--box-size":
+        args.boxSize = Number(value);
+        break;
+      case "--events":
+        args.events = Number(value);
+        break;
+      case "--seed":
+        args.seed = Number(value);
+        break;
+      case "--warmup":
+        args.warmup = Number(value);
+        break;
+      case "--sync-mode":
+        args.syncMode = value as SyncMode;
+        break;
+      case "--boxes-format":
+        args.boxesFormat = value as BoxesFormat;
+        break;
+      case "--sequences":
+      case "--record":
+      case "--output":
+      case "--compare":
+        args[name.slice(2) as "sequences" | "record" | "output" | "compare"] = value;
+        break;
+      default:
+        throw new Error(`Unknown option ${name}\n\n${USAGE}`);
+    }
+  }
+  return args;
+}
+
+function percentile(sorted: number[], p: number): number {
+  if (sorted.length === 0) {
+    return 0;
+  }
+  return sorted[Math.min(Math.floor(sorted.length * p), sorted.length - 1)];
+}
+
+function summarize(values: number[]) {
+  const sorted = [...values].sort((a, b) => a - b);
+  const round = (value: number) => Math.round(value * 1000) / 1000;
+  const total = sorted.reduce((sum, value) => sum + value, 0);
+  return {
+    count: sorted.length,
+    mean: round(sorted.length ? total / sorted.length : 0),
+    p50: round(percentile(sorted, 0.5)),
+    p95: round(percentile(sorted, 0.95)),
+    p99: round(percentile(sorted, 0.99)),
+    max: round(sorted.length ? sorted[sorted.length - 1] : 0),
+  };
+}
+
+/**
+ * Replay a sequence on a new scene, one event per frame
+ */
+function replay(
+  document: FakeDocument,
+  options: SceneOptions,
+  sequence: PointerSequence
+) {
+  const harness = new AnnotatorHarness(document, options);
+  harness.mode = sequence.mode;
+  const handlerMs: number[] = [];
+  const frameMs: number[] = [];
+  const drawCalls: number[] = [];
+  for (const step of sequence.events) {
+    const start = performance.now();
+    harness.dispatch(step);
+    const handled = performance.now();
+    const calls = harness.frame();
+    const rendered = performance.now();
+    handlerMs.push(handled - start);
+    if (calls >= 0) {
+      frameMs.push(rendered - handled);
+      drawCalls.push(calls);
+    }
+  }
+  harness.destroy();
+  return { handlerMs, frameMs, drawCalls };
+}
+
+function main() {
+  const args = parseArgs(process.argv.slice(2));
+  const document = installDom();
+  const recorded: PointerSequence[] | null = args.sequences
+    ? JSON.parse(readFileSync(args.sequences, "utf8"))
+    : null;
+
+  const results: Record<string, unknown>[] = [];
+  for (const boxes of args.boxes) {
+    const options: SceneOptions = {
+      width: args.width,
+      height: args.height,
+      boxes,
+      boxSize: args.boxSize,
+      seed: args.seed,
+      syncMode: args.syncMode,
+      boxesFormat: args.boxesFormat,
+    };
+    const sequences = recorded || syntheticSequences(options, args.events);
+    if (args.record && results.length === 0) {
+      writeFileSync(args.record, JSON.stringify(sequences, null, 2));
+    }
+
+    for (const sequence of sequences) {
+      for (let i = 0; i < args.warmup; i++) {
+        replay(document, options, sequence);
+      }
+      const { handlerMs, frameMs, drawCalls } = replay(document, options, sequence);
+      const result = {
+        sequence: sequence.name,
+        boxes,
+        size: `${args.width}x${args.height}`,
+        events: sequence.events.length,
+        frames: frameMs.length,
+        handler_ms: summarize(handlerMs),
+        frame_ms: summarize(frameMs),
+        draw_calls: summarize(drawCalls),
+      };
+      results.push(result);
+      console.log(
+        `${sequence.name} boxes=${boxes}: handler p50/p95/p99 ` +
+          `${result.handler_ms.p50}/${result.handler_ms.p95}/${result.handler_ms.p99} ms, ` +
+          `frame p50/p95/p99 ` +
+          `${result.frame_ms.p50}/${result.frame_ms.p95}/${result.frame_ms.p99} ms ` +
+          `(${result.frames} frames, ${result.draw_calls.mean} draw calls)`
+      );
+    }
+  }
+
+  if (args.output) {
+    writeFileSync(args.output, JSON.stringify({ params: args, results }, null, 2));
+  }
+  if (args.compare) {
+    const baseline: any[] = JSON.parse(readFileSync(args.compare, "utf8")).results;
+    const key = (result: any) => `${result.sequence} boxes=${result.boxes} ${result.size}`;
+    const old = new Map(baseline.map((result) => [key(result), result]));
+    for (const result of results as any[]) {
+      const previous = old.get(key(result));
+      if (!previous) {
+        continue;
+      }
+      for (const metric of ["handler_ms", "frame_ms"]) {
+        const before = previous[metric].p95;
+        const after = result[metric].p95;
+        const change = before > 0 ? ((after - before) / before) * 100 : 0;
+        console.log(
+          `${key(result)} ${metric} p95 ${before} -> ${after} (${change >= 0 ? "+" : ""}${change.toFixed(1)}%)`
+        );
+      }
+    }
+  }
+}
+
+main();
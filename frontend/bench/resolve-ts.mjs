@@ -0,0 +1,25 @@
+// Module hooks resolving the extensionless imports of the TypeScript sources
+// to their files, for Node to run them without a bundler (see `run.mjs`).
+import { existsSync, statSync } from "node:fs";
+import { register } from "node:module";
+import { fileURLToPath, pathToFileURL } from "node:url";
+import { isMainThread } from "node:worker_threads";
+
+export async function resolve(specifier, context, next) {
+  if (specifier.startsWith(".") && context.parentURL) {
+    const path = fileURLToPath(new URL(specifier, context.parentURL));
+    if (!existsSync(path) || statSync(path).isDirectory()) {
+      for (const candidate of [`${path}.ts`, `${path}/index.ts`]) {
+        if (existsSync(candidate)) {
+          return next(pathToFileURL(candidate).href, context);
+        }
+      }
+    }
+  }
+  return next(specifier, context);
+}
+
+// Loaded with --import, the hooks themselves run on another thread
+if (isMainThread) {
+  register(import.meta.url);
+}
@@ -0,0 +1,55 @@
+// Bundle the benchmark with esbuild (installed with the dev dependencies) and
+// run it in Node. Without esbuild, Node 22.10+ runs the TypeScript sources
+// itself. Arguments are passed through, see `--help`.
+import { spawnSync } from "node:child_process";
+import { mkdtempSync, rmSync } from "node:fs";
+import { tmpdir } from "node:os";
+import { join } from "node:path";
+import { fileURLToPath, pathToFileURL } from "node:url";
+
+const main = fileURLToPath(new URL("./main.ts", import.meta.url));
+
+let build = null;
+try {
+  ({ build } = await import("esbuild"));
+} catch {
+  // Not installed
+}
+
+if (build === null) {
+  if (!process.features.typescript) {
+    throw new Error(
+      "Running the benchmark needs esbuild (npm install) or Node 22.10+"
+    );
+  }
+  const result = spawnSync(
+    process.execPath,
+    [
+      "--experimental-transform-types",
+      "--no-warnings",
+      "--import",
+      fileURLToPath(new URL("./resolve-ts.mjs", import.meta.url)),
+      main,
+      ...process.argv.slice(2),
+    ],
+    { stdio: "inherit" }
+  );
+  process.exit(result.status ?? 1);
+}
+
+const folder = mkdtempSync(join(tmpdir(), "annotator-bench-"));
+const outfile = join(folder, "bench.mjs");
+try {
+  await build({
+    entryPoints: [main],
+    outfile,
+    bundle: true,
+    platform: "node",
+    format: "esm",
+    target: "node18",
+    logLevel: "warning",
+  });
+  await import(pathToFileURL(outfile).href);
+} finally {
+  rmSync(folder, { recursive: true, force: true });
+}
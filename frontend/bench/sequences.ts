@@ -0,0 +1,145 @@
+import type { PointerSequence, PointerStep, SceneOptions } from "./harness";
+import { random, syntheticBoxes } from "./harness";
+
+const FRAME_MS = 16; // One coalesced pointer event per frame at 60 Hz
+const GESTURE_MOVES = 30; // Pointer moves per drag, resize or create gesture
+
+type Point = [number, number];
+
+function timed(steps: Omit<PointerStep, "t">[]): PointerStep[] {
+  return steps.map((step, i) => ({ ...step, t: i * FRAME_MS }));
+}
+
+function clampPoint([x, y]: Point, options: SceneOptions): Point {
+  return [
+    Math.min(Math.max(Math.round(x), 0), options.width - 1),
+    Math.min(Math.max(Math.round(y), 0), options.height - 1),
+  ];
+}
+
+/**
+ * Gestures pressing at a point, moving in a straight line and releasing
+ */
+function gestures(
+  count: number,
+  start: () => Point,
+  direction: () => Point
+): Omit<PointerStep, "t">[] {
+  const steps: Omit<PointerStep, "t">[] = [];
+  for (let i = 0; i < count; i++) {
+    let [x, y] = start();
+    const [dx, dy] = direction();
+    steps.push({ type: "pointerdown", x, y });
+    for (let j = 0; j < GESTURE_MOVES; j++) {
+      x += dx;
+      y += dy;
+      steps.push({ type: "pointermove", x, y });
+    }
+    steps.push({ type: "pointerup", x, y });
+  }
+  return steps;
+}
+
+/**
+ * Synthetic pointer sequences over a scene, of about `events` events each:
+ *
+ * - pan: the pointer sweeps the whole canvas without pressing. The annotator
+ *   has no viewport to pan, so this is the hover hit-testing over every
+ *   part of the image.
+ * - hover: a random walk around a few points, like when aiming at a box.
+ * - drag: boxes are pressed at their center and moved.
+ * - resize: boxes are pressed at their bottom-right handle and resized.
+ * - create: new boxes are drawn in creation mode.
+ *
+ * The gestures start on the boxes of `syntheticBoxes(options)`, the boxes of
+ * an `AnnotatorHarness` with the same options.
+ */
+export function syntheticSequences(
+  options: SceneOptions,
+  events: number
+): PointerSequence[] {
+  const rand = random(options.seed + 1);
+  const { width, height } = options;
+  const gestureCount = Math.max(Math.round(events / (GESTURE_MOVES + 2)), 1);
+
+  const boxes = syntheticBoxes(options);
+  const anyBox = () => boxes[Math.floor(rand() * boxes.length)];
+  const anyPoint = (): Point => [rand() * width, rand() * height];
+  const anyDirection = (): Point => {
+    const angle = rand() * 2 * Math.PI;
+    return [4 * Math.cos(angle), 4 * Math.sin(angle)];
+  };
+
+  const pan: Omit<PointerStep, "t">[] = [];
+  const rows = Math.max(Math.round(Math.sqrt(events)), 1);
+  const columns = Math.max(Math.round(events / rows), 1);
+  for (let row = 0; row < rows; row++) {
+    for (let column = 0; column < columns; column++) {
+      const x = row % 2 === 0 ? column : columns - 1 - column;
+      const [px, py] = clampPoint(
+        [(x / columns) * width, ((row + 0.5) / rows) * height],
+        options
+      );
+      pan.push({ type: "pointermove", x: px, y: py });
+    }
+  }
+
+  const hover: Omit<PointerStep, "t">[] = [];
+  let point = anyPoint();
+  for (let i = 0; i < events; i++) {
+    if (i % 50 === 0 && boxes.length > 0) {
+      const [xmin, ymin, xmax, ymax] = anyBox();
+      point = [(xmin + xmax) / 2, (ymin + ymax) / 2];
+    }
+    point = clampPoint(
+      [point[0] + (rand() - 0.5) * 16, point[1] + (rand() - 0.5) * 16],
+      options
+    );
+    hover.push({ type: "pointermove", x: point[0], y: point[1] });
+  }
+
+  const sequences: PointerSequence[] = [
+    { name: "pan", mode: "drag", events: timed(pan) },
+    { name: "hover", mode: "drag", events: timed(hover) },
+  ];
+  if (boxes.length > 0) {
+    sequences.push(
+      {
+        name: "drag",
+        mode: "drag",
+        events: timed(
+          gestures(
+            gestureCount,
+            () => {
+              const [xmin, ymin, xmax, ymax] = anyBox();
+              return [Math.round((xmin + xmax) / 2), Math.round((ymin + ymax) / 2)];
+            },
+            anyDirection
+          )
+        ),
+      },
+      {
+        name: "resize",
+        mode: "drag",
+        events: timed(
+          gestures(
+            gestureCount,
+            () => {
+              const [, , xmax, ymax] = anyBox();
+              return [xmax, ymax];
+            },
+            anyDirection
+          )
+        ),
+      }
+    );
+  }
+  sequences.push({
+    name: "create",
+    mode: "create",
+    events: timed(
+      gestures(gestureCount, anyPoint, () => [2 + rand() * 4, 2 + rand() * 4])
+    ),
+  });
+  return sequences;
+}
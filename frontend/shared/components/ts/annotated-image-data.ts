@@ -1,5 +1,6 @@
 import type { FileData } from "@gradio/client";
 import Box from "./box";
+import type { BoxOp } from "./box-sync";
 
 /**
  * Represents annotated image data.
@@ -8,4 +9,7 @@ export default class AnnotatedImageData {
   image: FileData;
   boxes: Box[] = [];
   calibration_ratio: [number, number] = [0, 0];
+  // Only used in the "delta" sync mode
+  ops?: BoxOp[];
+  version?: number;
 }
@@ -0,0 +1,208 @@
+import Box from "./box";
+
+export type BoxesFormat = "json" | "packed";
+
+const PACKED_FORMAT = "packed";
+const PACKED_VERSION = 1;
+const NO_INDEX = 0xffff; // Box without a label or a color
+
+/**
+ * Compact wire format for boxes. Mirrors `box_codec.py` in the backend.
+ *
+ * Coordinates are a base64 little-endian Float32Array with
+ * `xmin, ymin, xmax, ymax` per box in image coordinates. Labels and colors
+ * are deduplicated and every box only stores Uint16 indices into them.
+ * Palette entries are RGB triplets, or strings for colors that are not RGB
+ * values (e.g. "red"). Box ids are sent as a plain list.
+ */
+export interface PackedBoxes {
+  format: "packed";
+  version: number;
+  count: number;
+  coords: string;
+  labels: string[];
+  label_ids: string;
+  palette: ([number, number, number] | string)[];
+  color_ids: string;
+  ids?: (string | null)[];
+}
+
+/**
+ * Plain box as received from the backend, before being parsed into a `Box`.
+ */
+export interface RawBox {
+  id?: string;
+  label?: string;
+  color?: string;
+  xmin: number;
+  ymin: number;
+  xmax: number;
+  ymax: number;
+}
+
+export function isPackedBoxes(boxes: unknown): boxes is PackedBoxes {
+  return (
+    boxes !== null &&
+    typeof boxes === "object" &&
+    !Array.isArray(boxes) &&
+    (boxes as PackedBoxes).format === PACKED_FORMAT
+  );
+}
+
+function bytesToBase64(bytes: Uint8Array): string {
+  // Build the binary string in chunks to avoid exceeding the argument limit
+  let binary = "";
+  const chunkSize = 0x8000;
+  for (let i = 0; i < bytes.length; i += chunkSize) {
+    binary += String.fromCharCode.apply(
+      null,
+      bytes.subarray(i, i + chunkSize) as unknown as number[]
+    );
+  }
+  return btoa(binary);
+}
+
+function base64ToBytes(data: string): Uint8Array {
+  const binary = atob(data);
+  const bytes = new Uint8Array(binary.length);
+  for (let i = 0; i < binary.length; i++) {
+    bytes[i] = binary.charCodeAt(i);
+  }
+  return bytes;
+}
+
+function parseRGB(color: string): [number, number, number] | null {
+  const rgb = color.match(/^rgba?\((\d+), ?(\d+), ?(\d+)/);
+  if (rgb) {
+    return [parseInt(rgb[1]), parseInt(rgb[2]), parseInt(rgb[3])];
+  }
+  const hex = color.match(/^#([0-9a-f]{2})([0-9a-f]{2})([0-9a-f]{2})$/i);
+  if (hex) {
+    return [parseInt(hex[1], 16), parseInt(hex[2], 16), parseInt(hex[3], 16)];
+  }
+  return null;
+}
+
+/**
+ * Pack boxes into the compact wire format.
+ * @param boxes Box[]
+ * @returns PackedBoxes
+ */
+export function packBoxes(boxes: Box[]): PackedBoxes {
+  const coords = new Float32Array(boxes.length * 4);
+  const labelIds = new Uint16Array(boxes.length);
+  const colorIds = new Uint16Array(boxes.length);
+  const labels: string[] = [];
+  const labelLookup = new Map<string, number>();
+  const palette: ([number, number, number] | string)[] = [];
+  const paletteLookup = new Map<string, number>();
+
+  boxes.forEach((box, i) => {
+    // Send image coordinates so the backend doesn't need the scale factor
+    coords[i * 4] = box.xmin / box.scaleFactor;
+    coords[i * 4 + 1] = box.ymin / box.scaleFactor;
+    coords[i * 4 + 2] = box.xmax / box.scaleFactor;
+    coords[i * 4 + 3] = box.ymax / box.scaleFactor;
+
+    let labelId = labelLookup.get(box.label);
+    if (labelId === undefined) {
+      labelId = labels.length;
+      labels.push(box.label);
+      labelLookup.set(box.label, labelId);
+    }
+    labelIds[i] = labelId;
+
+    if (!box.color) {
+      colorIds[i] = NO_INDEX;
+    } else {
+      // Colors that are not RGB values, e.g. "red", are sent as they are
+      const color = parseRGB(box.color) || box.color;
+      const key = typeof color === "string" ? color : color.join(",");
+      let colorId = paletteLookup.get(key);
+      if (colorId === undefined) {
+        colorId = palette.length;
+        palette.push(color);
+        paletteLookup.set(key, colorId);
+      }
+      colorIds[i] = colorId;
+    }
+  });
+
+  return {
+    format: PACKED_FORMAT,
+    version: PACKED_VERSION,
+    count: boxes.length,
+    coords: bytesToBase64(new Uint8Array(coords.buffer)),
+    labels: labels,
+    label_ids: bytesToBase64(new Uint8Array(labelIds.buffer)),
+    palette: palette,
+    color_ids: bytesToBase64(new Uint8Array(colorIds.buffer)),
+    ids: boxes.map((box) => box.id),
+  };
+}
+
+/**
+ * Unpack boxes sent by the backend in the compact wire format.
+ * @param packed PackedBoxes
+ * @returns RawBox[]
+ */
+export function unpackBoxes(packed: PackedBoxes): RawBox[] {
+  if (packed.version !== PACKED_VERSION) {
+    throw new Error(`Unsupported packed boxes version ${packed.version}`);
+  }
+  if (packed.count === 0) {
+    return [];
+  }
+
+  const coords = new Float32Array(base64ToBytes(packed.coords).buffer);
+  const labelIds = new Uint16Array(base64ToBytes(packed.label_ids).buffer);
+  const colorIds = new Uint16Array(base64ToBytes(packed.color_ids).buffer);
+
+  const boxes: RawBox[] = new Array(packed.count);
+  for (let i = 0; i < packed.count; i++) {
+    const box: RawBox = {
+      xmin: coords[i * 4],
+      ymin: coords[i * 4 + 1],
+      xmax: coords[i * 4 + 2],
+      ymax: coords[i * 4 + 3],
+    };
+    if (labelIds[i] !== NO_INDEX) {
+      box.label = packed.labels[labelIds[i]];
+    }
+    if (colorIds[i] !== NO_INDEX) {
+      const color = packed.palette[colorIds[i]];
+      if (typeof color === "string") {
+        box.color = color;
+      } else {
+        const [r, g, b] = color;
+        box.color = `rgb(${r}, ${g}, ${b})`;
+      }
+    }
+    if (packed.ids && packed.ids[i] !== null) {
+      box.id = packed.ids[i];
+    }
+    boxes[i] = box;
+  }
+  return boxes;
+}
+
+/**
+ * Make `boxes` serialize itself in the given wire format when the value is
+ * sent to the backend. The JSON format keeps the default `Box.toJSON`.
+ * @param boxes Box[]
+ * @param format BoxesFormat
+ * @returns Box[]
+ */
+export function withWireFormat(boxes: Box[], format: BoxesFormat): Box[] {
+  if (format === "packed") {
+    Object.defineProperty(boxes, "toJSON", {
+      value: function (this: Box[]) {
+        return packBoxes(this);
+      },
+      enumerable: false,
+      configurable: true,
+      writable: true,
+    });
+  }
+  return boxes;
+}
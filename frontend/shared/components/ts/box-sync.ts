@@ -0,0 +1,77 @@
+import Box from "./box";
+
+export type SyncMode = "full" | "delta";
+
+export interface BoxOp {
+  op: "add" | "update" | "delete";
+  id: string;
+  box?: ReturnType<Box["toJSON"]>;
+}
+
+export interface BoxDelta {
+  version: number;
+  ops: BoxOp[];
+}
+
+/**
+ * Log of box operations used by the "delta" sync mode. Mirrors `box_sync.py`
+ * in the backend.
+ *
+ * Operations are coalesced per box id and kept until the backend sets a new
+ * value, so every change sends all the boxes edited since then. Intermediate
+ * change events may be dropped by Gradio, and the backend applies the
+ * operations idempotently, so no edit is lost.
+ */
+export default class BoxOpLog {
+  private ops: Map<string, { op: BoxOp["op"]; box: Box | null }> = new Map();
+  // Versions keep increasing after a page reload
+  private version: number = Date.now();
+
+  add(box: Box): void {
+    this.ops.set(box.id, { op: "add", box: box });
+  }
+
+  update(box: Box): void {
+    const previous = this.ops.get(box.id);
+    this.ops.set(box.id, {
+      op: previous && previous.op === "add" ? "add" : "update",
+      box: box,
+    });
+  }
+
+  delete(box: Box): void {
+    this.ops.set(box.id, { op: "delete", box: null });
+  }
+
+  reset(): void {
+    this.ops.clear();
+  }
+
+  /**
+   * Serialize the pending operations with a new version number
+   * @returns BoxDelta
+   */
+  snapshot(): BoxDelta {
+    this.version += 1;
+    const ops: BoxOp[] = [];
+    for (const [id, { op, box }] of this.ops) {
+      ops.push(box === null ? { op, id } : { op, id, box: box.toJSON() });
+    }
+    return { version: this.version, ops: ops };
+  }
+}
+
+/**
+ * Make `boxes` serialize as an empty list, the operations are sent instead.
+ * @param boxes Box[]
+ * @returns Box[]
+ */
+export function omitFromWire(boxes: Box[]): Box[] {
+  Object.defineProperty(boxes, "toJSON", {
+    value: () => [],
+    enumerable: false,
+    configurable: true,
+    writable: true,
+  });
+  return boxes;
+}
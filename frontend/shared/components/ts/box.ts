@@ -15,7 +15,20 @@ function setAlpha(rgbColor: string, alpha: number) {
   return `rgba(${r}, ${g}, ${b}, ${alpha})`;
 }
 
+let boxIdCounter = 0;
+
+/**
+ * Generate an id that is unique for the lifetime of the page
+ */
+export function newBoxId(): string {
+  boxIdCounter += 1;
+  return `${Date.now().toString(36)}-${boxIdCounter.toString(36)}-${Math.random()
+    .toString(36)
+    .slice(2, 8)}`;
+}
+
 export default class Box {
+  id: string;
   label: string;
   xmin: number;
   ymin: number;
@@ -34,6 +47,8 @@ export default class Box {
   minSize: number;
   renderCallBack: () => void;
   onFinishCreation: () => void;
+  onFinishEdit: () => void;
+  editStart: [number, number, number, number];
   canvasXmin: number;
   canvasYmin: number;
   canvasXmax: number;
@@ -75,6 +90,8 @@ export default class Box {
   ) {
     this.renderCallBack = renderCallBack;
     this.onFinishCreation = onFinishCreation;
+    this.onFinishEdit = () => {};
+    this.id = newBoxId();
     this.canvasXmin = canvasXmin;
     this.canvasYmin = canvasYmin;
     this.canvasXmax = canvasXmax;
@@ -106,6 +123,7 @@ export default class Box {
 
   toJSON() {
     return {
+      id: this.id,
       label: this.label,
       xmin: this.xmin,
       ymin: this.ymin,
@@ -226,7 +244,7 @@ export default class Box {
     return [x, y];
   }
 
-  render(ctx: CanvasRenderingContext2D): void {
+  render(ctx: CanvasRenderingContext2D, showHandles: boolean = true): void {
     let xmin: number, ymin: number;
 
     // Render the box and border
@@ -253,15 +271,17 @@ export default class Box {
     ctx.closePath();
 
     // Render the handles
-    ctx.fillStyle = setAlpha(this.color, 1);
-    for (const handle of this.resizeHandles) {
-      [xmin, ymin] = this.toCanvasCoordinates(handle.xmin, handle.ymin);
-      ctx.fillRect(
-        xmin / this.scaleFactor,
-        ymin / this.scaleFactor,
-        (handle.xmax - handle.xmin) / this.scaleFactor,
-        (handle.ymax - handle.ymin) / this.scaleFactor
-      );
+    if (showHandles) {
+      ctx.fillStyle = setAlpha(this.color, 1);
+      for (const handle of this.resizeHandles) {
+        [xmin, ymin] = this.toCanvasCoordinates(handle.xmin, handle.ymin);
+        ctx.fillRect(
+          xmin / this.scaleFactor,
+          ymin / this.scaleFactor,
+          (handle.xmax - handle.xmin) / this.scaleFactor,
+          (handle.ymax - handle.ymin) / this.scaleFactor
+        );
+      }
     }
 
     // Panel to show the real width and height of the box
@@ -302,8 +322,22 @@ export default class Box {
     }
   }
 
+  /**
+   * Whether the box moved or changed its size since the drag/resize started
+   */
+  private hasChangedSinceEditStart(): boolean {
+    const [xmin, ymin, xmax, ymax] = this.editStart;
+    return (
+      xmin !== this.xmin ||
+      ymin !== this.ymin ||
+      xmax !== this.xmax ||
+      ymax !== this.ymax
+    );
+  }
+
   startDrag(event: MouseEvent): void {
     this.isDragging = true;
+    this.editStart = [this.xmin, this.ymin, this.xmax, this.ymax];
     this.offsetMouseX = event.clientX - this.xmin;
     this.offsetMouseY = event.clientY - this.ymin;
     document.addEventListener("pointermove", this.handleDrag);
@@ -314,6 +348,9 @@ export default class Box {
     this.isDragging = false;
     document.removeEventListener("pointermove", this.handleDrag);
     document.removeEventListener("pointerup", this.stopDrag);
+    if (this.hasChangedSinceEditStart()) {
+      this.onFinishEdit();
+    }
   };
 
   handleDrag = (event: MouseEvent): void => {
@@ -478,6 +515,7 @@ export default class Box {
   startResize(handleIndex: number, event: MouseEvent): void {
     this.resizingHandleIndex = handleIndex;
     this.isResizing = true;
+    this.editStart = [this.xmin, this.ymin, this.xmax, this.ymax];
     this.offsetMouseX = event.clientX - this.resizeHandles[handleIndex].xmin;
     this.offsetMouseY = event.clientY - this.resizeHandles[handleIndex].ymin;
     document.addEventListener("pointermove", this.handleResize);
@@ -550,5 +588,8 @@ export default class Box {
     this.isResizing = false;
     document.removeEventListener("pointermove", this.handleResize);
     document.removeEventListener("pointerup", this.stopResize);
+    if (this.hasChangedSinceEditStart()) {
+      this.onFinishEdit();
+    }
   };
 }
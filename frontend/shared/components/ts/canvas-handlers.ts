@@ -0,0 +1,111 @@
+import type AnnotatedImageData from "./annotated-image-data";
+import Box from "./box";
+import { withWireFormat } from "./box-codec";
+import type { BoxesFormat } from "./box-codec";
+import BoxOpLog, { omitFromWire } from "./box-sync";
+import type { SyncMode } from "./box-sync";
+import BoxGrid from "./spatial-index";
+
+/*
+ * Pointer handling of `canvas.svelte`, also driven by the benchmark harness
+ * (`frontend/bench`) so that it measures the code the component runs. Points
+ * are in canvas coordinates, like the boxes and their grid cells.
+ */
+
+export interface BoxHit {
+  box: Box;
+  index: number; // In the boxes list
+  handle: number; // Index of the resize handle, -1 inside the box
+}
+
+/**
+ * Position of a pointer event on the canvas
+ * @returns [x, y] in canvas coordinates
+ */
+export function pointerPosition(
+  canvas: HTMLCanvasElement,
+  event: { clientX: number; clientY: number }
+): [number, number] {
+  const rect = canvas.getBoundingClientRect();
+  return [event.clientX - rect.left, event.clientY - rect.top];
+}
+
+/**
+ * Topmost box under a point, checking the resize handles of the boxes first
+ * @returns BoxHit or null if there is no box there
+ */
+export function hitTest(boxIndex: BoxGrid, x: number, y: number): BoxHit | null {
+  const candidates = boxIndex.query(x, y);
+  for (const box of candidates) {
+    const handle = box.indexOfPointInsideHandle(x, y);
+    if (handle >= 0) {
+      return { box: box, index: boxIndex.indexOf(box), handle: handle };
+    }
+  }
+  for (const box of candidates) {
+    if (box.isPointInsideBox(x, y)) {
+      return { box: box, index: boxIndex.indexOf(box), handle: -1 };
+    }
+  }
+  return null;
+}
+
+/**
+ * Cursor of the canvas hovering a point in drag mode
+ * @returns the cursor, or null to keep the current one while the selected box
+ * is dragged or resized (its grid cells are only updated when it stops)
+ */
+export function hoverCursor(
+  boxIndex: BoxGrid,
+  boxes: Box[],
+  selectedBox: number,
+  x: number,
+  y: number
+): string | null {
+  if (selectedBox >= 0 && selectedBox < boxes.length) {
+    const selected = boxes[selectedBox];
+    if (selected.isDragging || selected.isResizing) {
+      return null;
+    }
+  }
+  for (const box of boxIndex.query(x, y)) {
+    const handle = box.indexOfPointInsideHandle(x, y);
+    if (handle >= 0) {
+      return box.resizeHandles[handle].cursor;
+    }
+  }
+  return "default";
+}
+
+/**
+ * Select the box at `index` of `boxes`, -1 to unselect them all
+ */
+export function setSelection(boxes: Box[], index: number): void {
+  boxes.forEach((box) => {
+    box.setSelected(false);
+  });
+  if (index >= 0 && index < boxes.length) {
+    boxes[index].setSelected(true);
+  }
+}
+
+/**
+ * Prepare a value to be sent on a change. In the "delta" sync mode, the
+ * operations logged since the last value from the backend are sent instead of
+ * the boxes, otherwise the boxes are serialized in `boxesFormat`.
+ */
+export function prepareChange(
+  value: Pick<AnnotatedImageData, "boxes" | "ops" | "version">,
+  syncMode: SyncMode,
+  boxesFormat: BoxesFormat,
+  opLog: BoxOpLog
+): void {
+  if (syncMode === "delta") {
+    const delta = opLog.snapshot();
+    value.ops = delta.ops;
+    value.version = delta.version;
+    omitFromWire(value.boxes);
+  } else {
+    withWireFormat(value.boxes, boxesFormat);
+  }
+}
@@ -1,3 +1,14 @@
 export { default as Box } from "./box";
 export { default as AnnotatedImageData } from "./annotated-image-data";
 export { default as ListAnnotatedImageData } from "./list-annotated-image-data";
+export { default as LayeredRenderer } from "./layered-renderer";
+export { default as BoxGrid } from "./spatial-index";
+export * from "./canvas-handlers";
+export {
+  default as WorkerLayeredRenderer,
+  createLayeredRenderer,
+  supportsOffscreenRendering,
+} from "./worker-renderer";
+export * from "./box-codec";
+export { default as BoxOpLog, omitFromWire } from "./box-sync";
+export type { BoxDelta, BoxOp, SyncMode } from "./box-sync";
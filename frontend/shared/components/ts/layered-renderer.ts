@@ -0,0 +1,228 @@
+import { LevelOfDetail } from "../../utils/constants";
+import Box from "./box";
+import { renderCoarseBoxes } from "./level-of-detail";
+
+/**
+ * Renders the annotator on three layers so that interacting with a box does
+ * not repaint everything:
+ *
+ * - background: the image, redrawn only when it or the canvas size changes.
+ * - static: every box except the selected one, redrawn when the boxes change.
+ * - interactive: the selected box and its handles, redrawn on every frame.
+ *
+ * The background and static layers are cached on offscreen canvases and
+ * composited onto the target canvas. Render requests are coalesced with
+ * `requestAnimationFrame`, so several updates in the same frame only paint
+ * once.
+ *
+ * Unselected boxes are drawn with less detail when they are small on screen,
+ * see `LevelOfDetail`.
+ */
+export default class LayeredRenderer {
+  protected target: HTMLCanvasElement;
+  private ctx: CanvasRenderingContext2D | null;
+  private background: HTMLCanvasElement;
+  private backgroundCtx: CanvasRenderingContext2D | null;
+  private staticLayer: HTMLCanvasElement;
+  private staticCtx: CanvasRenderingContext2D | null;
+  private backgroundDirty: boolean = true;
+  private staticDirty: boolean = true;
+  private frameRequest: number | null = null;
+
+  private image: HTMLImageElement | null = null;
+  private imageRect: [number, number, number, number] = [0, 0, 0, 0];
+  private boxes: Box[] = [];
+  private selectedBox: number = -1;
+
+  constructor(target: HTMLCanvasElement) {
+    this.target = target;
+    this.ctx = target.getContext("2d");
+    this.background = document.createElement("canvas");
+    this.backgroundCtx = this.background.getContext("2d");
+    this.staticLayer = document.createElement("canvas");
+    this.staticCtx = this.staticLayer.getContext("2d");
+  }
+
+  /**
+   * Set the image drawn on the background layer and where to draw it
+   */
+  setBackground(
+    image: HTMLImageElement | null,
+    x: number,
+    y: number,
+    width: number,
+    height: number
+  ): void {
+    const [prevX, prevY, prevWidth, prevHeight] = this.imageRect;
+    if (
+      image !== this.image ||
+      x !== prevX ||
+      y !== prevY ||
+      width !== prevWidth ||
+      height !== prevHeight
+    ) {
+      this.image = image;
+      this.imageRect = [x, y, width, height];
+      this.backgroundDirty = true;
+    }
+  }
+
+  /**
+   * Set the boxes to draw and which one is drawn on the interactive layer
+   */
+  setBoxes(boxes: Box[], selectedBox: number): void {
+    if (boxes !== this.boxes || selectedBox !== this.selectedBox) {
+      this.boxes = boxes;
+      this.selectedBox = selectedBox;
+      this.invalidateBoxes();
+    }
+  }
+
+  invalidateBackground(): void {
+    this.backgroundDirty = true;
+  }
+
+  invalidateBoxes(): void {
+    this.staticDirty = true;
+  }
+
+  /**
+   * Schedule a render on the next animation frame
+   */
+  requestRender(): void {
+    if (this.frameRequest !== null) {
+      return;
+    }
+    this.frameRequest = requestAnimationFrame(() => {
+      this.frameRequest = null;
+      this.render();
+    });
+  }
+
+  destroy(): void {
+    if (this.frameRequest !== null) {
+      cancelAnimationFrame(this.frameRequest);
+      this.frameRequest = null;
+    }
+  }
+
+  private getSelectedBox(): Box | null {
+    if (this.selectedBox >= 0 && this.selectedBox < this.boxes.length) {
+      return this.boxes[this.selectedBox];
+    }
+    return null;
+  }
+
+  private syncLayerSize(layer: HTMLCanvasElement): boolean {
+    if (
+      layer.width !== this.target.width ||
+      layer.height !== this.target.height
+    ) {
+      layer.width = this.target.width;
+      layer.height = this.target.height;
+      return true;
+    }
+    return false;
+  }
+
+  private renderBackground(): void {
+    if (!this.backgroundCtx) {
+      return;
+    }
+    const ctx = this.backgroundCtx;
+    ctx.clearRect(0, 0, this.background.width, this.background.height);
+    if (this.image !== null) {
+      const [x, y, width, height] = this.imageRect;
+      ctx.drawImage(this.image, x, y, width, height);
+    }
+  }
+
+  protected renderStatic(ctx: CanvasRenderingContext2D, boxes: Box[]): void {
+    const detailed: Box[] = [];
+    const coarse: Box[] = [];
+    for (const box of boxes) {
+      // Box coordinates are scaled to screen pixels
+      if (Math.min(box.getWidth(), box.getHeight()) < LevelOfDetail.MinBoxSize) {
+        coarse.push(box);
+      } else {
+        detailed.push(box);
+      }
+    }
+
+    if (coarse.length > 0) {
+      const rects = new Float32Array(coarse.length * 4);
+      const colors: string[] = new Array(coarse.length);
+      coarse.forEach((box, i) => {
+        const [xmin, ymin] = box.toCanvasCoordinates(box.xmin, box.ymin);
+        rects[i * 4] = xmin / box.scaleFactor;
+        rects[i * 4 + 1] = ymin / box.scaleFactor;
+        rects[i * 4 + 2] = box.getWidth() / box.scaleFactor;
+        rects[i * 4 + 3] = box.getHeight() / box.scaleFactor;
+        colors[i] = box.color;
+      });
+      renderCoarseBoxes(
+        ctx,
+        rects,
+        colors,
+        coarse.length,
+        coarse[0].thickness,
+        LevelOfDetail.DensityCellSize / coarse[0].scaleFactor
+      );
+    }
+
+    for (const box of detailed) {
+      box.render(
+        ctx,
+        Math.min(box.getWidth(), box.getHeight()) >=
+          LevelOfDetail.MinHandlesBoxSize
+      );
+    }
+  }
+
+  /**
+   * Unselected boxes in drawing order, the first box is drawn on top
+   */
+  protected getStaticBoxes(): Box[] {
+    const selected = this.getSelectedBox();
+    return this.boxes.filter((box) => box !== selected).reverse();
+  }
+
+  render(): void {
+    if (!this.ctx) {
+      return;
+    }
+
+    if (this.syncLayerSize(this.background)) {
+      this.backgroundDirty = true;
+    }
+    if (this.syncLayerSize(this.staticLayer)) {
+      this.invalidateBoxes();
+    }
+
+    if (this.backgroundDirty) {
+      this.renderBackground();
+      this.backgroundDirty = false;
+    }
+
+    if (this.staticDirty && this.staticCtx) {
+      this.staticCtx.clearRect(
+        0,
+        0,
+        this.staticLayer.width,
+        this.staticLayer.height
+      );
+      this.renderStatic(this.staticCtx, this.getStaticBoxes());
+      this.staticDirty = false;
+    }
+
+    const ctx = this.ctx;
+    ctx.clearRect(0, 0, this.target.width, this.target.height);
+    ctx.drawImage(this.background, 0, 0);
+    ctx.drawImage(this.staticLayer, 0, 0);
+
+    const selected = this.getSelectedBox();
+    if (selected !== null) {
+      selected.render(ctx);
+    }
+  }
+}
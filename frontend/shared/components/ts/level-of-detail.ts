@@ -0,0 +1,71 @@
+import { LevelOfDetail } from "../../utils/constants";
+
+type Context2D = CanvasRenderingContext2D | OffscreenCanvasRenderingContext2D;
+
+/**
+ * Draw boxes that are too small on screen to be drawn in detail.
+ *
+ * The outlines of every color are batched in a single path and stroked once,
+ * without fill, labels or handles. When there are more than
+ * `LevelOfDetail.MaxOutlines` boxes, the occupied cells of a density grid are
+ * filled instead.
+ * @param ctx Context2D
+ * @param rects Float32Array with `x, y, width, height` per box in canvas pixels
+ * @param colors string[] CSS color of each box
+ * @param count number of boxes
+ * @param thickness number outline width in canvas pixels
+ * @param cellSize number density cell size in canvas pixels
+ */
+export function renderCoarseBoxes(
+  ctx: Context2D,
+  rects: Float32Array,
+  colors: string[],
+  count: number,
+  thickness: number,
+  cellSize: number
+): void {
+  if (count === 0) {
+    return;
+  }
+
+  if (count > LevelOfDetail.MaxOutlines) {
+    const cells = new Map<string, Set<number>>();
+    for (let i = 0; i < count; i++) {
+      const cx = Math.floor((rects[i * 4] + rects[i * 4 + 2] / 2) / cellSize);
+      const cy = Math.floor((rects[i * 4 + 1] + rects[i * 4 + 3] / 2) / cellSize);
+      let colorCells = cells.get(colors[i]);
+      if (!colorCells) {
+        colorCells = new Set();
+        cells.set(colors[i], colorCells);
+      }
+      colorCells.add(cx * 0x10000 + cy);
+    }
+    for (const [color, colorCells] of cells) {
+      ctx.fillStyle = color;
+      for (const key of colorCells) {
+        ctx.fillRect(
+          Math.floor(key / 0x10000) * cellSize,
+          (key % 0x10000) * cellSize,
+          cellSize,
+          cellSize
+        );
+      }
+    }
+    return;
+  }
+
+  const paths = new Map<string, Path2D>();
+  for (let i = 0; i < count; i++) {
+    let path = paths.get(colors[i]);
+    if (!path) {
+      path = new Path2D();
+      paths.set(colors[i], path);
+    }
+    path.rect(rects[i * 4], rects[i * 4 + 1], rects[i * 4 + 2], rects[i * 4 + 3]);
+  }
+  ctx.lineWidth = thickness;
+  for (const [color, path] of paths) {
+    ctx.strokeStyle = color;
+    ctx.stroke(path);
+  }
+}
@@ -0,0 +1,108 @@
+/// <reference lib="webworker" />
+
+import { LevelOfDetail } from "../../utils/constants";
+import { renderCoarseBoxes } from "./level-of-detail";
+
+/**
+ * Web Worker that rasterizes the unselected boxes on an `OffscreenCanvas`.
+ * See `WorkerLayeredRenderer` for the main thread side.
+ *
+ * The geometry arrives as transferable typed arrays in canvas pixels:
+ * - rects: `x, y, width, height` per box
+ * - styles: `alpha, thickness, handleSize` per box
+ * - colors: `r, g, b` per box
+ *
+ * `screenScale` converts canvas pixels to screen pixels for the level of
+ * detail rules, as in `LayeredRenderer`.
+ */
+export interface OverlayJob {
+  seq: number;
+  width: number;
+  height: number;
+  count: number;
+  screenScale: number;
+  rects: Float32Array;
+  styles: Float32Array;
+  colors: Uint8Array;
+}
+
+export interface OverlayResult {
+  seq: number;
+  bitmap: ImageBitmap;
+}
+
+let canvas: OffscreenCanvas | null = null;
+let ctx: OffscreenCanvasRenderingContext2D | null = null;
+
+function renderJob(job: OverlayJob): ImageBitmap {
+  if (canvas === null || canvas.width !== job.width || canvas.height !== job.height) {
+    canvas = new OffscreenCanvas(job.width, job.height);
+    ctx = canvas.getContext("2d");
+  }
+  if (!ctx) {
+    return canvas.transferToImageBitmap();
+  }
+
+  ctx.clearRect(0, 0, job.width, job.height);
+
+  const coarseRects = new Float32Array(job.count * 4);
+  const coarseColors: string[] = [];
+  let coarseThickness = 1;
+
+  for (let i = 0; i < job.count; i++) {
+    const x = job.rects[i * 4];
+    const y = job.rects[i * 4 + 1];
+    const w = job.rects[i * 4 + 2];
+    const h = job.rects[i * 4 + 3];
+    const alpha = job.styles[i * 3];
+    const thickness = job.styles[i * 3 + 1];
+    const handleSize = job.styles[i * 3 + 2];
+    const rgb = `${job.colors[i * 3]}, ${job.colors[i * 3 + 1]}, ${job.colors[i * 3 + 2]}`;
+    const screenSize = Math.min(w, h) * job.screenScale;
+
+    if (screenSize < LevelOfDetail.MinBoxSize) {
+      coarseRects.set(job.rects.subarray(i * 4, i * 4 + 4), coarseColors.length * 4);
+      coarseColors.push(`rgb(${rgb})`);
+      coarseThickness = thickness;
+      continue;
+    }
+
+    ctx.beginPath();
+    ctx.rect(x, y, w, h);
+    ctx.fillStyle = `rgba(${rgb}, ${alpha})`;
+    ctx.fill();
+    ctx.lineWidth = thickness;
+    ctx.strokeStyle = `rgba(${rgb}, 1)`;
+    ctx.stroke();
+    ctx.closePath();
+
+    if (handleSize > 0 && screenSize >= LevelOfDetail.MinHandlesBoxSize) {
+      // Same 8 handles as `Box.updateHandles`
+      const half = handleSize / 2;
+      ctx.fillStyle = `rgba(${rgb}, 1)`;
+      for (const hx of [x, x + w / 2, x + w]) {
+        for (const hy of [y, y + h / 2, y + h]) {
+          if (hx !== x + w / 2 || hy !== y + h / 2) {
+            ctx.fillRect(hx - half, hy - half, handleSize, handleSize);
+          }
+        }
+      }
+    }
+  }
+
+  renderCoarseBoxes(
+    ctx,
+    coarseRects,
+    coarseColors,
+    coarseColors.length,
+    coarseThickness,
+    LevelOfDetail.DensityCellSize / job.screenScale
+  );
+  return canvas.transferToImageBitmap();
+}
+
+self.onmessage = (event: MessageEvent<OverlayJob>) => {
+  const bitmap = renderJob(event.data);
+  const result: OverlayResult = { seq: event.data.seq, bitmap: bitmap };
+  (self as unknown as DedicatedWorkerGlobalScope).postMessage(result, [bitmap]);
+};
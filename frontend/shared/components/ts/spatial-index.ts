@@ -0,0 +1,190 @@
+import Box from "./box";
+
+const MIN_CELL_SIZE = 16;
+const MAX_CELL_SIZE = 512;
+const MAX_CELLS_PER_BOX = 256; // Bigger boxes are kept in a separate list
+
+type CellRange = [number, number, number, number]; // [cxmin, cymin, cxmax, cymax]
+
+/**
+ * Uniform grid over the canvas extents of the boxes (including their resize
+ * handles), used to hit-test the pointer against the boxes near it instead of
+ * every box.
+ *
+ * The grid also keeps the index of each box in the boxes list, where the
+ * first box is drawn on top, so hits are ordered and mapped back to the list
+ * without scanning it. Like the list, inserting or removing a box shifts the
+ * indexes of the others.
+ */
+export default class BoxGrid {
+  private cellSize: number = 64;
+  private cells: Map<number, Set<Box>> = new Map();
+  private ranges: Map<Box, CellRange> = new Map();
+  private oversized: Set<Box> = new Set();
+  private indexes: Map<Box, number> = new Map();
+
+  /**
+   * Rebuild the grid from scratch, picking a cell size from the mean box size
+   * @param boxes Box[] the boxes list, topmost first
+   */
+  rebuild(boxes: Box[]): void {
+    this.cells.clear();
+    this.ranges.clear();
+    this.oversized.clear();
+    this.indexes.clear();
+
+    if (boxes.length > 0) {
+      let total = 0;
+      for (const box of boxes) {
+        total += Math.max(box.getWidth(), box.getHeight());
+      }
+      this.cellSize = Math.min(
+        Math.max(total / boxes.length, MIN_CELL_SIZE),
+        MAX_CELL_SIZE
+      );
+    }
+
+    boxes.forEach((box, i) => {
+      this.indexes.set(box, i);
+      this.addToCells(box);
+    });
+  }
+
+  /**
+   * Add a new box on top of the others, at the start of the boxes list
+   */
+  insert(box: Box): void {
+    for (const [other, index] of this.indexes) {
+      this.indexes.set(other, index + 1);
+    }
+    this.indexes.set(box, 0);
+    this.addToCells(box);
+  }
+
+  /**
+   * Remove a box, as it is removed from the boxes list
+   */
+  remove(box: Box): void {
+    const removed = this.indexes.get(box);
+    if (removed === undefined) {
+      return;
+    }
+    this.removeFromCells(box);
+    this.indexes.delete(box);
+    for (const [other, index] of this.indexes) {
+      if (index > removed) {
+        this.indexes.set(other, index - 1);
+      }
+    }
+  }
+
+  /**
+   * Update the cells of a box after it moved or was resized
+   */
+  update(box: Box): void {
+    if (!this.indexes.has(box)) {
+      this.insert(box);
+      return;
+    }
+    this.removeFromCells(box);
+    this.addToCells(box);
+  }
+
+  /**
+   * Index of a box in the boxes list, -1 if it is not in the grid
+   */
+  indexOf(box: Box): number {
+    const index = this.indexes.get(box);
+    return index === undefined ? -1 : index;
+  }
+
+  /**
+   * Boxes whose extent may contain the point, topmost first
+   * @param x number in canvas coordinates
+   * @param y number in canvas coordinates
+   * @returns Box[]
+   */
+  query(x: number, y: number): Box[] {
+    const cell = this.cells.get(this.key(this.toCell(x), this.toCell(y)));
+    const candidates: Box[] = cell ? Array.from(cell) : [];
+    for (const box of this.oversized) {
+      candidates.push(box);
+    }
+    candidates.sort(
+      (a, b) => (this.indexes.get(a) || 0) - (this.indexes.get(b) || 0)
+    );
+    return candidates;
+  }
+
+  private toCell(value: number): number {
+    return Math.max(Math.floor(value / this.cellSize), 0);
+  }
+
+  private key(cx: number, cy: number): number {
+    return cx * 0x10000 + cy;
+  }
+
+  private cellRange(box: Box): CellRange {
+    const halfSize = box.resizeHandleSize / 2;
+    const [xmin, ymin] = box.toCanvasCoordinates(
+      box.xmin - halfSize,
+      box.ymin - halfSize
+    );
+    const [xmax, ymax] = box.toCanvasCoordinates(
+      box.xmax + halfSize,
+      box.ymax + halfSize
+    );
+    return [
+      this.toCell(xmin),
+      this.toCell(ymin),
+      this.toCell(xmax),
+      this.toCell(ymax),
+    ];
+  }
+
+  private addToCells(box: Box): void {
+    const range = this.cellRange(box);
+    const [cxmin, cymin, cxmax, cymax] = range;
+    this.ranges.set(box, range);
+
+    if ((cxmax - cxmin + 1) * (cymax - cymin + 1) > MAX_CELLS_PER_BOX) {
+      this.oversized.add(box);
+      return;
+    }
+    for (let cx = cxmin; cx <= cxmax; cx++) {
+      for (let cy = cymin; cy <= cymax; cy++) {
+        const key = this.key(cx, cy);
+        let cell = this.cells.get(key);
+        if (!cell) {
+          cell = new Set();
+          this.cells.set(key, cell);
+        }
+        cell.add(box);
+      }
+    }
+  }
+
+  private removeFromCells(box: Box): void {
+    const range = this.ranges.get(box);
+    if (!range) {
+      return;
+    }
+    this.ranges.delete(box);
+    if (this.oversized.delete(box)) {
+      return;
+    }
+    const [cxmin, cymin, cxmax, cymax] = range;
+    for (let cx = cxmin; cx <= cxmax; cx++) {
+      for (let cy = cymin; cy <= cymax; cy++) {
+        const key = this.key(cx, cy);
+        const cell = this.cells.get(key);
+        if (cell) {
+          cell.delete(box);
+          if (cell.size === 0) {
+            this.cells.delete(key);
+          }
+        }
+      }
+    }
+  }
+}
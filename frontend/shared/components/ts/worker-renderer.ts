@@ -0,0 +1,140 @@
+import Box from "./box";
+import LayeredRenderer from "./layered-renderer";
+import type { OverlayJob, OverlayResult } from "./overlay-worker";
+
+/**
+ * Whether the browser can render the overlay in a worker
+ */
+export function supportsOffscreenRendering(): boolean {
+  return (
+    typeof OffscreenCanvas !== "undefined" &&
+    typeof Worker !== "undefined" &&
+    typeof createImageBitmap !== "undefined"
+  );
+}
+
+/**
+ * `LayeredRenderer` that rasterizes the static layer (the unselected boxes)
+ * in a Web Worker on an `OffscreenCanvas`. The main thread only packs the box
+ * geometry into transferable typed arrays and composites the returned
+ * bitmap, the selected box is still drawn on the main thread.
+ *
+ * Until the worker answers, the previous bitmap is shown.
+ */
+export default class WorkerLayeredRenderer extends LayeredRenderer {
+  private worker: Worker;
+  private seq: number = 0;
+  private needsJob: boolean = true;
+  private bitmap: ImageBitmap | null = null;
+  private colorCache: Map<string, [number, number, number]> = new Map();
+
+  constructor(target: HTMLCanvasElement) {
+    super(target);
+    this.worker = new Worker(new URL("./overlay-worker.ts", import.meta.url), {
+      type: "module",
+    });
+    this.worker.onmessage = (event: MessageEvent<OverlayResult>) => {
+      if (event.data.seq !== this.seq) {
+        // Outdated result, a newer job is on its way
+        event.data.bitmap.close();
+        return;
+      }
+      if (this.bitmap !== null) {
+        this.bitmap.close();
+      }
+      this.bitmap = event.data.bitmap;
+      super.invalidateBoxes();
+      this.requestRender();
+    };
+  }
+
+  invalidateBoxes(): void {
+    this.needsJob = true;
+    super.invalidateBoxes();
+  }
+
+  destroy(): void {
+    super.destroy();
+    this.worker.terminate();
+    if (this.bitmap !== null) {
+      this.bitmap.close();
+      this.bitmap = null;
+    }
+  }
+
+  protected renderStatic(ctx: CanvasRenderingContext2D, boxes: Box[]): void {
+    if (this.needsJob) {
+      this.needsJob = false;
+      this.postJob(boxes);
+    }
+    if (this.bitmap !== null) {
+      ctx.drawImage(this.bitmap, 0, 0);
+    }
+  }
+
+  private parseColor(color: string): [number, number, number] {
+    let rgb = this.colorCache.get(color);
+    if (rgb === undefined) {
+      const matches = color.match(/\d+/g);
+      rgb =
+        matches && matches.length >= 3
+          ? [parseInt(matches[0]), parseInt(matches[1]), parseInt(matches[2])]
+          : [50, 50, 50];
+      this.colorCache.set(color, rgb);
+    }
+    return rgb;
+  }
+
+  private postJob(boxes: Box[]): void {
+    const rects = new Float32Array(boxes.length * 4);
+    const styles = new Float32Array(boxes.length * 3);
+    const colors = new Uint8Array(boxes.length * 3);
+
+    boxes.forEach((box, i) => {
+      // Same transform as `Box.render`
+      const [xmin, ymin] = box.toCanvasCoordinates(box.xmin, box.ymin);
+      rects[i * 4] = xmin / box.scaleFactor;
+      rects[i * 4 + 1] = ymin / box.scaleFactor;
+      rects[i * 4 + 2] = box.getWidth() / box.scaleFactor;
+      rects[i * 4 + 3] = box.getHeight() / box.scaleFactor;
+      styles[i * 3] = box.alpha;
+      styles[i * 3 + 1] = box.isSelected ? box.selectedThickness : box.thickness;
+      styles[i * 3 + 2] = box.resizeHandleSize / box.scaleFactor;
+      colors.set(this.parseColor(box.color), i * 3);
+    });
+
+    this.seq += 1;
+    const job: OverlayJob = {
+      seq: this.seq,
+      width: this.target.width,
+      height: this.target.height,
+      count: boxes.length,
+      screenScale: boxes.length > 0 ? boxes[0].scaleFactor : 1,
+      rects: rects,
+      styles: styles,
+      colors: colors,
+    };
+    this.worker.postMessage(job, [rects.buffer, styles.buffer, colors.buffer]);
+  }
+}
+
+/**
+ * Create the renderer for the canvas, rendering the overlay in a worker when
+ * requested and supported.
+ * @param target HTMLCanvasElement
+ * @param offscreen boolean
+ * @returns LayeredRenderer
+ */
+export function createLayeredRenderer(
+  target: HTMLCanvasElement,
+  offscreen: boolean
+): LayeredRenderer {
+  if (offscreen && supportsOffscreenRendering()) {
+    try {
+      return new WorkerLayeredRenderer(target);
+    } catch (error) {
+      console.warn("Offscreen rendering is not available", error);
+    }
+  }
+  return new LayeredRenderer(target);
+}
@@ -10,6 +10,14 @@ export enum BoxProperty {
   ScaleFactor = 1,
 }
 
+// Level of detail of the boxes, sizes in screen pixels
+export enum LevelOfDetail {
+  MinBoxSize = 6, // Smaller boxes are drawn as plain outlines in one stroke
+  MinHandlesBoxSize = 24, // Smaller boxes are drawn without handles
+  MaxOutlines = 20000, // Above this, small boxes are drawn as density cells
+  DensityCellSize = 4,
+}
+
 export const DefaultColor = "#00FF00"; // Green
 
 export const Colors = [
@@ -0,0 +1,47 @@
+import pytest
+
+from gradio_image_annotation.box_codec import is_packed, pack_boxes, unpack_boxes
+
+
+def test_pack_round_trip():
+    boxes = [
+        {"label": "cat", "color": (255, 0, 0), "xmin": 1, "ymin": 2, "xmax": 30, "ymax": 40},
+        {"label": "dog", "color": "red", "xmin": 5, "ymin": 6, "xmax": 7, "ymax": 8},
+        {"label": "cat", "color": "#00ff00", "xmin": 0, "ymin": 0, "xmax": 10.5, "ymax": 20.25},
+        {"xmin": 100, "ymin": 200, "xmax": 300, "ymax": 400},
+    ]
+    packed = pack_boxes(boxes)
+
+    assert is_packed(packed)
+    assert packed["count"] == 4
+    assert packed["labels"] == ["cat", "dog"]
+    assert packed["palette"] == [[255, 0, 0], "red", [0, 255, 0]]
+    assert "ids" not in packed
+    assert unpack_boxes(packed) == [
+        {"label": "cat", "color": (255, 0, 0), "xmin": 1, "ymin": 2, "xmax": 30, "ymax": 40},
+        {"label": "dog", "color": "red", "xmin": 5, "ymin": 6, "xmax": 7, "ymax": 8},
+        {"label": "cat", "color": (0, 255, 0), "xmin": 0, "ymin": 0, "xmax": 10.5, "ymax": 20.25},
+        {"xmin": 100, "ymin": 200, "xmax": 300, "ymax": 400},
+    ]
+
+
+def test_pack_keeps_ids():
+    boxes = [
+        {"id": "a", "label": "1", "xmin": 0, "ymin": 0, "xmax": 1, "ymax": 1},
+        {"label": "1", "xmin": 0, "ymin": 0, "xmax": 1, "ymax": 1},
+    ]
+    unpacked = unpack_boxes(pack_boxes(boxes))
+    assert unpacked[0]["id"] == "a"
+    assert "id" not in unpacked[1]
+
+
+def test_pack_empty():
+    assert unpack_boxes(pack_boxes([])) == []
+    assert not is_packed([])
+
+
+def test_unpack_unsupported_version():
+    packed = pack_boxes([{"xmin": 0, "ymin": 0, "xmax": 1, "ymax": 1}])
+    packed["version"] = 2
+    with pytest.raises(ValueError):
+        unpack_boxes(packed)
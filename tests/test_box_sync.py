@@ -0,0 +1,81 @@
+import copy
+
+import pytest
+
+from gradio_image_annotation.box_sync import apply_box_delta, apply_box_ops
+
+
+def _box(label, x):
+    return {"label": label, "xmin": x, "ymin": 0, "xmax": x + 10, "ymax": 10}
+
+
+def _boxes():
+    return [dict(_box("a", 0), id="a"), dict(_box("b", 20), id="b")]
+
+
+def test_apply_box_ops():
+    boxes = apply_box_ops(
+        _boxes(),
+        [
+            {"op": "add", "id": "c", "box": _box("c", 40)},
+            {"op": "update", "id": "a", "box": _box("a2", 5)},
+            {"op": "delete", "id": "b"},
+        ],
+    )
+    assert boxes == [dict(_box("c", 40), id="c"), dict(_box("a2", 5), id="a")]
+
+
+def test_apply_box_ops_is_idempotent():
+    ops = [
+        {"op": "add", "id": "c", "box": _box("c", 40)},
+        {"op": "add", "id": "d", "box": _box("d", 60)},
+        {"op": "update", "id": "a", "box": _box("a2", 5)},
+        {"op": "delete", "id": "b"},
+    ]
+    once = apply_box_ops(_boxes(), copy.deepcopy(ops))
+    twice = apply_box_ops(copy.deepcopy(once), copy.deepcopy(ops))
+    assert twice == once
+    # New boxes first, the last added on top
+    assert [box["id"] for box in once] == ["d", "c", "a"]
+
+
+def test_apply_box_ops_add_then_delete():
+    boxes = apply_box_ops(
+        _boxes(),
+        [
+            {"op": "add", "id": "c", "box": _box("c", 40)},
+            {"op": "delete", "id": "c"},
+            {"op": "delete", "id": "unknown"},
+        ],
+    )
+    assert boxes == _boxes()
+
+
+def test_apply_box_ops_invalid():
+    with pytest.raises(ValueError):
+        apply_box_ops(_boxes(), [{"op": "move", "id": "a"}])
+
+
+def test_apply_box_delta_versions():
+    state = {"boxes": _boxes(), "version": 1}
+    delta = {"version": 2, "ops": [{"op": "delete", "id": "a"}]}
+
+    assert apply_box_delta(state, delta)
+    assert state["version"] == 2
+    assert [box["id"] for box in state["boxes"]] == ["b"]
+
+    # Replayed and older deltas are ignored
+    assert not apply_box_delta(state, delta)
+    assert not apply_box_delta(
+        state, {"version": 1, "ops": [{"op": "delete", "id": "b"}]}
+    )
+    assert [box["id"] for box in state["boxes"]] == ["b"]
+    assert state["version"] == 2
+
+
+def test_apply_box_delta_without_boxes():
+    state = {}
+    assert apply_box_delta(
+        state, {"version": 1, "ops": [{"op": "add", "id": "a", "box": _box("a", 0)}]}
+    )
+    assert state == {"boxes": [dict(_box("a", 0), id="a")], "version": 1}
@@ -0,0 +1,113 @@
+import cv2
+import numpy as np
+
+from gradio_image_annotation.matching import MatchEngine, MatchState
+from gradio_image_annotation.template_matcher import TemplateMatcher
+
+
+def test_buffer_reuse():
+    engine = MatchEngine()
+    large = engine.buffer("image", (100, 100))
+    small = engine.buffer("image", (10, 20), np.float32)
+
+    assert small.shape == (10, 20) and small.dtype == np.float32
+    assert np.shares_memory(large, small)
+    assert engine.buffer_bytes == 100 * 100
+
+    # Grown for a larger size, then reused again
+    larger = engine.buffer("image", (200, 100))
+    assert not np.shares_memory(large, larger)
+    assert np.shares_memory(larger, engine.buffer("image", (100, 100)))
+    assert engine.buffer_bytes == 200 * 100
+
+
+def test_trim_buffers():
+    engine = MatchEngine()
+    engine.buffer("image", (100, 100))
+    engine.buffer("result", (10, 10))
+
+    engine.trim_buffers(1000)
+    assert engine.buffer_bytes == 100
+    engine.trim_buffers(0)
+    assert engine.buffer_bytes == 0
+
+
+def test_preprocess_leaves_image_alone():
+    engine = MatchEngine()
+    image = np.random.RandomState(0).randint(0, 255, (50, 60, 3), np.uint8)
+    copy = image.copy()
+    processed = engine.preprocess(image)
+    assert processed.shape == (50, 60)
+    assert np.array_equal(image, copy)
+    assert np.shares_memory(processed, engine.preprocess(image[:40, :40]))
+
+
+def test_match_state_keeps_hits_in_order(tmp_path):
+    path = str(tmp_path / "state" / MatchState.FILE_NAME)
+    state = MatchState(path, {"image": 1})
+    state.add(MatchState.key("a", "h1"), "a", [(0, 0, 10, 10)])
+    state.add(MatchState.key("b", "h2"), "b", [(20, 0, 10, 10)])
+    state.save()
+
+    state = MatchState(path, {"image": 1})
+    keys = [MatchState.key("a", "h1"), MatchState.key("b", "h2")]
+    assert state.found_labels(keys, ["a", "b"]) == {
+        "a": [(0, 0, 10, 10)],
+        "b": [(20, 0, 10, 10)],
+    }
+    # Another signature starts from scratch
+    assert MatchState(path, {"image": 2}).hits == {}
+
+
+def test_match_state_removed_template(tmp_path):
+    state = MatchState(str(tmp_path / MatchState.FILE_NAME), {})
+    state.add(MatchState.key("a", "h1"), "a", [(0, 0, 10, 10)])
+    state.add(MatchState.key("b", "h2"), "b", [(20, 0, 10, 10)])
+
+    # "b" may now find the rects "a" suppressed, so it is matched again
+    assert state.found_labels([MatchState.key("b", "h2")], ["b"]) == {}
+    assert state.hits == {}
+
+
+def test_match_state_relabeled_template(tmp_path):
+    state = MatchState(str(tmp_path / MatchState.FILE_NAME), {})
+    state.add(MatchState.key("a", "h1"), "a", [(0, 0, 10, 10)])
+    state.add(MatchState.key("b", "h2"), "b", [(20, 0, 10, 10)])
+
+    keys = [MatchState.key("c", "h1"), MatchState.key("b", "h2")]
+    assert state.found_labels(keys, ["c", "b"]) == {}
+    # A label that is gone stops the kept hits too
+    state.add(MatchState.key("a", "h1"), "a", [(0, 0, 10, 10)])
+    assert state.found_labels([MatchState.key("a", "h1")], ["c"]) == {}
+
+
+def test_template_matcher_relabel(tmp_path):
+    image = np.random.RandomState(0).randint(0, 255, (200, 200, 3), np.uint8)
+    image_path = str(tmp_path / "image.png")
+    cv2.imwrite(image_path, image)
+    matcher = TemplateMatcher(str(tmp_path / "templates"), str(tmp_path / "results"))
+
+    found_labels = matcher.match(
+        image_path, [{"label": "1", "rect": [10, 10, 30, 30]}], "image"
+    )[3]
+    assert list(found_labels) == ["1"]
+    assert found_labels["1"]["rects"]
+
+    # Same crop, new label: matched again under the new label
+    found_labels = matcher.match(
+        image_path, [{"label": "2", "rect": [10, 10, 30, 30]}], "image"
+    )[3]
+    assert list(found_labels) == ["2"]
+    assert found_labels["2"]["rects"]
+
+    # Both labels on the same crop: the second one is suppressed by the first
+    found_labels = matcher.match(
+        image_path,
+        [
+            {"label": "1", "rect": [10, 10, 30, 30]},
+            {"label": "2", "rect": [10, 10, 30, 30]},
+        ],
+        "image",
+    )[3]
+    assert found_labels["1"]["rects"]
+    assert not found_labels.get("2", {}).get("rects")
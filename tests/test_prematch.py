@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+
+from gradio_image_annotation.prematch import PrematchQueue
+from gradio_image_annotation.template_matcher import MatchParams
+
+FOUND_LABELS = {"1": {"color": [255, 0, 0], "rects": [[10, 20, 30, 40]]}}
+
+
+class _BlockedMatcher:
+    """
+    Stands in for a `TemplateMatcher`, its runs wait for `release`.
+    """
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = []
+
+    def match(self, image_path, rectangles, image_name, params, folders=None):
+        self.calls.append(image_name)
+        self.started.set()
+        assert self.release.wait(5)
+        return "image.png", "image.json", "image.png", FOUND_LABELS, 1
+
+
+def _submit(queue, names):
+    entries = {name: {"file_path": f"{name}.png"} for name in names}
+    for name, image_data in entries.items():
+        queue.submit(name, image_data, [], MatchParams(), ["library"])
+    return entries
+
+
+def test_prematch_applies_results():
+    matcher = _BlockedMatcher()
+    matcher.release.set()
+    queue = PrematchQueue(matcher)
+    entries = _submit(queue, ["a"])
+
+    result = queue.result(entries["a"], [], MatchParams(), ["library"])
+    assert result[3] == FOUND_LABELS
+    assert entries["a"]["boxes"] == [
+        {"label": "1", "color": [255, 0, 0], "xmin": 10, "ymin": 20, "xmax": 40, "ymax": 60}
+    ]
+    queue.shutdown()
+
+
+def test_prematch_other_request():
+    matcher = _BlockedMatcher()
+    queue = PrematchQueue(matcher)
+    entries = _submit(queue, ["a", "b"])
+    assert matcher.started.wait(5)
+
+    # Not made for these folders: the queued job is cancelled
+    assert queue.result(entries["b"], [], MatchParams(), ["other"]) is None
+    matcher.release.set()
+    queue.shutdown()
+    assert "prematch" not in entries["b"]
+    assert matcher.calls == ["a"]
+
+
+def test_shutdown_cancels_queued_jobs():
+    matcher = _BlockedMatcher()
+    queue = PrematchQueue(matcher)
+    entries = _submit(queue, ["a", "b", "c"])
+    assert matcher.started.wait(5)
+
+    queue.shutdown()
+    futures = {
+        name: image_data["prematch"]["future"] for name, image_data in entries.items()
+    }
+    assert futures["b"].cancelled() and futures["c"].cancelled()
+    assert not futures["a"].cancelled()
+
+    # The running job still completes
+    matcher.release.set()
+    assert futures["a"].result(5)[3] == FOUND_LABELS
+    assert matcher.calls == ["a"]
+    assert "boxes" not in entries["b"]
+
+
+def test_invalid_workers():
+    with pytest.raises(ValueError):
+        PrematchQueue(_BlockedMatcher(), workers=0)
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from gradio_image_annotation.sequence import SequenceMatcher
+from gradio_image_annotation.template_matcher import MatchParams
+
+RANDOM = np.random.RandomState(0)
+BACKGROUND = RANDOM.randint(100, 130, (200, 200, 3), np.uint8)
+OBJECT = RANDOM.randint(0, 255, (20, 20, 3), np.uint8)
+
+
+def _frame(x: int | None, y: int = 80) -> np.ndarray:
+    frame = BACKGROUND.copy()
+    if x is not None:
+        frame[y : y + 20, x : x + 20] = OBJECT
+    return frame
+
+
+def _run(positions, **kwargs):
+    sequence = SequenceMatcher(
+        [("object", OBJECT)], MatchParams(selected_angle=0), **kwargs
+    )
+    frames = [(str(i), None, _frame(x)) for i, x in enumerate(positions)]
+    return list(sequence.run(frames))
+
+
+def _rects(frame):
+    return frame["found_labels"].get("object", {}).get("rects", [])
+
+
+def test_tracks_between_keyframes():
+    results = _run([50, 53, 56], rescan_every=10)
+    assert [frame["keyframe"] for frame in results] == [True, False, False]
+    assert [[rect[0] for rect in _rects(frame)] for frame in results] == [[50], [53], [56]]
+
+
+def test_searches_again_after_a_miss():
+    # Hidden in the second frame, and found again around where it was last seen
+    results = _run([50, None, 56], rescan_every=10)
+    assert len(_rects(results[0])) == 1
+    assert _rects(results[1]) == []
+    assert [rect[0] for rect in _rects(results[2])] == [56]
+    assert not results[2]["keyframe"]
+
+
+def test_window_grows_with_misses():
+    # Out of the window of a single missed frame, not of two
+    positions = [50, None, None, 64]
+    assert _rects(_run(positions, rescan_every=10, margin=0.25)[3]) != []
+    assert _rects(_run([50, None, 64], rescan_every=10, margin=0.25)[2]) == []
+
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError):
+        SequenceMatcher([("object", OBJECT)], rescan_every=0)
+    with pytest.raises(ValueError):
+        SequenceMatcher([("object", OBJECT)], margin=-1)